@@ -0,0 +1,90 @@
+import functools
+import inspect
+import os
+
+from fastapi.routing import APIRoute
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .database import DATABASE_READ_URL, DATABASE_URL, configure, engine_options, get_read_db
+
+# Async request path, enabled with ASYNC_DB=1. Endpoints keep a single (sync) implementation:
+# each one runs through AsyncSession.run_sync, i.e. in a greenlet on the event loop, with the
+# async driver (psycopg async or aiosqlite) doing the I/O. Endpoints that are already async get
+# an AsyncSession from get_db and call their sync helpers through database.run_db. Requests no
+# longer hold a threadpool slot while they wait on the database, and behaviour is identical to the
+# sync path by construction. A greenlet holds the event loop while it runs Python code, so the
+# CPU-heavy steps (compiling a source, building and diffing plans, validating rule imports) go
+# through database.offload, which runs them in the threadpool.
+
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+psycopg"}
+
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.drivername}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def make_engine(url: str, name: str):
+    # aiosqlite would otherwise default to NullPool, opening a connection per request
+    options = engine_options(url, name, AsyncAdaptedQueuePool)
+    engine = create_async_engine(url, **options)
+    configure(engine.sync_engine, name)
+    return engine
+
+
+DATABASE_ASYNC_URL = os.getenv("DATABASE_ASYNC_URL") or async_url(DATABASE_URL)
+DATABASE_ASYNC_READ_URL = os.getenv("DATABASE_ASYNC_READ_URL") or (
+    async_url(DATABASE_READ_URL) if DATABASE_READ_URL else None
+)
+
+async_engine = make_engine(DATABASE_ASYNC_URL, "primary_async")
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+async_read_engine = (
+    make_engine(DATABASE_ASYNC_READ_URL, "replica_async") if DATABASE_ASYNC_READ_URL else async_engine
+)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+async def dispose():
+    # Close pooled connections on shutdown (aiosqlite runs one non-daemon thread per connection)
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+
+
+def _asyncify(endpoint):
+    sig = inspect.signature(endpoint)
+    db_param = sig.parameters["db"].default
+    reads = getattr(db_param, "dependency", None) is get_read_db
+    session_factory = AsyncReadSessionLocal if reads else AsyncSessionLocal
+
+    @functools.wraps(endpoint)
+    async def wrapper(**kwargs):
+        async with session_factory() as db:
+            return await db.run_sync(lambda session: endpoint(db=session, **kwargs))
+
+    wrapper.__signature__ = sig.replace(parameters=[p for p in sig.parameters.values() if p.name != "db"])
+    return wrapper
+
+
+class AsyncDbRoute(APIRoute):
+    # Sync endpoints taking a `db` session become coroutines running on an AsyncSession
+    def __init__(self, path, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint) and "db" in inspect.signature(endpoint).parameters:
+            endpoint = _asyncify(endpoint)
+        super().__init__(path, endpoint, **kwargs)
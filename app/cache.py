@@ -0,0 +1,55 @@
+import os
+import threading
+from collections import OrderedDict
+
+from . import singleflight
+
+RESOLVER_CACHE_SIZE = int(os.getenv("RESOLVER_CACHE_SIZE", "1024"))
+
+
+class SourceCache:
+    # LRU of compiled per-source state, validated against an in-process revision.
+    # Writers bump the revision after commit; a loader captures the revision before reading,
+    # so a value built from data older than the latest bump is never served.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[tuple, object]] = OrderedDict()
+        self._revisions: dict[int, int] = {}
+        # Bumped by writes that can affect any source (policies, connections, warehouses)
+        self._generation = 0
+
+    def revision(self, source_id: int) -> tuple[int, int]:
+        return (self._generation, self._revisions.get(source_id, 0))
+
+    def get(self, source_id: int, load, version=None):
+        # `version` optionally pins the entry to an external revision as well (e.g. the config
+        # revision read from the database the value is loaded from)
+        revision = (*self.revision(source_id), version)
+        with self._lock:
+            entry = self._entries.get(source_id)
+            if entry is not None and entry[0] == revision:
+                self._entries.move_to_end(source_id)
+                return entry[1]
+        # Concurrent misses for the same source and revision load it once
+        value = singleflight.group.do(("compile", source_id, revision), load)
+        if value is not None and self.maxsize > 0:
+            with self._lock:
+                self._entries[source_id] = (revision, value)
+                self._entries.move_to_end(source_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def bump(self, source_id: int):
+        with self._lock:
+            self._revisions[source_id] = self._revisions.get(source_id, 0) + 1
+            self._entries.pop(source_id, None)
+
+    def bump_all(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+sources = SourceCache(RESOLVER_CACHE_SIZE)
@@ -0,0 +1,162 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import coherence, history, models, revisions
+
+# Global change feed. Every config write records one change under the next global revision,
+# with the sources it affects, in the same transaction as the write (see record). Readers ask
+# for everything after a revision they have seen, optionally waiting for the next change.
+
+# While requests are waiting, each worker checks the latest revision this often, to see writes
+# made by other workers or instances; writes in the same worker wake waiters immediately.
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "1"))
+MAX_WAIT = 60
+HEARTBEAT_INTERVAL = 15
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _next_revision(db: Session) -> int:
+    t = models.ChangeCounter.__table__
+    insert = _UPSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        stmt = insert(t).values(id=1, revision=1)
+        stmt = stmt.on_conflict_do_update(index_elements=[t.c.id], set_={"revision": t.c.revision + 1})
+        return db.execute(stmt.returning(t.c.revision)).scalar_one()
+    if not db.execute(t.update().where(t.c.id == 1).values(revision=t.c.revision + 1)).rowcount:
+        db.execute(t.insert().values(id=1, revision=1))
+    return db.execute(select(t.c.revision).where(t.c.id == 1)).scalar_one()
+
+
+def record(db: Session, entity: str, entity_id: int | None, op: str, source_ids=(), exported=True) -> int:
+    # Call before commit. Also bumps the config revision (ETag) of every affected source, and
+    # unless `exported` is False (the write cannot change their export documents) logs the new
+    # state in their history.
+    ids = sorted(set(source_ids))
+    revisions.bump(db, ids)
+    revision = _next_revision(db)
+    db.execute(models.Change.__table__.insert().values(
+        revision=revision, entity=entity, entity_id=entity_id, op=op, changed_at=datetime.now(timezone.utc)
+    ))
+    if ids:
+        db.execute(models.ChangeSource.__table__.insert(), [{"revision": revision, "source_id": i} for i in ids])
+        db.info.setdefault("changed_sources", set()).update(ids)
+        coherence.announce(db, revision, ids)
+        if exported:
+            history.record(db, revision, entity, entity_id, op, ids)
+    db.info["changes_recorded"] = True
+    return revision
+
+
+def latest_revision(db: Session) -> int:
+    return db.scalar(select(models.ChangeCounter.revision).where(models.ChangeCounter.id == 1)) or 0
+
+
+def since(db: Session, revision: int, limit: int) -> dict:
+    # Changes after `revision`, oldest first, at most `limit` of them
+    rows = db.execute(
+        select(models.Change).where(models.Change.revision > revision).order_by(models.Change.revision).limit(limit + 1)
+    ).scalars().all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    affected: dict[int, list[int]] = {}
+    if rows:
+        cs = models.ChangeSource
+        for rev, source_id in db.execute(
+            select(cs.revision, cs.source_id)
+            .where(cs.revision > revision, cs.revision <= rows[-1].revision)
+            .order_by(cs.revision, cs.source_id)
+        ):
+            affected.setdefault(rev, []).append(source_id)
+    # Ends the read transaction so that a later call sees newer commits
+    db.rollback()
+    return {
+        "since": revision,
+        "revision": rows[-1].revision if rows else revision,
+        "changes": [
+            {
+                "revision": r.revision,
+                "entity": r.entity,
+                "id": r.entity_id,
+                "op": r.op,
+                "changed_at": r.changed_at,
+                "source_ids": affected.get(r.revision, []),
+            }
+            for r in rows
+        ],
+        "sources": sorted({s for ids in affected.values() for s in ids}),
+        "more": more,
+    }
+
+
+class Feed:
+    # Lets requests wait for the next change without a query per waiter: writes in this process
+    # wake waiters directly, and one poller per process watches for writes made elsewhere.
+    def __init__(self, read_latest):
+        self._read_latest = read_latest
+        self._loop = None
+        self._event = None
+        self._poller = None
+        # revision -> number of requests waiting for a change after it
+        self._waiting: dict[int, int] = {}
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._event, self._poller = loop, asyncio.Event(), None
+
+    def _fire(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def notify(self):
+        # Any thread: a write was committed in this process
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fire)
+
+    async def wait(self, revision: int, timeout: float) -> bool:
+        # Returns True once a change after `revision` may exist, False after `timeout` seconds
+        self._bind()
+        event = self._event
+        self._waiting[revision] = self._waiting.get(revision, 0) + 1
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiting[revision] -= 1
+            if not self._waiting[revision]:
+                del self._waiting[revision]
+
+    async def _poll(self):
+        while self._waiting:
+            await asyncio.sleep(CHANGES_POLL_INTERVAL)
+            if not self._waiting:
+                break
+            latest = await run_in_threadpool(self._read_latest)
+            if self._waiting and latest > min(self._waiting):
+                self._fire()
+
+
+def _read_latest() -> int:
+    from .database import ReadSessionLocal
+    with ReadSessionLocal() as db:
+        return latest_revision(db)
+
+
+feed = Feed(_read_latest)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("changes_recorded", False):
+        feed.notify()
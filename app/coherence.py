@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from . import revisions
+
+# Keeps the per-worker caches coherent when several workers (or instances) serve the same
+# database. Every write bumps config_revisions for the sources it affects, in its own transaction
+# (changes.record), and everything cached per source (cache.sources, the compiled resolver and
+# export) is keyed by that revision. Readers get the revision from validators(); CACHE_COHERENCE:
+#   revision  (default) one indexed read of config_revisions per request; a write is visible to
+#             the next request on any worker
+#   notify    PostgreSQL only: writes also NOTIFY config_changes with the sources they touched,
+#             a listener thread per worker evicts them from an in-process copy of the validators,
+#             and a request for a source whose validators are held makes no query at all. Another
+#             worker sees a write once the notification arrives (normally within milliseconds of
+#             the commit); the worker that made the write sees it at once. While the listener is
+#             disconnected every request reads config_revisions, as in revision mode.
+
+CACHE_COHERENCE = os.getenv("CACHE_COHERENCE", "revision")
+if CACHE_COHERENCE not in ("revision", "notify"):
+    raise ValueError(f"CACHE_COHERENCE must be revision or notify, not {CACHE_COHERENCE!r}")
+CHANNEL = "config_changes"
+# NOTIFY payloads are limited to 8000 bytes; larger changes announce "*" (evict everything)
+MAX_PAYLOAD_IDS = 500
+RECONNECT_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class ValidatorCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[int, revisions.Validators] = {}
+        # Bumped by every eviction, so a read that raced with one is not stored
+        self._evictions = 0
+        self.listening = False
+
+    def get(self, db: Session, source_id: int) -> revisions.Validators | None:
+        if not self.listening:
+            return revisions.validators(db, source_id)
+        current = self._entries.get(source_id)
+        if current is not None:
+            return current
+        evictions = self._evictions
+        current = revisions.validators(db, source_id)
+        if current is not None:
+            with self._lock:
+                if self.listening and evictions == self._evictions:
+                    self._entries[source_id] = current
+        return current
+
+    def evict(self, source_ids=None):
+        # None: everything
+        with self._lock:
+            self._evictions += 1
+            if source_ids is None:
+                self._entries.clear()
+            else:
+                for i in source_ids:
+                    self._entries.pop(i, None)
+
+    def set_listening(self, listening: bool):
+        with self._lock:
+            self._evictions += 1
+            self._entries.clear()
+            self.listening = listening
+
+
+validator_cache = ValidatorCache()
+
+
+def validators(db: Session, source_id: int) -> revisions.Validators | None:
+    # The source's current ETag/Last-Modified (see revisions.validators); None if it does not exist
+    return validator_cache.get(db, source_id)
+
+
+def announce(db: Session, revision: int, source_ids):
+    # Called by changes.record; NOTIFY is delivered at commit, and dropped with a rollback
+    if CACHE_COHERENCE != "notify" or db.get_bind().dialect.name != "postgresql":
+        return
+    ids = sorted(set(source_ids))
+    if not ids:
+        return
+    payload = "*" if len(ids) > MAX_PAYLOAD_IDS else ",".join(map(str, ids))
+    db.execute(select(func.pg_notify(CHANNEL, f"{revision}:{payload}")))
+
+
+def _apply(payload: str):
+    _, _, ids = payload.partition(":")
+    validator_cache.evict(None if ids == "*" else [int(i) for i in ids.split(",") if i])
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # The writing worker drops its own copies at once instead of waiting for its notification
+    ids = session.info.pop("changed_sources", None)
+    if ids:
+        validator_cache.evict(ids)
+
+
+class Listener:
+    def __init__(self, url: str, on_change=None):
+        self._conninfo = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._on_change = on_change
+        self._stop = threading.Event()
+        self._conn = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="coherence-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        conn = self._conn
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        import psycopg
+
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self._conninfo, autocommit=True) as conn:
+                    self._conn = conn
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    # Anything committed before LISTEN was missed: start from an empty cache
+                    validator_cache.set_listening(True)
+                    for notify in conn.notifies():
+                        _apply(notify.payload)
+                        if self._on_change is not None:
+                            self._on_change()
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.warning("%s listener disconnected: %s", CHANNEL, e)
+            finally:
+                self._conn = None
+                validator_cache.set_listening(False)
+            self._stop.wait(RECONNECT_DELAY)
+
+
+def start(url: str, read_url: str | None, on_change=None) -> Listener | None:
+    # Starts this worker's listener in notify mode; returns None (revision mode) otherwise
+    if CACHE_COHERENCE != "notify":
+        return None
+    if make_url(url).get_backend_name() != "postgresql":
+        logger.warning("CACHE_COHERENCE=notify needs PostgreSQL; using revision mode")
+        return None
+    if read_url:
+        # A lagging replica could refill the cache with validators older than a notification
+        logger.warning("CACHE_COHERENCE=notify is not used with DATABASE_READ_URL; using revision mode")
+        return None
+    listener = Listener(url, on_change)
+    listener.start()
+    return listener
@@ -0,0 +1,156 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Optional response compression, negotiated from Accept-Encoding: zstd (when the zstandard
+# package is installed) or gzip, whichever the client weights higher, zstd on a tie. JSON, NDJSON
+# and CSV bodies of at least COMPRESSION_MIN_SIZE bytes are compressed; streamed bodies are
+# compressed incrementally, so exports stay streams. Event streams, responses that already carry
+# a Content-Encoding and 204/304 responses are passed through. When the client accepts a coding,
+# the ETag of a compressible response gets the coding appended ("1-3-v3" -> "1-3-v3-gzip"), even
+# under COMPRESSION_MIN_SIZE, so that each encoding has its own strong validator. A 304 carries no
+# Content-Type, so it is tagged when the client's If-None-Match holds the tagged form, i.e. when
+# the 200 it revalidates was tagged; revisions.not_modified accepts either form.
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "0") == "1"
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+CODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/csv")
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    # The coding to use for a request's Accept-Encoding, or None for identity
+    weights = {}
+    for item in (accept_encoding or "").lower().split(","):
+        coding, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip()] = q
+    best = None
+    for coding in CODINGS:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > 0 and (best is None or q > best[0]):
+            best = q, coding
+    return None if best is None else best[1]
+
+
+def strip_coding(etag: str) -> str:
+    # '"1-3-v3-gzip"' -> '"1-3-v3"'
+    for coding in CODINGS:
+        suffix = f'-{coding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def _tagged(etag: bytes, coding: str) -> bytes:
+    return etag[:-1] + b"-" + coding.encode() + b'"' if etag.endswith(b'"') else etag
+
+
+def _tag_etag(headers, coding: str) -> list:
+    return [(k, _tagged(v, coding)) if k.lower() == b"etag" else (k, v) for k, v in headers]
+
+
+class _Compressor:
+    def __init__(self, coding: str):
+        if coding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+def _header(headers, name: bytes) -> bytes | None:
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope["headers"], b"accept-encoding")
+        coding = negotiate(accept.decode("latin-1") if accept else None)
+        if_none_match = _header(scope["headers"], b"if-none-match") or b""
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether the body is worth compressing
+                start = message
+                return
+            if message["type"] == "http.response.pathsend" and start is not None:
+                # A file the server sends itself (see snapshot.SendfileResponse): left uncompressed
+                await send(start)
+                start = None
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.compress(body)
+                if not more:
+                    data += compressor.finish()
+                if data or not more:
+                    await send({**message, "body": data})
+                return
+
+            headers = list(start.get("headers", []))
+            media_type = (_header(headers, b"content-type") or b"").split(b";")[0].strip().decode("latin-1")
+            compressible = media_type in COMPRESSIBLE and _header(headers, b"content-encoding") is None
+            if compressible:
+                headers.append((b"vary", b"Accept-Encoding"))
+            if coding is not None:
+                if start["status"] == 304:
+                    etag = _header(headers, b"etag")
+                    if etag is not None and _tagged(etag, coding) in if_none_match:
+                        headers = _tag_etag(headers, coding)
+                elif compressible:
+                    headers = _tag_etag(headers, coding)
+            if (
+                not compressible or coding is None or start["status"] in (204, 304)
+                or not more and len(body) < MIN_SIZE
+            ):
+                await send({**start, "headers": headers})
+                start = None
+                await send(message)
+                return
+
+            compressor = _Compressor(coding)
+            data = compressor.compress(body)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers.append((b"content-encoding", coding.encode()))
+            if not more:
+                data += compressor.finish()
+                headers.append((b"content-length", str(len(data)).encode()))
+            await send({**start, "headers": headers})
+            await send({**message, "body": data})
+
+        await self.app(scope, receive, send_wrapper)
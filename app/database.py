@@ -1,15 +1,90 @@
 import os
 
-from sqlalchemy import create_engine
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+from . import metrics, migrations, profiling, query_budget
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+# Optional replica for read-only endpoints; writes always go to DATABASE_URL
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+# Set to 0 to run schema migrations only through `python -m app.migrations upgrade`
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+# Opt-in async request path (see app/aio.py); the sync engine is still used for startup tasks
+ASYNC_DB = os.getenv("ASYNC_DB", "0") == "1"
+
+# Connection pool, per engine and per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Defaults to on for network databases, off for SQLite
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING")
+
+# SQLite connection pragmas
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+def connect_args(url: str) -> dict:
+    return {"check_same_thread": False} if is_sqlite(url) else {}
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+def engine_options(url: str, name: str, queue_pool=QueuePool) -> dict:
+    # `name` labels the pool's metrics; async engines pass AsyncAdaptedQueuePool as `queue_pool`
+    parsed = make_url(url)
+    sqlite = parsed.get_backend_name() == "sqlite"
+    pre_ping = DB_POOL_PRE_PING == "1" if DB_POOL_PRE_PING is not None else not sqlite
+    options = {"connect_args": connect_args(url), "pool_pre_ping": pre_ping}
+    if sqlite and parsed.database in (None, "", ":memory:"):
+        # In-memory databases live in a single connection; keep SQLAlchemy's default pool
+        options["poolclass"] = metrics.timed_pool(parsed.get_dialect().get_pool_class(parsed), name)
+        return options
+    options.update(
+        poolclass=metrics.timed_pool(queue_pool, name),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if SQLITE_WAL:
+        # Readers no longer block the writer (and vice versa); NORMAL is durable in WAL mode
+        # except for the last transactions before a power loss
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    # Wait for the write lock instead of failing with "database is locked"
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def configure(sync_engine, name: str):
+    # `name` labels the engine's pool and query metrics
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _sqlite_pragmas)
+    metrics.instrument_engine(sync_engine, name)
+    query_budget.instrument_engine(sync_engine)
+    profiling.instrument_engine(sync_engine)
+    return sync_engine
+
+engine = configure(create_engine(DATABASE_URL, **engine_options(DATABASE_URL, "primary")), "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+read_engine = (
+    configure(create_engine(DATABASE_READ_URL, **engine_options(DATABASE_READ_URL, "replica")), "replica")
+    if DATABASE_READ_URL else engine
+)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 class Base(DeclarativeBase):
     pass
 
@@ -20,5 +95,32 @@ def get_db():
     finally:
         db.close()
 
-def init_db(BaseModel):
+def get_read_db():
+    # Read-only endpoints; served by DATABASE_READ_URL when one is configured
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def run_db(db, fn, *args):
+    # Run fn(session, *args) from an async endpoint: in the threadpool for a sync Session, or
+    # through run_sync for the AsyncSession that get_db is overridden to yield in async mode
+    if profiling.PROFILING:
+        fn = profiling.marked(fn)
+    if hasattr(db, "run_sync"):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
+
+def offload(fn, *args):
+    # Run fn(*args): pure Python work (compiling, resolving, diffing) on objects already loaded,
+    # which must not use a session. On the threadpool path it runs where it is called. With
+    # ASYNC_DB, sync endpoints and run_db calls run in a greenlet on the event loop, so fn goes
+    # to the threadpool instead and the loop keeps serving other requests meanwhile.
+    if in_greenlet():
+        return await_only(run_in_threadpool(fn, *args))
+    return fn(*args)
+
+def init_db(BaseModel, migrate=MIGRATE_ON_STARTUP):
     BaseModel.metadata.create_all(bind=engine)
+    return migrations.upgrade(engine) if migrate else []
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session, aliased, joinedload
+from . import models, resolution
+
+# Point-in-time config history. Every write that changes a source's export state appends one
+# delta per affected source to config_log, under the write's change revision and in the same
+# transaction (changes.record):
+#   {"source": {...}}            export header replaced (name, env, referenced names, hold default)
+#   {"rules": {"<id>": [...]}}   rule added or changed ([type, schema, table, policy_id,
+#                                legal_hold]), or deleted (null)
+#   {"state": null}              source deleted
+#   {"snapshot": true}           full state written to config_snapshots instead (source created,
+#                                rules imported)
+# A source is also snapshotted once SNAPSHOT_EVERY deltas have accumulated since its last
+# snapshot, so its state at any revision is the nearest earlier snapshot plus fewer than
+# SNAPSHOT_EVERY deltas: two indexed range reads, however long the history grows. Sources that
+# predate the log (or were written without changes.record, like bench.datagen's) get their first
+# snapshot from migration 3 or
+#   python -m app.history backfill
+# and have no history before it.
+
+SNAPSHOT_EVERY = int(os.getenv("CONFIG_SNAPSHOT_EVERY", "50"))
+
+
+class StateRule(NamedTuple):
+    type: str
+    schema: str
+    table: str | None
+    policy_id: int | None
+    legal_hold: bool | None
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"))
+
+
+DELETED = _dumps({"state": None})
+
+
+def _rule(r) -> list:
+    return [r.type, r.schema, r.table, r.policy_id, r.legal_hold]
+
+
+def headers(db: Session, source_ids) -> dict[int, dict]:
+    # Current export header of each given source that exists
+    sources = db.scalars(
+        select(models.Source)
+        .options(
+            joinedload(models.Source.connection),
+            joinedload(models.Source.warehouse),
+            joinedload(models.Source.default_policy),
+        )
+        .where(models.Source.id.in_(list(source_ids)))
+        # Relationships loaded before a write changed the foreign keys are stale otherwise
+        .execution_options(populate_existing=True)
+    )
+    return {src.id: resolution.export_header(src) for src in sources}
+
+
+def states(db: Session, source_ids) -> dict[int, dict]:
+    # Current export state of each given source that exists: header and every rule by id
+    found = headers(db, source_ids)
+    if not found:
+        return {}
+    rules: dict[int, dict] = {i: {} for i in found}
+    r = models.Rule
+    for row in db.execute(
+        select(r.id, r.source_id, r.type, r.schema, r.table, r.policy_id, r.legal_hold)
+        .where(r.source_id.in_(list(found)))
+        .order_by(r.id)
+    ):
+        rules[row.source_id][str(row.id)] = _rule(row)
+    return {i: {"source": header, "rules": rules[i]} for i, header in found.items()}
+
+
+def _write_snapshots(db: Session, revision: int, current: dict[int, dict]):
+    if current:
+        db.execute(
+            models.ConfigSnapshot.__table__.insert(),
+            [{"source_id": i, "revision": revision, "state": _dumps(s)} for i, s in current.items()],
+        )
+
+
+def _due(db: Session, source_ids) -> list[int]:
+    # Sources with SNAPSHOT_EVERY or more deltas since their last snapshot
+    log, snap = models.ConfigLogEntry, models.ConfigSnapshot
+    last = select(func.max(snap.revision)).where(snap.source_id == log.source_id).scalar_subquery()
+    return list(db.scalars(
+        select(log.source_id)
+        .where(log.source_id.in_(list(source_ids)), log.revision > func.coalesce(last, -1))
+        .group_by(log.source_id)
+        .having(func.count() >= SNAPSHOT_EVERY)
+    ))
+
+
+def record(db: Session, revision: int, entity: str, entity_id: int | None, op: str, source_ids):
+    # Called by changes.record for writes that can change the sources' export state
+    ids = sorted(set(source_ids))
+    if not ids:
+        return
+    # The state is read back from the database, so pending changes must be written first
+    db.flush()
+    # Deleted and just-snapshotted sources never need another snapshot now
+    check_due = False
+    if entity == "source" and op == "delete":
+        deltas = {i: {"state": None} for i in ids}
+    elif entity == "source" and op == "create" or op == "import":
+        _write_snapshots(db, revision, states(db, ids))
+        deltas = {i: {"snapshot": True} for i in ids}
+    elif entity == "rule":
+        rule = db.get(models.Rule, entity_id) if op != "delete" else None
+        deltas = {i: {"rules": {str(entity_id): rule and _rule(rule)}} for i in ids}
+        check_due = True
+    else:
+        # The source, or a connection/warehouse/policy whose name it exports
+        deltas = {i: {"source": header} for i, header in headers(db, ids).items()}
+        check_due = True
+    if not deltas:
+        return
+    db.execute(
+        models.ConfigLogEntry.__table__.insert(),
+        [{"source_id": i, "revision": revision, "delta": _dumps(d)} for i, d in deltas.items()],
+    )
+    if check_due:
+        due = _due(db, list(deltas))
+        if due:
+            _write_snapshots(db, revision, states(db, due))
+
+
+def revision_at(db: Session, value: str) -> int:
+    # A change revision as given (digits), or the latest revision at an ISO 8601 time (UTC
+    # unless it carries an offset)
+    if value.isdigit():
+        return int(value)
+    try:
+        at = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Not a revision or ISO 8601 timestamp: {value!r}")
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    c = models.Change
+    return db.scalar(
+        select(c.revision)
+        .where(c.changed_at <= at.astimezone(timezone.utc))
+        .order_by(c.changed_at.desc(), c.revision.desc())
+        .limit(1)
+    ) or 0
+
+
+def _apply(state: dict | None, delta: dict) -> dict | None:
+    if "state" in delta:
+        return delta["state"]
+    if state is None or "snapshot" in delta:
+        return state
+    if "source" in delta:
+        state["source"] = delta["source"]
+    for rule_id, rule in delta.get("rules", {}).items():
+        if rule is None:
+            state["rules"].pop(rule_id, None)
+        else:
+            state["rules"][rule_id] = rule
+    return state
+
+
+def state_at(db: Session, source_id: int, revision: int) -> dict | None:
+    # The source's export state after `revision`; None if it did not exist then, or its history
+    # starts later
+    snap = models.ConfigSnapshot
+    row = db.execute(
+        select(snap.revision, snap.state)
+        .where(snap.source_id == source_id, snap.revision <= revision)
+        .order_by(snap.revision.desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    state = json.loads(row.state)
+    log = models.ConfigLogEntry
+    for delta in db.scalars(
+        select(log.delta)
+        .where(log.source_id == source_id, log.revision > row.revision, log.revision <= revision)
+        .order_by(log.revision)
+    ):
+        state = _apply(state, json.loads(delta))
+    return state
+
+
+def export(state: dict) -> dict:
+    # The export document for a state, as resolution.export_document builds it
+    rules = [StateRule(*rule) for _, rule in sorted(state["rules"].items(), key=lambda kv: int(kv[0]))]
+    return resolution.build_export(state["source"], rules)
+
+
+def _rule_out(rule_id: str, rule: list) -> dict:
+    return {"id": int(rule_id), **StateRule(*rule)._asdict()}
+
+
+def diff(before: dict | None, after: dict | None) -> dict:
+    # Rules added, removed and changed between two states (None: the source did not exist)
+    old = before["rules"] if before else {}
+    new = after["rules"] if after else {}
+    return {
+        "added": [_rule_out(i, new[i]) for i in sorted(new.keys() - old.keys(), key=int)],
+        "removed": [_rule_out(i, old[i]) for i in sorted(old.keys() - new.keys(), key=int)],
+        "changed": [
+            {"id": int(i), "from": _rule_out(i, old[i]), "to": _rule_out(i, new[i])}
+            for i in sorted(old.keys() & new.keys(), key=int)
+            if old[i] != new[i]
+        ],
+    }
+
+
+def backfill(db: Session, batch_size: int = 500) -> int:
+    # Snapshots, at the latest change revision, every source without a history of its own: none
+    # at all, or only that of a deleted source whose id it reuses. Returns how many; call before
+    # commit.
+    from .changes import latest_revision
+
+    revision = latest_revision(db)
+    src, snap, log, later = models.Source, models.ConfigSnapshot, models.ConfigLogEntry, aliased(models.ConfigLogEntry)
+    last_delta = select(func.max(later.revision)).where(later.source_id == src.id).scalar_subquery()
+    last_snapshot = select(func.max(snap.revision)).where(snap.source_id == src.id).scalar_subquery()
+    deleted = select(log.source_id).where(
+        log.source_id == src.id, log.revision == last_delta, log.revision > last_snapshot, log.delta == DELETED
+    )
+    ids = list(db.scalars(
+        select(src.id).where(or_(src.id.not_in(select(snap.source_id)), deleted.exists())).order_by(src.id)
+    ))
+    for start in range(0, len(ids), batch_size):
+        _write_snapshots(db, revision, states(db, ids[start:start + batch_size]))
+    return len(ids)
+
+
+def main(argv=None):
+    from .database import Base, SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(prog="python -m app.history")
+    parser.add_argument("command", choices=["backfill"])
+    parser.parse_args(argv)
+
+    init_db(Base)
+    with SessionLocal() as db:
+        count = backfill(db)
+        db.commit()
+    print(f"snapshotted {count} sources")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
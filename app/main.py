@@ -1,8 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, Response
+import csv
+import json
+import os
+import time
+from typing import Literal, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from .database import init_db, get_db, Base
-from . import models, schemas
-# plan build removed; no resolution import
+from .database import (
+    init_db, get_db, get_read_db, run_db, Base, ReadSessionLocal, ASYNC_DB, DATABASE_URL, DATABASE_READ_URL,
+)
+from . import (
+    cache, changes, coherence, compression, history, materialized, metrics, models, ndjson, pagination, plans,
+    policies, profiling, query_budget, resolution, revisions, rule_import, schemas, serialization, singleflight,
+    snapshot, usage,
+)
 
 app = FastAPI(
     title="Retention Policy Service",
@@ -18,12 +34,77 @@ app = FastAPI(
         {"name": "Sources", "description": "Configure sources and defaults; export for orchestration."},
         {"name": "Rules", "description": "Include/exclude tables and override policy or legal hold."},
         {"name": "Export", "description": "Export Airflow-friendly JSON for a source."},
+        {"name": "Plans", "description": "Archive plans built from a source's table inventory."},
+        {"name": "Changes", "description": "Feed of config changes, by global revision."},
     ],
 )
 
+if ASYNC_DB:
+    from . import aio
+    app.router.route_class = aio.AsyncDbRoute
+    app.dependency_overrides[get_db] = aio.get_async_db
+    app.dependency_overrides[get_read_db] = aio.get_async_read_db
+    app.add_event_handler("shutdown", aio.dispose)
+
+if query_budget.ENABLED:
+    app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+if compression.RESPONSE_COMPRESSION:
+    app.add_middleware(compression.CompressionMiddleware)
+
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_event_handler("shutdown", metrics.worker_exit)
+
+    @app.get("/metrics", include_in_schema=False)
+    @query_budget.budget(0)
+    def prometheus_metrics():
+        return metrics.metrics_response()
+
+if profiling.PROFILING:
+    profiling.install(app)
+
+    @app.get("/v1/admin/profiles", include_in_schema=False, dependencies=[Depends(profiling.require_admin)])
+    @query_budget.budget(0)
+    def list_profiles(limit: int = Query(50, ge=1, le=1000)):
+        found = (profiling.summary(i) for i in profiling.recent()[:limit])
+        return [meta for meta in found if meta is not None]
+
+    @app.get(
+        "/v1/admin/profiles/{profile_id}:collapsed",
+        include_in_schema=False,
+        dependencies=[Depends(profiling.require_admin)],
+    )
+    @query_budget.budget(0)
+    def get_profile_stacks(profile_id: str):
+        path = profiling.path(profile_id, ".collapsed")
+        if path is None:
+            raise HTTPException(404, "Profile not found")
+        return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.collapsed")
+
+    @app.get("/v1/admin/profiles/{profile_id}", include_in_schema=False, dependencies=[Depends(profiling.require_admin)])
+    @query_budget.budget(0)
+    def get_profile(profile_id: str):
+        path = profiling.path(profile_id, ".json")
+        if path is None:
+            raise HTTPException(404, "Profile not found")
+        return FileResponse(path, media_type="application/json")
+
 @app.on_event("startup")
 def startup():
     init_db(Base)
+    app.state.coherence = coherence.start(DATABASE_URL, DATABASE_READ_URL, changes.feed.notify)
+
+@app.on_event("shutdown")
+def shutdown():
+    if app.state.coherence is not None:
+        app.state.coherence.stop()
+
+def _compiled(db: Session, source_id: int, version=None) -> resolution.CompiledSource | None:
+    # Compiled resolver + export document, served from the per-source cache. `version` is the
+    # config revision the caller read from `db`, so that an entry built from a lagging replica
+    # is not served once the replica has caught up.
+    return cache.sources.get(source_id, lambda: resolution.compile_source(db, source_id), version)
 
 @app.post(
     "/v1/connections",
@@ -31,11 +112,14 @@ def startup():
     tags=["Connections"],
     summary="Create connection",
 )
+@query_budget.budget(5)
 def create_connection(payload: schemas.ConnectionCreate, db: Session = Depends(get_db)):
     if db.query(models.Connection).filter_by(name=payload.name).first():
         raise HTTPException(409, "Connection name already exists")
     obj = models.Connection(**payload.model_dump())
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj); db.flush()
+    changes.record(db, "connection", obj.id, "create")
+    db.commit(); db.refresh(obj)
     return obj
 
 @app.get(
@@ -44,8 +128,15 @@ def create_connection(payload: schemas.ConnectionCreate, db: Session = Depends(g
     tags=["Connections"],
     summary="List connections",
 )
-def list_connections(db: Session = Depends(get_db)):
-    return db.query(models.Connection).order_by(models.Connection.id).all()
+@query_budget.budget(1)
+def list_connections(
+    request: Request,
+    response: Response,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
+    q = serialization.query(db, models.Connection, schemas.ConnectionOut)
+    return serialization.rows_response(pagination.paginate(q, models.Connection.id, page, request, response), response)
 
 @app.get(
     "/v1/connections/{id}",
@@ -53,7 +144,8 @@ def list_connections(db: Session = Depends(get_db)):
     tags=["Connections"],
     summary="Get connection",
 )
-def get_connection(id: int, db: Session = Depends(get_db)):
+@query_budget.budget(1)
+def get_connection(id: int, db: Session = Depends(get_read_db)):
     obj = db.get(models.Connection, id)
     if not obj: raise HTTPException(404, "Not found")
     return obj
@@ -64,6 +156,7 @@ def get_connection(id: int, db: Session = Depends(get_db)):
     tags=["Connections"],
     summary="Update connection",
 )
+@query_budget.budget(15)
 def update_connection(id: int, payload: schemas.ConnectionUpdate, db: Session = Depends(get_db)):
     obj = db.get(models.Connection, id)
     if not obj:
@@ -74,20 +167,28 @@ def update_connection(id: int, payload: schemas.ConnectionUpdate, db: Session =
             raise HTTPException(409, "Connection name already exists")
     for k, v in data.items():
         setattr(obj, k, v)
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj)
+    # Of a connection, exports only show the name
+    changes.record(
+        db, "connection", id, "update", revisions.sources_using(db, models.Connection, id), exported="name" in data
+    )
+    db.commit(); db.refresh(obj)
+    cache.sources.bump_all()
     return obj
 
 @app.delete(
     "/v1/connections/{id}", status_code=204, tags=["Connections"], summary="Delete connection"
 )
+@query_budget.budget(6)
 def delete_connection(id: int, db: Session = Depends(get_db)):
     obj = db.get(models.Connection, id)
     if not obj:
         raise HTTPException(404, "Not found")
-    in_use = db.query(models.Source).filter_by(connection_id=id).first()
-    if in_use:
-        raise HTTPException(400, "Connection in use by sources")
-    db.delete(obj); db.commit()
+    if usage.in_use(db, models.Connection, id):
+        raise HTTPException(400, "Connection in use by sources or plans")
+    db.delete(obj)
+    changes.record(db, "connection", id, "delete")
+    db.commit()
     return Response(status_code=204)
 
 @app.post(
@@ -96,11 +197,14 @@ def delete_connection(id: int, db: Session = Depends(get_db)):
     tags=["Warehouses"],
     summary="Create warehouse",
 )
+@query_budget.budget(5)
 def create_warehouse(payload: schemas.WarehouseCreate, db: Session = Depends(get_db)):
     if db.query(models.Warehouse).filter_by(name=payload.name).first():
         raise HTTPException(409, "Warehouse name already exists")
     obj = models.Warehouse(**payload.model_dump())
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj); db.flush()
+    changes.record(db, "warehouse", obj.id, "create")
+    db.commit(); db.refresh(obj)
     return obj
 
 @app.get(
@@ -109,8 +213,15 @@ def create_warehouse(payload: schemas.WarehouseCreate, db: Session = Depends(get
     tags=["Warehouses"],
     summary="List warehouses",
 )
-def list_warehouses(db: Session = Depends(get_db)):
-    return db.query(models.Warehouse).order_by(models.Warehouse.id).all()
+@query_budget.budget(1)
+def list_warehouses(
+    request: Request,
+    response: Response,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
+    q = serialization.query(db, models.Warehouse, schemas.WarehouseOut)
+    return serialization.rows_response(pagination.paginate(q, models.Warehouse.id, page, request, response), response)
 
 @app.get(
     "/v1/warehouses/{id}",
@@ -118,7 +229,8 @@ def list_warehouses(db: Session = Depends(get_db)):
     tags=["Warehouses"],
     summary="Get warehouse",
 )
-def get_warehouse(id: int, db: Session = Depends(get_db)):
+@query_budget.budget(1)
+def get_warehouse(id: int, db: Session = Depends(get_read_db)):
     obj = db.get(models.Warehouse, id)
     if not obj: raise HTTPException(404, "Not found")
     return obj
@@ -129,6 +241,7 @@ def get_warehouse(id: int, db: Session = Depends(get_db)):
     tags=["Warehouses"],
     summary="Update warehouse",
 )
+@query_budget.budget(15)
 def update_warehouse(id: int, payload: schemas.WarehouseUpdate, db: Session = Depends(get_db)):
     obj = db.get(models.Warehouse, id)
     if not obj:
@@ -139,20 +252,28 @@ def update_warehouse(id: int, payload: schemas.WarehouseUpdate, db: Session = De
             raise HTTPException(409, "Warehouse name already exists")
     for k, v in data.items():
         setattr(obj, k, v)
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj)
+    # Of a warehouse, exports only show the name
+    changes.record(
+        db, "warehouse", id, "update", revisions.sources_using(db, models.Warehouse, id), exported="name" in data
+    )
+    db.commit(); db.refresh(obj)
+    cache.sources.bump_all()
     return obj
 
 @app.delete(
     "/v1/warehouses/{id}", status_code=204, tags=["Warehouses"], summary="Delete warehouse"
 )
+@query_budget.budget(6)
 def delete_warehouse(id: int, db: Session = Depends(get_db)):
     obj = db.get(models.Warehouse, id)
     if not obj:
         raise HTTPException(404, "Not found")
-    in_use = db.query(models.Source).filter_by(warehouse_id=id).first()
-    if in_use:
-        raise HTTPException(400, "Warehouse in use by sources")
-    db.delete(obj); db.commit()
+    if usage.in_use(db, models.Warehouse, id):
+        raise HTTPException(400, "Warehouse in use by sources or plans")
+    db.delete(obj)
+    changes.record(db, "warehouse", id, "delete")
+    db.commit()
     return Response(status_code=204)
 
 @app.post(
@@ -161,11 +282,18 @@ def delete_warehouse(id: int, db: Session = Depends(get_db)):
     tags=["Policies"],
     summary="Create policy",
 )
+@query_budget.budget(5)
 def create_policy(payload: schemas.PolicyCreate, db: Session = Depends(get_db)):
     if db.query(models.Policy).filter_by(name=payload.name).first():
         raise HTTPException(409, "Policy name already exists")
-    obj = models.Policy(**payload.model_dump())
-    db.add(obj); db.commit(); db.refresh(obj)
+    try:
+        data = policies.normalized(payload.model_dump())
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    obj = models.Policy(**data)
+    db.add(obj); db.flush()
+    changes.record(db, "policy", obj.id, "create")
+    db.commit(); db.refresh(obj)
     return obj
 
 @app.get(
@@ -174,7 +302,8 @@ def create_policy(payload: schemas.PolicyCreate, db: Session = Depends(get_db)):
     tags=["Policies"],
     summary="Get policy",
 )
-def get_policy(id: int, db: Session = Depends(get_db)):
+@query_budget.budget(1)
+def get_policy(id: int, db: Session = Depends(get_read_db)):
     obj = db.get(models.Policy, id)
     if not obj: raise HTTPException(404, "Not found")
     return obj
@@ -185,8 +314,15 @@ def get_policy(id: int, db: Session = Depends(get_db)):
     tags=["Policies"],
     summary="List policies",
 )
-def list_policies(db: Session = Depends(get_db)):
-    return db.query(models.Policy).order_by(models.Policy.id).all()
+@query_budget.budget(1)
+def list_policies(
+    request: Request,
+    response: Response,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
+    q = serialization.query(db, models.Policy, schemas.PolicyOut)
+    return serialization.rows_response(pagination.paginate(q, models.Policy.id, page, request, response), response)
 
 @app.patch(
     "/v1/policies/{id}",
@@ -194,6 +330,7 @@ def list_policies(db: Session = Depends(get_db)):
     tags=["Policies"],
     summary="Update policy",
 )
+@query_budget.budget(15)
 def update_policy(id: int, payload: schemas.PolicyUpdate, db: Session = Depends(get_db)):
     obj = db.get(models.Policy, id)
     if not obj:
@@ -202,23 +339,63 @@ def update_policy(id: int, payload: schemas.PolicyUpdate, db: Session = Depends(
     if "name" in data and data["name"] != obj.name:
         if db.query(models.Policy).filter_by(name=data["name"]).first():
             raise HTTPException(409, "Policy name already exists")
+    if data.get("retention_value", "") is None:
+        raise HTTPException(400, "retention_value cannot be null")
+    try:
+        data = policies.normalized(data)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     for k, v in data.items():
         setattr(obj, k, v)
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj)
+    # Of a policy, exports only show the name
+    changes.record(
+        db, "policy", id, "update", revisions.sources_using(db, models.Policy, id), exported="name" in data
+    )
+    db.commit(); db.refresh(obj)
+    cache.sources.bump_all()
     return obj
 
+@app.get(
+    "/v1/policies/{id}/usage",
+    tags=["Policies"],
+    summary="Sources, rules and tables governed by a policy",
+    response_description=(
+        "NDJSON: sources using it as default, override_policy rules naming it, the plan_id inventory count "
+        "(tables resolving to it), then a summary"
+    ),
+)
+# Index lookups, fetched in batches
+@query_budget.budget(None, allow_repeats=True)
+def policy_usage(id: int, plan_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    if not db.get(models.Policy, id):
+        raise HTTPException(404, "Not found")
+    if plan_id is not None and not db.get(models.Plan, plan_id):
+        raise HTTPException(404, "Plan not found")
+
+    # The session outlives the request handler, so the stream owns it rather than using get_db
+    def lines():
+        stream_db = ReadSessionLocal()
+        try:
+            yield from usage.policy_usage(stream_db, id, plan_id)
+        finally:
+            stream_db.close()
+
+    return ndjson.response(lines())
+
 @app.delete(
     "/v1/policies/{id}", status_code=204, tags=["Policies"], summary="Delete policy"
 )
+@query_budget.budget(5)
 def delete_policy(id: int, db: Session = Depends(get_db)):
     obj = db.get(models.Policy, id)
     if not obj:
         raise HTTPException(404, "Not found")
-    in_use_source = db.query(models.Source).filter_by(default_policy_id=id).first()
-    in_use_rule = db.query(models.Rule).filter_by(policy_id=id).first()
-    if in_use_source or in_use_rule:
-        raise HTTPException(400, "Policy in use by sources or rules")
-    db.delete(obj); db.commit()
+    if usage.in_use(db, models.Policy, id):
+        raise HTTPException(400, "Policy in use by sources, rules or plans")
+    db.delete(obj)
+    changes.record(db, "policy", id, "delete")
+    db.commit()
     return Response(status_code=204)
 
 @app.post(
@@ -227,6 +404,7 @@ def delete_policy(id: int, db: Session = Depends(get_db)):
     tags=["Sources"],
     summary="Create source",
 )
+@query_budget.budget(17)
 def create_source(payload: schemas.SourceCreate, db: Session = Depends(get_db)):
     if db.query(models.Source).filter_by(name=payload.name).first():
         raise HTTPException(409, "Source name already exists")
@@ -236,7 +414,10 @@ def create_source(payload: schemas.SourceCreate, db: Session = Depends(get_db)):
         if not db.get(cls, key):
             raise HTTPException(400, f"Invalid reference id: {cls.__name__}={key}")
     obj = models.Source(**payload.model_dump())
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj); db.flush()
+    materialized.refresh(db, obj)
+    changes.record(db, "source", obj.id, "create", [obj.id])
+    db.commit(); db.refresh(obj)
     return obj
 
 @app.get(
@@ -245,49 +426,166 @@ def create_source(payload: schemas.SourceCreate, db: Session = Depends(get_db)):
     tags=["Sources"],
     summary="List sources",
 )
-def list_sources(db: Session = Depends(get_db)):
-    return db.query(models.Source).order_by(models.Source.id).all()
+@query_budget.budget(1)
+def list_sources(
+    request: Request,
+    response: Response,
+    env: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
+    q = serialization.query(db, models.Source, schemas.SourceOut)
+    if env is not None:
+        q = q.filter(models.Source.env == env)
+    if name_prefix:
+        q = q.filter(pagination.prefix_filter(models.Source.name, name_prefix, db.get_bind().dialect.name))
+    return serialization.rows_response(pagination.paginate(q, models.Source.id, page, request, response), response)
+
+@app.get(
+    "/v1/sources:export",
+    tags=["Export"],
+    summary="Export all source configs",
+    response_description="NDJSON (default) or a JSON array, one export document per source in id order",
+)
+# One sources query plus one rules query per batch of sources
+@query_budget.budget(None, allow_repeats=True)
+def export_all_sources(format: Literal["ndjson", "json"] = "ndjson"):
+    # The session outlives the request handler, so the stream owns it rather than using get_db
+    def documents():
+        db = ReadSessionLocal()
+        try:
+            for _, doc in resolution.iter_exports(db):
+                yield doc
+        finally:
+            db.close()
+
+    if format == "json":
+        return ndjson.array_response(documents(), serialization.dumps)
+    return ndjson.response(documents(), serialization.dumps)
 
 @app.get(
     "/v1/sources/{source_id}:export",
     tags=["Export"],
     summary="Export source config",
 )
-def export_source_config(source_id: int, db: Session = Depends(get_db)):
-    src = db.get(models.Source, source_id)
-    if not src:
+@query_budget.budget(4)
+def export_source_config(
+    source_id: int,
+    request: Request,
+    response: Response,
+    as_of: Optional[str] = Query(None, description="Change revision or ISO 8601 time: the export as it was then"),
+    db: Session = Depends(get_read_db),
+):
+    if as_of is not None:
+        revision, state = _state_at(db, source_id, as_of)
+        if state is None:
+            raise HTTPException(404, "Source not found at that revision")
+        headers = {"X-Config-Revision": str(revision)}
+        if serialization.FAST_JSON:
+            return serialization.json_response(history.export(state), headers)
+        response.headers.update(headers)
+        return history.export(state)
+    validators = coherence.validators(db, source_id)
+    if not validators:
+        raise HTTPException(404, "Source not found")
+    if revisions.not_modified(request, validators):
+        return Response(status_code=304, headers=validators.headers)
+    compiled = singleflight.group.do(
+        ("export", source_id, (), validators.etag), lambda: _compiled(db, source_id, validators.etag)
+    )
+    if not compiled:
         raise HTTPException(404, "Source not found")
+    if serialization.FAST_JSON:
+        return serialization.json_response(compiled.export, validators.headers)
+    response.headers.update(validators.headers)
+    return compiled.export
 
-    # Build include/exclude schema->tables from table-level rules
-    def group_tables(rules):
-        grouped: dict[str, list[dict[str, str]]] = {}
-        for r in rules:
-            if r.table is None:
-                continue
-            grouped.setdefault(r.schema, []).append({"name": r.table})
-        # Sort tables for determinism
-        return [
-            {"name": schema, "tables": sorted(tables, key=lambda t: t["name"]) }
-            for schema, tables in sorted(grouped.items(), key=lambda kv: kv[0])
-        ]
-
-    include_rules = [r for r in src.rules if r.type == "include"]
-    exclude_rules = [r for r in src.rules if r.type == "exclude"]
-
-    include_block = {"schemas": group_tables(include_rules)}
-    exclude_schemas = group_tables(exclude_rules)
-    exclude_block = {} if not exclude_schemas else {"schemas": exclude_schemas}
-
-    return {
-        "id": src.name,
-        "env": src.env,
-        "connection": src.connection.name if src.connection else None,
-        "warehouse": src.warehouse.name if src.warehouse else None,
-        "default_policy": src.default_policy.name if src.default_policy else None,
-        "legal_hold_default": bool(src.legal_hold_default),
-        "include": include_block,
-        "exclude": exclude_block,
-    }
+def _state_at(db: Session, source_id: int, value: str | None) -> tuple[int, dict | None]:
+    # value: a change revision or ISO 8601 time; None for the latest revision
+    try:
+        revision = changes.latest_revision(db) if value is None else history.revision_at(db, value)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return revision, history.state_at(db, source_id, revision)
+
+@app.get(
+    "/v1/sources/{source_id}:diff",
+    tags=["Export"],
+    summary="Rules changed between two revisions",
+)
+@query_budget.budget(6)
+def diff_source_config(
+    source_id: int,
+    from_: str = Query(..., alias="from", description="Change revision or ISO 8601 time"),
+    to: Optional[str] = Query(None, description="Change revision or ISO 8601 time; default latest"),
+    db: Session = Depends(get_read_db),
+):
+    from_revision, before = _state_at(db, source_id, from_)
+    to_revision, after = _state_at(db, source_id, to)
+    if before is None and after is None:
+        raise HTTPException(404, "Source not found at either revision")
+    return {"source_id": source_id, "from": from_revision, "to": to_revision, **history.diff(before, after)}
+
+def _snapshot() -> snapshot.Snapshot:
+    snap = snapshot.current()
+    if snap is None:
+        raise HTTPException(404, "Snapshot not built")
+    return snap
+
+def _snapshot_file(request: Request, snap: snapshot.Snapshot, filename: str, media_type: str):
+    # The files never change once written: the snapshot revision validates them
+    validators = revisions.Validators(snap.etag, None)
+    headers = {**validators.headers, "X-Config-Revision": str(snap.revision)}
+    if revisions.not_modified(request, validators):
+        return Response(status_code=304, headers=headers)
+    if snapshot.ACCEL_REDIRECT:
+        headers["X-Accel-Redirect"] = f"{snapshot.ACCEL_REDIRECT.rstrip('/')}/{filename}"
+        return Response(media_type=media_type, headers=headers)
+    return snapshot.SendfileResponse(os.path.join(snap.directory, filename), media_type=media_type, headers=headers)
+
+@app.get(
+    "/v1/snapshot",
+    tags=["Export"],
+    summary="Download every source's export",
+    response_description="gzip-compressed NDJSON, one export document per source, in source id order",
+)
+@query_budget.budget(0)
+def get_snapshot(request: Request):
+    snap = _snapshot()
+    return _snapshot_file(request, snap, snap.manifest["bundle"], "application/gzip")
+
+@app.get(
+    "/v1/snapshot/index",
+    tags=["Export"],
+    summary="Get the snapshot index",
+    response_description="Byte ranges of each source's document in the snapshot",
+)
+@query_budget.budget(0)
+def get_snapshot_index(request: Request):
+    snap = _snapshot()
+    return _snapshot_file(request, snap, snap.manifest["index"], "application/json")
+
+@app.get(
+    "/v1/snapshot/sources/{key}",
+    tags=["Export"],
+    summary="Get one source's export from the snapshot",
+)
+@query_budget.budget(0)
+def get_snapshot_source(key: str, request: Request, by: Literal["id", "name"] = "id"):
+    # Same document and ETag as /v1/sources/{source_id}:export at the snapshot's revision
+    snap = _snapshot()
+    if by == "name":
+        entry = snap.entry(name=key)
+    else:
+        entry = snap.entry(source_id=int(key)) if key.isdigit() else None
+    if entry is None:
+        raise HTTPException(404, "Source not found")
+    validators = revisions.Validators(revisions.etag(entry[0], entry[6]), None)
+    headers = {**validators.headers, "X-Config-Revision": str(snap.revision)}
+    if revisions.not_modified(request, validators):
+        return Response(status_code=304, headers=headers)
+    return Response(snap.document(entry), media_type="application/json", headers=headers)
 
 @app.get(
     "/v1/sources/{id}",
@@ -295,7 +593,8 @@ def export_source_config(source_id: int, db: Session = Depends(get_db)):
     tags=["Sources"],
     summary="Get source",
 )
-def get_source(id: int, db: Session = Depends(get_db)):
+@query_budget.budget(1)
+def get_source(id: int, db: Session = Depends(get_read_db)):
     obj = db.get(models.Source, id)
     if not obj: raise HTTPException(404, "Not found")
     return obj
@@ -306,6 +605,7 @@ def get_source(id: int, db: Session = Depends(get_db)):
     tags=["Sources"],
     summary="Update source",
 )
+@query_budget.budget(18)
 def update_source(id: int, payload: schemas.SourceUpdate, db: Session = Depends(get_db)):
     obj = db.get(models.Source, id)
     if not obj:
@@ -324,20 +624,29 @@ def update_source(id: int, payload: schemas.SourceUpdate, db: Session = Depends(
         raise HTTPException(400, f"Invalid reference id: Policy={data['default_policy_id']}")
     for k, v in data.items():
         setattr(obj, k, v)
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj)
+    if "default_policy_id" in data or "legal_hold_default" in data:
+        materialized.refresh(db, obj)
+    changes.record(db, "source", id, "update", [id])
+    db.commit(); db.refresh(obj)
+    cache.sources.bump(id)
     return obj
 
 @app.delete(
     "/v1/sources/{id}", status_code=204, tags=["Sources"], summary="Delete source"
 )
+@query_budget.budget(11)
 def delete_source(id: int, db: Session = Depends(get_db)):
     obj = db.get(models.Source, id)
     if not obj:
         raise HTTPException(404, "Not found")
-    in_use_rules = db.query(models.Rule).filter_by(source_id=id).first()
-    if in_use_rules:
-        raise HTTPException(400, "Source has rules; delete rules first")
-    db.delete(obj); db.commit()
+    if usage.in_use(db, models.Source, id):
+        raise HTTPException(400, "Source has rules or plans; delete them first")
+    materialized.clear(db, id)
+    db.delete(obj)
+    changes.record(db, "source", id, "delete", [id])
+    db.commit()
+    cache.sources.bump(id)
     return Response(status_code=204)
 
 @app.get(
@@ -346,12 +655,28 @@ def delete_source(id: int, db: Session = Depends(get_db)):
     tags=["Rules"],
     summary="List rules",
 )
-def list_rules(source_id: int, db: Session = Depends(get_db)):
+@query_budget.budget(2)
+def list_rules(
+    source_id: int,
+    request: Request,
+    response: Response,
+    type: Optional[schemas.RuleType] = None,
+    schema: Optional[str] = None,
+    table_prefix: Optional[str] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
     src = db.get(models.Source, source_id)
     if not src:
         raise HTTPException(404, "Source not found")
-    rules = db.query(models.Rule).filter_by(source_id=source_id).order_by(models.Rule.id).all()
-    return rules
+    q = serialization.query(db, models.Rule, schemas.RuleOut).filter(models.Rule.source_id == source_id)
+    if type is not None:
+        q = q.filter(models.Rule.type == type)
+    if schema is not None:
+        q = q.filter(models.Rule.schema == schema)
+    if table_prefix:
+        q = q.filter(pagination.prefix_filter(models.Rule.table, table_prefix, db.get_bind().dialect.name))
+    return serialization.rows_response(pagination.paginate(q, models.Rule.id, page, request, response), response)
 
 @app.post(
     "/v1/sources/{source_id}/rules",
@@ -359,22 +684,66 @@ def list_rules(source_id: int, db: Session = Depends(get_db)):
     tags=["Rules"],
     summary="Create rule",
 )
+@query_budget.budget(15)
 def add_rule(source_id: int, payload: schemas.RuleCreate, db: Session = Depends(get_db)):
     src = db.get(models.Source, source_id)
     if not src: raise HTTPException(404, "Source not found")
     if payload.type == "override_policy" and not payload.policy_id:
         raise HTTPException(400, "policy_id required for override_policy")
     obj = models.Rule(source_id=source_id, **payload.model_dump())
-    db.add(obj); db.commit(); db.refresh(obj)
+    db.add(obj); db.flush()
+    materialized.refresh(db, src, materialized.rule_schemas((obj.type, obj.schema, obj.table)))
+    changes.record(db, "rule", obj.id, "create", [source_id])
+    db.commit(); db.refresh(obj)
+    cache.sources.bump(source_id)
     return obj
 
+def _import_rules(db: Session, source_id: int, rows: list, mode: str):
+    rules, errors = rule_import.validate(db, rows)
+    result = {"mode": mode, "received": len(rows), "inserted": 0, "updated": 0, "deleted": 0, "errors": errors}
+    if errors:
+        # All or nothing: no row is written when any row is invalid
+        return JSONResponse(result, status_code=422)
+    result.update(rule_import.apply(db, source_id, rules, mode))
+    materialized.refresh(db, db.get(models.Source, source_id))
+    changes.record(db, "rule", None, "import", [source_id])
+    db.commit()
+    cache.sources.bump(source_id)
+    return result
+
+@app.post(
+    "/v1/sources/{source_id}/rules:bulk",
+    response_model=schemas.RuleBulkResult,
+    tags=["Rules"],
+    summary="Bulk import rules",
+    responses={422: {"model": schemas.RuleBulkResult, "description": "Per-row validation errors; nothing written"}},
+)
+# Writes are batched: one statement per 10k rows
+@query_budget.budget(None, allow_repeats=True)
+async def bulk_import_rules(
+    source_id: int,
+    request: Request,
+    mode: schemas.ImportMode = "append",
+    db: Session = Depends(get_db),
+):
+    # Body: JSON list (or {"rules": [...]}), NDJSON, or CSV (type,schema,table,policy_id,legal_hold)
+    if not await run_db(db, lambda s: s.get(models.Source, source_id)):
+        raise HTTPException(404, "Source not found")
+    try:
+        # Parsing a large upload is pure Python: kept off the event loop
+        rows = await run_in_threadpool(rule_import.parse, await request.body(), request.headers.get("content-type"))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(400, f"Invalid body: {e}")
+    return await run_db(db, _import_rules, source_id, rows, mode)
+
 @app.get(
     "/v1/sources/{source_id}/rules/{rule_id}",
     response_model=schemas.RuleOut,
     tags=["Rules"],
     summary="Get rule",
 )
-def get_rule(source_id: int, rule_id: int, db: Session = Depends(get_db)):
+@query_budget.budget(2)
+def get_rule(source_id: int, rule_id: int, db: Session = Depends(get_read_db)):
     src = db.get(models.Source, source_id)
     if not src:
         raise HTTPException(404, "Source not found")
@@ -389,6 +758,7 @@ def get_rule(source_id: int, rule_id: int, db: Session = Depends(get_db)):
     tags=["Rules"],
     summary="Update rule",
 )
+@query_budget.budget(17)
 def update_rule(source_id: int, rule_id: int, payload: schemas.RuleUpdate, db: Session = Depends(get_db)):
     src = db.get(models.Source, source_id)
     if not src:
@@ -424,9 +794,14 @@ def update_rule(source_id: int, rule_id: int, payload: schemas.RuleUpdate, db: S
         data["policy_id"] = None
         data["legal_hold"] = None
 
+    before = (rule.type, rule.schema, rule.table)
     for k, v in data.items():
         setattr(rule, k, v)
-    db.add(rule); db.commit(); db.refresh(rule)
+    db.add(rule)
+    materialized.refresh(db, src, materialized.rule_schemas(before, (rule.type, rule.schema, rule.table)))
+    changes.record(db, "rule", rule_id, "update", [source_id])
+    db.commit(); db.refresh(rule)
+    cache.sources.bump(source_id)
     return rule
 
 @app.delete(
@@ -435,6 +810,7 @@ def update_rule(source_id: int, rule_id: int, payload: schemas.RuleUpdate, db: S
     tags=["Rules"],
     summary="Delete rule",
 )
+@query_budget.budget(15)
 def delete_rule(source_id: int, rule_id: int, db: Session = Depends(get_db)):
     src = db.get(models.Source, source_id)
     if not src:
@@ -442,88 +818,264 @@ def delete_rule(source_id: int, rule_id: int, db: Session = Depends(get_db)):
     rule = db.get(models.Rule, rule_id)
     if not rule or rule.source_id != source_id:
         raise HTTPException(404, "Rule not found")
-    db.delete(rule); db.commit()
+    db.delete(rule)
+    materialized.refresh(db, src, materialized.rule_schemas((rule.type, rule.schema, rule.table)))
+    changes.record(db, "rule", rule_id, "delete", [source_id])
+    db.commit()
+    cache.sources.bump(source_id)
     return Response(status_code=204)
 
-# /v1/plans:build endpoint removed per requirements
+def _plan_build(body: bytes) -> schemas.PlanBuild:
+    try:
+        return schemas.PlanBuild.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+
+def _build_plan(db: Session, payload: schemas.PlanBuild) -> dict:
+    validators = coherence.validators(db, payload.source_id)
+    compiled = validators and _compiled(db, payload.source_id, validators.etag)
+    if not compiled:
+        raise HTTPException(400, f"Invalid reference id: Source={payload.source_id}")
+    plan = plans.build_plan(
+        db, compiled.resolver, ((t.schema, t.table) for t in payload.tables), payload.label
+    )
+    db.commit(); db.refresh(plan)
+    return plans.summary(db, plan)
+
+@app.post(
+    "/v1/plans:build",
+    response_model=schemas.PlanOut,
+    tags=["Plans"],
+    summary="Build plan",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": schemas.PlanBuild.model_json_schema()}},
+        }
+    },
+)
+# Items are inserted in batches of 10k
+@query_budget.budget(None, allow_repeats=True)
+async def build_plan(request: Request, db: Session = Depends(get_db)):
+    # Inventories run to hundreds of thousands of tables: the body is parsed and validated in the
+    # threadpool rather than on the event loop
+    payload = await run_in_threadpool(_plan_build, await request.body())
+    return await run_db(db, _build_plan, payload)
+
+@app.get(
+    "/v1/plans/{id}:diff",
+    tags=["Plans"],
+    summary="Diff plans",
+)
+@query_budget.budget(4)
+def diff_plans(id: int, base: int, db: Session = Depends(get_read_db)):
+    for plan_id in (id, base):
+        if not db.get(models.Plan, plan_id):
+            raise HTTPException(404, f"Plan not found: {plan_id}")
+    # Plain JSON types only, so skip jsonable_encoder on what can be a very large document
+    return JSONResponse(plans.diff(db, base, id))
+
+@app.get(
+    "/v1/plans/{id}",
+    response_model=schemas.PlanOut,
+    tags=["Plans"],
+    summary="Get plan",
+)
+@query_budget.budget(2)
+def get_plan(id: int, db: Session = Depends(get_read_db)):
+    obj = db.get(models.Plan, id)
+    if not obj: raise HTTPException(404, "Not found")
+    return plans.summary(db, obj)
+
+@app.delete(
+    "/v1/plans/{id}", status_code=204, tags=["Plans"], summary="Delete plan"
+)
+@query_budget.budget(3)
+def delete_plan(id: int, db: Session = Depends(get_db)):
+    if not db.get(models.Plan, id):
+        raise HTTPException(404, "Not found")
+    plans.delete_plan(db, id)
+    db.commit()
+    return Response(status_code=204)
+
+@app.get(
+    "/v1/plans/{id}/items",
+    response_model=list[schemas.PlanItemOut],
+    tags=["Plans"],
+    summary="List plan items",
+)
+@query_budget.budget(2)
+def list_plan_items(
+    id: int,
+    request: Request,
+    response: Response,
+    action: Optional[Literal["archive", "skip"]] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+):
+    if not db.get(models.Plan, id):
+        raise HTTPException(404, "Not found")
+    q = serialization.query(db, models.PlanItem, schemas.PlanItemOut).filter(models.PlanItem.plan_id == id)
+    if action:
+        q = q.filter(models.PlanItem.action == action)
+    return serialization.rows_response(pagination.paginate(q, models.PlanItem.id, page, request, response), response)
+
+def _effective_policy(db: Session, source_id: int, schema: str, table: str, version: str) -> dict | None:
+    # Resolve policy precedence: default -> schema pattern -> schema override -> table pattern -> table override
+    # Resolve legal hold: same order
+    result = materialized.lookup(db, source_id, schema, table) if materialized.ENABLED else None
+    if result is None:
+        compiled = _compiled(db, source_id, version)
+        if not compiled:
+            raise HTTPException(404, "Source not found")
+        result = compiled.resolver.resolve(schema, table)
+    return result
 
 @app.get(
     "/v1/sources/{source_id}/policy:effective",
     tags=["Policies"],
     summary="Get effective policy for a table",
 )
+@query_budget.budget(5)
 def effective_policy(
     source_id: int,
     schema: str,
     table: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
 ):
-    src = db.get(models.Source, source_id)
-    if not src:
+    validators = coherence.validators(db, source_id)
+    if not validators:
         raise HTTPException(404, "Source not found")
+    if revisions.not_modified(request, validators):
+        return Response(status_code=304, headers=validators.headers)
+    result = singleflight.group.do(
+        ("policy:effective", source_id, (schema, table), validators.etag),
+        lambda: _effective_policy(db, source_id, schema, table, validators.etag),
+    )
+    if result is None:
+        raise HTTPException(404, "Effective policy not found")
+    response.headers.update(validators.headers)
+    return result
 
-    # Resolve policy precedence: default -> schema override -> table override
-    policy_id = src.default_policy_id
+def _table_ref(item) -> schemas.TableRef:
+    if isinstance(item, (list, tuple)) and len(item) == 2:
+        item = {"schema": item[0], "table": item[1]}
+    return schemas.TableRef.model_validate(item)
 
-    schema_override = (
-        db.query(models.Rule)
-        .filter_by(source_id=source_id, type="override_policy", schema=schema, table=None)
-        .order_by(models.Rule.id)
-        .first()
-    )
-    if schema_override and schema_override.policy_id:
-        policy_id = schema_override.policy_id
-
-    table_override = (
-        db.query(models.Rule)
-        .filter_by(source_id=source_id, type="override_policy", schema=schema, table=table)
-        .order_by(models.Rule.id)
-        .first()
+@app.post(
+    "/v1/sources/{source_id}/policy:effective:batch",
+    tags=["Policies"],
+    summary="Get effective policies for many tables",
+    response_description="NDJSON, one effective-policy document (or error) per requested table",
+)
+@query_budget.budget(4)
+async def effective_policy_batch(source_id: int, request: Request, db: Session = Depends(get_read_db)):
+    # Accepts a JSON list of {"schema", "table"} objects or [schema, table] pairs
+    # (optionally wrapped as {"tables": [...]}), or an NDJSON body streamed line by line.
+    validators = await run_db(db, coherence.validators, source_id)
+    if not validators:
+        raise HTTPException(404, "Source not found")
+    # Waiters share the leader's load without holding a threadpool slot
+    compiled = await singleflight.group.do_async(
+        ("policy:effective:batch", source_id, (), validators.etag),
+        lambda: run_db(db, _compiled, source_id, validators.etag),
     )
-    if table_override and table_override.policy_id:
-        policy_id = table_override.policy_id
+    if not compiled:
+        raise HTTPException(404, "Source not found")
+    resolver = compiled.resolver
 
-    policy = db.get(models.Policy, policy_id)
-    if not policy:
-        raise HTTPException(404, "Effective policy not found")
+    if ndjson.is_ndjson(request.headers.get("content-type")):
+        # Lines are parsed as they arrive; the body has to be drained before the response
+        # starts streaming because the response task also listens on the receive channel.
+        items = []
+        async for line in ndjson.iter_lines(request.stream()):
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(400, "Invalid JSON body")
+        if isinstance(items, dict):
+            items = items.get("tables")
+        if not isinstance(items, list):
+            raise HTTPException(400, "Expected a list of tables")
 
-    # Resolve legal hold: default -> schema override -> table override
-    legal_hold = bool(src.legal_hold_default)
-    schema_hold = (
-        db.query(models.Rule)
-        .filter_by(source_id=source_id, type="override_hold", schema=schema, table=None)
-        .order_by(models.Rule.id)
-        .first()
-    )
-    if schema_hold and schema_hold.legal_hold is not None:
-        legal_hold = bool(schema_hold.legal_hold)
-    table_hold = (
-        db.query(models.Rule)
-        .filter_by(source_id=source_id, type="override_hold", schema=schema, table=table)
-        .order_by(models.Rule.id)
-        .first()
+    def results():
+        for n, item in enumerate(items, start=1):
+            try:
+                ref = _table_ref(item)
+            except ValidationError:
+                yield {"line": n, "error": "Invalid table reference"}
+                continue
+            result = resolver.resolve(ref.schema, ref.table)
+            if result is None:
+                yield {"schema": ref.schema, "table": ref.table, "error": "Effective policy not found"}
+            else:
+                yield result
+
+    return ndjson.response(results())
+
+@app.get(
+    "/v1/changes",
+    response_model=schemas.ChangeFeed,
+    tags=["Changes"],
+    summary="List changes since a revision",
+)
+# One query per wake-up while waiting
+@query_budget.budget(None, allow_repeats=True)
+async def list_changes(
+    since: int = Query(0, ge=0, description="Last revision already seen (0 for everything)"),
+    limit: int = Query(1000, ge=1, le=10000),
+    wait: Optional[str] = Query(
+        None,
+        pattern=r"^\d+(\.\d+)?s?$",
+        description=f"Long-poll: hold the request open up to this many seconds (max {changes.MAX_WAIT}) "
+        "until a change arrives, e.g. 30s",
+    ),
+    db: Session = Depends(get_read_db),
+):
+    # Clients pass the returned `revision` as `since` on their next call
+    deadline = time.monotonic() + min(float(wait.rstrip("s")) if wait else 0, changes.MAX_WAIT)
+    while True:
+        result = await run_db(db, changes.since, since, limit)
+        remaining = deadline - time.monotonic()
+        if result["changes"] or remaining <= 0:
+            return result
+        await changes.feed.wait(since, remaining)
+
+def _changes_since(revision: int) -> dict:
+    with ReadSessionLocal() as db:
+        return changes.since(db, revision, 1000)
+
+@app.get(
+    "/v1/changes:stream",
+    tags=["Changes"],
+    summary="Stream changes (Server-Sent Events)",
+    response_description="text/event-stream; one `change` event per change, with the revision as event id",
+)
+# One query per batch of changes
+@query_budget.budget(None, allow_repeats=True)
+def stream_changes(request: Request, since: int = Query(0, ge=0)):
+    # Reconnecting clients resume from Last-Event-ID
+    last_event_id = request.headers.get("last-event-id", "")
+    revision = int(last_event_id) if last_event_id.isdigit() else since
+
+    async def events():
+        nonlocal revision
+        while True:
+            result = await run_in_threadpool(_changes_since, revision)
+            for change in result["changes"]:
+                yield f"id: {change['revision']}\nevent: change\ndata: {ndjson.dumps(jsonable_encoder(change))}\n\n"
+            revision = result["revision"]
+            if not result["more"] and not await changes.feed.wait(revision, changes.HEARTBEAT_INTERVAL):
+                # Comment line: keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    if table_hold and table_hold.legal_hold is not None:
-        legal_hold = bool(table_hold.legal_hold)
-
-    has_rules = bool(policy.rules_json and str(policy.rules_json).strip())
-
-    return {
-        "source_id": src.id,
-        "source_name": src.name,
-        "schema": schema,
-        "table": table,
-        "scope": (
-            "override_table" if table_override and table_override.policy_id == policy.id
-            else "override_schema" if schema_override and schema_override.policy_id == policy.id
-            else "default"
-        ),
-        "policy": {
-            "id": policy.id,
-            "name": policy.name,
-            "retention_value": policy.retention_value,
-            "has_rules": has_rules,
-            "rules_json": policy.rules_json if has_rules else None,
-        },
-        "legal_hold": legal_hold,
-    }
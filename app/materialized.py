@@ -0,0 +1,206 @@
+import argparse
+import os
+import sys
+
+from sqlalchemy import delete, or_, select, union_all
+from sqlalchemy.orm import Session
+from . import models, patterns
+from .resolution import OVERRIDE_TYPES, SourceResolver, policy_payload
+
+# Optional materialized resolution. With MATERIALIZE_EFFECTIVE_POLICIES=1 every write that can
+# change a source's effective policies rewrites the affected rows of effective_policies in the
+# same transaction, and the effective-policy endpoint answers from one indexed lookup instead
+# of compiling the source's rules. Lookups fall back to on-the-fly resolution for sources that
+# have no rows yet and, when the source has pattern overrides, for tables without an exact row.
+#   python -m app.materialized rebuild|check
+# fills the table (run it after enabling) and compares it with on-the-fly resolution.
+
+ENABLED = os.getenv("MATERIALIZE_EFFECTIVE_POLICIES", "0") == "1"
+
+BATCH_SIZE = 500
+WRITE_BATCH = 10_000
+
+
+def _override_rules(db: Session, source_ids) -> dict[int, list]:
+    rules: dict[int, list] = {i: [] for i in source_ids}
+    for rule in db.scalars(
+        select(models.Rule)
+        .where(models.Rule.source_id.in_(list(rules)), models.Rule.type.in_(OVERRIDE_TYPES))
+        .order_by(models.Rule.id)
+    ):
+        rules[rule.source_id].append(rule)
+    return rules
+
+
+def expected_rows(source: models.Source, rules) -> list[dict]:
+    # One row per exact override key, per schema with an exact schema-wide override, and the
+    # source row (NULL schema and table)
+    resolver = SourceResolver(source, rules, [])
+    keys = {(None, None)}
+    has_patterns = False
+    for r in rules:
+        if patterns.is_pattern(r.schema) or patterns.is_pattern(r.table):
+            has_patterns = True
+        else:
+            keys.add((r.schema, r.table))
+    rows = []
+    for schema, table in keys:
+        policy_id, legal_hold, scope = resolver.decide(schema, table)
+        rows.append({
+            "source_id": source.id,
+            "schema": schema,
+            "table": table,
+            "policy_id": policy_id,
+            "legal_hold": legal_hold,
+            "scope": scope,
+            "has_patterns": has_patterns if schema is None else False,
+        })
+    return rows
+
+
+def refresh(db: Session, source: models.Source, schemas=None):
+    # Call before commit, after the source or its rules changed. `schemas`: the exact schema
+    # names whose rules changed (see rule_schemas); None rewrites every row of the source.
+    if not ENABLED or schemas is not None and not schemas:
+        return
+    db.flush()
+    t = models.EffectivePolicy.__table__
+    rows = expected_rows(source, _override_rules(db, [source.id])[source.id])
+    stmt = delete(t).where(t.c.source_id == source.id)
+    if schemas is not None:
+        schemas = set(schemas)
+        rows = [r for r in rows if r["schema"] is None or r["schema"] in schemas]
+        stmt = stmt.where(or_(t.c.schema.is_(None), t.c.schema.in_(schemas)))
+    db.execute(stmt)
+    db.execute(t.insert(), rows)
+
+
+def rule_schemas(*rules) -> list[str] | None:
+    # Schemas whose rows the given rule states (before and after a write) can affect, for
+    # refresh: none for include/exclude rules, every schema for pattern rules
+    schemas = []
+    for rule_type, schema, table in rules:
+        if rule_type not in OVERRIDE_TYPES:
+            continue
+        if patterns.is_pattern(schema) or patterns.is_pattern(table):
+            return None
+        schemas.append(schema)
+    return schemas
+
+
+def clear(db: Session, source_id: int):
+    # Call before deleting the source
+    t = models.EffectivePolicy.__table__
+    db.execute(delete(t).where(t.c.source_id == source_id))
+
+
+def lookup(db: Session, source_id: int, schema: str, table: str) -> dict | None:
+    # Same document as SourceResolver.resolve, or None when the rows cannot answer (see above)
+    e = models.EffectivePolicy
+    keys = union_all(
+        select(e).where(e.source_id == source_id, e.schema == schema, e.table == table),
+        select(e).where(e.source_id == source_id, e.schema == schema, e.table.is_(None)),
+        select(e).where(e.source_id == source_id, e.schema.is_(None), e.table.is_(None)),
+    ).subquery()
+    rows = db.execute(
+        select(keys, models.Policy, models.Source.name)
+        .join(models.Policy, models.Policy.id == keys.c.policy_id)
+        .join(models.Source, models.Source.id == keys.c.source_id)
+    ).all()
+    by_level = {(row.schema is not None) + (row.table is not None): row for row in rows}
+    if 0 not in by_level:
+        return None
+    if 2 in by_level:
+        row = by_level[2]
+    elif by_level[0].has_patterns:
+        return None
+    else:
+        row = by_level.get(1, by_level[0])
+    return {
+        "source_id": source_id,
+        "source_name": row.name,
+        "schema": schema,
+        "table": table,
+        "scope": row.scope,
+        "policy": policy_payload(row.Policy),
+        "legal_hold": row.legal_hold,
+    }
+
+
+def _sources(db: Session, source_ids=None):
+    stmt = select(models.Source).order_by(models.Source.id).execution_options(yield_per=BATCH_SIZE)
+    if source_ids:
+        stmt = stmt.where(models.Source.id.in_(source_ids))
+    for batch in db.scalars(stmt).partitions():
+        rules = _override_rules(db, [s.id for s in batch])
+        for source in batch:
+            yield source, rules[source.id]
+
+
+def rebuild(db: Session, source_ids=None) -> int:
+    # Rewrites the rows of the given sources (default: all) in the caller's transaction
+    t = models.EffectivePolicy.__table__
+    stmt = delete(t)
+    if source_ids:
+        stmt = stmt.where(t.c.source_id.in_(source_ids))
+    db.execute(stmt)
+    written = 0
+    rows = []
+    for source, rules in _sources(db, source_ids):
+        rows.extend(expected_rows(source, rules))
+        if len(rows) >= WRITE_BATCH:
+            db.execute(t.insert(), rows)
+            written, rows = written + len(rows), []
+    if rows:
+        db.execute(t.insert(), rows)
+    return written + len(rows)
+
+
+_COLUMNS = ("policy_id", "legal_hold", "scope", "has_patterns")
+
+
+def check(db: Session, source_ids=None) -> list[str]:
+    # Problems found; empty when the rows match on-the-fly resolution
+    t = models.EffectivePolicy.__table__
+    stmt = select(t)
+    if source_ids:
+        stmt = stmt.where(t.c.source_id.in_(source_ids))
+    stored = {(r.source_id, r.schema, r.table): tuple(r._mapping[c] for c in _COLUMNS) for r in db.execute(stmt)}
+    problems = []
+    for source, rules in _sources(db, source_ids):
+        for row in expected_rows(source, rules):
+            key = (row["source_id"], row["schema"], row["table"])
+            expected = tuple(row[c] for c in _COLUMNS)
+            actual = stored.pop(key, None)
+            if actual is None:
+                problems.append(f"missing {key}: expected {expected}")
+            elif actual != expected:
+                problems.append(f"stale {key}: stored {actual}, expected {expected}")
+    problems.extend(f"unexpected {key}: {values}" for key, values in sorted(stored.items(), key=str))
+    return problems
+
+
+def main(argv=None):
+    from .database import Base, SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(prog="python -m app.materialized")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--source", type=int, action="append", dest="sources", help="limit to a source id (repeatable)")
+    args = parser.parse_args(argv)
+
+    init_db(Base)
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            n = rebuild(db, args.sources)
+            db.commit()
+            print(f"wrote {n} rows")
+            return 0
+        problems = check(db, args.sources)
+    for p in problems:
+        print(p)
+    print("ok" if not problems else f"{len(problems)} rows differ from on-the-fly resolution")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import os
+import time
+from contextvars import ContextVar
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+# Prometheus metrics for requests, SQL and connection pools.
+# With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the
+# workers (and wiped on deploy); each worker then writes its samples to mmapped files there and
+# /metrics aggregates all of them.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+UNMATCHED = "<unmatched>"
+
+_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+_SQL_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", multiprocess_mode="livesum")
+QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ["method", "route"], buckets=_QUERY_BUCKETS
+)
+SQL_TIME = Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL per request", ["method", "route"], buckets=_SQL_TIME_BUCKETS
+)
+
+POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool", ["engine"])
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time waiting for a pooled connection", ["engine"])
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently checked out", ["engine"], multiprocess_mode="livesum"
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size", ["engine"], multiprocess_mode="livesum"
+)
+SINGLE_FLIGHT = Counter(
+    "singleflight_calls_total",
+    "Coalesced computations, by whether the call ran it (leader) or shared one in flight (follower)",
+    ["endpoint", "role"],
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+# Set by the middleware for the duration of a request. Sync endpoints run in copies of the
+# request's context (threadpool or greenlet), which share this mutable object.
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+# Labelled children by label values; resolving labels takes a lock, a dict lookup does not
+_children: dict[tuple[str, str], tuple] = {}
+_request_counters: dict[tuple[str, str, int], Counter] = {}
+
+
+def _route_metrics(method: str, route: str):
+    children = _children.get((method, route))
+    if children is None:
+        children = _children[(method, route)] = (
+            LATENCY.labels(method, route),
+            QUERIES.labels(method, route),
+            SQL_TIME.labels(method, route),
+        )
+    return children
+
+
+def _request_counter(method: str, route: str, status: int):
+    counter = _request_counters.get((method, route, status))
+    if counter is None:
+        counter = _request_counters[(method, route, status)] = REQUESTS.labels(method, route, str(status))
+    return counter
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: no per-request task or body buffering, unlike BaseHTTPMiddleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            request_stats.reset(token)
+            route = scope.get("route")
+            method = scope["method"]
+            path = route.path if route is not None else UNMATCHED
+            latency, queries, sql_time = _route_metrics(method, path)
+            latency.observe(elapsed)
+            queries.observe(stats.queries)
+            sql_time.observe(stats.sql_seconds)
+            _request_counter(method, path, status).inc()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # A statement that fails never reaches after_cursor_execute; the next one replaces its start
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("metrics_query_start", None)
+    stats = request_stats.get()
+    if stats is not None and started is not None:
+        stats.queries += 1
+        stats.sql_seconds += time.perf_counter() - started
+
+
+def timed_pool(pool_class, name: str):
+    # The engine's poolclass. Pools have no "before checkout" event, so waiting is timed around
+    # Pool.connect. A pool recreated by engine.dispose() keeps its class, and with it the timing.
+    if not METRICS_ENABLED:
+        return pool_class
+    wait = POOL_WAIT.labels(name)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super(timed, self).connect()
+        finally:
+            wait.observe(time.perf_counter() - start)
+
+    timed = type(f"Timed{pool_class.__name__}", (pool_class,), {"connect": connect})
+    return timed
+
+
+def instrument_engine(sync_engine, name: str):
+    if not METRICS_ENABLED:
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+    checkouts = POOL_CHECKOUTS.labels(name)
+    checked_out = POOL_CHECKED_OUT.labels(name)
+    overflow = POOL_OVERFLOW.labels(name)
+
+    def update_overflow():
+        pool_overflow = getattr(sync_engine.pool, "overflow", None)
+        if pool_overflow is not None:
+            overflow.set(max(0, pool_overflow()))
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checkouts.inc()
+        checked_out.inc()
+        update_overflow()
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out.dec()
+        update_overflow()
+
+
+def metrics_response() -> Response:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def worker_exit():
+    # Drops this worker's live gauges from the multiprocess aggregate
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
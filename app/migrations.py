@@ -0,0 +1,293 @@
+import argparse
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+# Versioned schema migrations, applied in order on startup (see database.init_db) or with
+#   python -m app.migrations upgrade|status|check
+# create_all() still creates missing tables, so a migration only has to evolve tables that may
+# already exist. Each one must be idempotent: on a fresh database create_all() has already built
+# the current schema, and on SQLite DDL is not transactional.
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+logger = logging.getLogger(__name__)
+
+# Serializes concurrent upgrades from several workers on Postgres
+_PG_LOCK_KEY = 0x61726368
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "migrations must be declared in order"
+        MIGRATIONS.append(Migration(version, name, fn))
+        return fn
+    return register
+
+
+def create_index(conn: Connection, name: str, table: str, *columns: str):
+    cols = ", ".join(conn.dialect.identifier_preparer.quote(c) for c in columns)
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+@migration(1, "composite and foreign-key indexes")
+def _indexes(conn: Connection):
+    create_index(conn, "ix_rules_resolution", "rules", "source_id", "type", "schema", "table")
+    create_index(conn, "ix_rules_policy_id", "rules", "policy_id")
+    create_index(conn, "ix_sources_connection_id", "sources", "connection_id")
+    create_index(conn, "ix_sources_warehouse_id", "sources", "warehouse_id")
+    create_index(conn, "ix_sources_default_policy_id", "sources", "default_policy_id")
+
+
+@migration(2, "policy retention_duration and normalized rules_json")
+def _policy_values(conn: Connection):
+    from .policies import normalize_rules, retention_duration
+
+    if "retention_duration" not in {c["name"] for c in inspect(conn).get_columns("policies")}:
+        conn.execute(text("ALTER TABLE policies ADD COLUMN retention_duration VARCHAR(32)"))
+    rows = conn.execute(text("SELECT id, retention_value, rules_json FROM policies")).all()
+    for id, retention_value, rules_json in rows:
+        values = {}
+        try:
+            values["retention_duration"] = retention_duration(retention_value)
+        except ValueError:
+            pass  # left NULL; fixed by the next update of the policy
+        try:
+            values["rules_json"] = normalize_rules(rules_json)
+        except ValueError:
+            pass  # served as the raw string (see policies.parse_rules)
+        if values:
+            sets = ", ".join(f"{k} = :{k}" for k in values)
+            conn.execute(text(f"UPDATE policies SET {sets} WHERE id = :id"), {**values, "id": id})
+
+
+@migration(3, "changes.changed_at index and initial config history snapshots")
+def _config_history(conn: Connection):
+    from sqlalchemy.orm import Session
+    from .history import backfill
+
+    create_index(conn, "ix_changes_changed_at", "changes", "changed_at")
+    # Joins the migration's transaction; history starts here for sources that already exist
+    with Session(bind=conn) as db:
+        backfill(db)
+
+
+@migration(4, "text_pattern_ops indexes for prefix listings on Postgres")
+def _pattern_indexes(conn: Connection):
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sources_name_pattern ON sources (name text_pattern_ops)"))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_rules_table_pattern ON rules (source_id, "table" text_pattern_ops)'
+    ))
+
+
+@migration(5, "flag policies whose rules_json holds NaN or Infinity")
+def _non_finite_rules(conn: Connection):
+    from .policies import normalize_rules
+
+    # Migration 2 normalized them as JSON; they are now served as the raw string, like other values
+    # that are not JSON, until the policy is updated
+    invalid = []
+    for id, rules_json in conn.execute(text("SELECT id, rules_json FROM policies WHERE rules_json IS NOT NULL")):
+        try:
+            normalize_rules(rules_json)
+        except ValueError as e:
+            invalid.append(f"{id} ({e})")
+    if invalid:
+        logger.warning("Policies with invalid rules_json, to be fixed: %s", ", ".join(invalid))
+
+
+@migration(6, "indexes on plan references")
+def _plan_reference_indexes(conn: Connection):
+    # Delete checks (usage.in_use) look these up
+    create_index(conn, "ix_plans_source_id", "plans", "source_id")
+    create_index(conn, "ix_plan_items_policy_id", "plan_items", "policy_id")
+    create_index(conn, "ix_plan_items_connection_id", "plan_items", "connection_id")
+    create_index(conn, "ix_plan_items_warehouse_id", "plan_items", "warehouse_id")
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    if not inspect(conn).has_table("schema_migrations"):
+        return set()
+    return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def upgrade(engine: Engine) -> list[Migration]:
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+        _metadata.create_all(conn)
+        done = applied_versions(conn)
+        insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}.get(conn.dialect.name)
+        for m in MIGRATIONS:
+            if m.version in done:
+                continue
+            m.upgrade(conn)
+            row = {"version": m.version, "name": m.name, "applied_at": datetime.now(timezone.utc)}
+            if insert is not None:
+                conn.execute(insert(schema_migrations).values(row).on_conflict_do_nothing())
+            else:
+                conn.execute(schema_migrations.insert().values(row))
+            applied.append(m)
+    return applied
+
+
+# Hot queries and the index each one must use: (description, SQL, params, index name)
+HOT_QUERIES = [
+    (
+        "effective policy rule lookup",
+        'SELECT id, policy_id, legal_hold FROM rules WHERE source_id = :sid AND type = :type '
+        'AND schema = :schema AND "table" = :table ORDER BY id',
+        {"sid": 1, "type": "override_policy", "schema": "s", "table": "t"},
+        "ix_rules_resolution",
+    ),
+    (
+        "materialized effective policy lookup",
+        'SELECT policy_id, legal_hold, scope FROM effective_policies WHERE source_id = :sid '
+        'AND schema = :schema AND "table" = :table',
+        {"sid": 1, "schema": "s", "table": "t"},
+        "ix_effective_policies_key",
+    ),
+    (
+        "change revision at a time",
+        "SELECT revision FROM changes WHERE changed_at <= :at ORDER BY changed_at DESC, revision DESC LIMIT 1",
+        {"at": "2000-01-01 00:00:00"},
+        "ix_changes_changed_at",
+    ),
+    (
+        "policy in use by rules",
+        "SELECT EXISTS (SELECT * FROM rules WHERE policy_id = :id)",
+        {"id": 1},
+        "ix_rules_policy_id",
+    ),
+    (
+        "policy in use by sources",
+        "SELECT EXISTS (SELECT * FROM sources WHERE default_policy_id = :id)",
+        {"id": 1},
+        "ix_sources_default_policy_id",
+    ),
+    (
+        "connection in use by sources",
+        "SELECT EXISTS (SELECT * FROM sources WHERE connection_id = :id)",
+        {"id": 1},
+        "ix_sources_connection_id",
+    ),
+    (
+        "warehouse in use by sources",
+        "SELECT EXISTS (SELECT * FROM sources WHERE warehouse_id = :id)",
+        {"id": 1},
+        "ix_sources_warehouse_id",
+    ),
+    (
+        "policy in use by plans",
+        "SELECT EXISTS (SELECT * FROM plan_items WHERE policy_id = :id)",
+        {"id": 1},
+        "ix_plan_items_policy_id",
+    ),
+    (
+        "connection in use by plans",
+        "SELECT EXISTS (SELECT * FROM plan_items WHERE connection_id = :id)",
+        {"id": 1},
+        "ix_plan_items_connection_id",
+    ),
+    (
+        "warehouse in use by plans",
+        "SELECT EXISTS (SELECT * FROM plan_items WHERE warehouse_id = :id)",
+        {"id": 1},
+        "ix_plan_items_warehouse_id",
+    ),
+    (
+        "source in use by plans",
+        "SELECT EXISTS (SELECT * FROM plans WHERE source_id = :id)",
+        {"id": 1},
+        "ix_plans_source_id",
+    ),
+    (
+        "policy usage: sources using it as default",
+        "SELECT id, name, env FROM sources WHERE default_policy_id = :id ORDER BY id",
+        {"id": 1},
+        "ix_sources_default_policy_id",
+    ),
+    (
+        "policy usage: override rules naming it",
+        "SELECT id, source_id, schema, \"table\" FROM rules WHERE policy_id = :id AND type = 'override_policy' "
+        "ORDER BY id",
+        {"id": 1},
+        "ix_rules_policy_id",
+    ),
+]
+
+
+def explain(conn: Connection, sql: str, params: dict) -> str:
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)
+        return "\n".join(str(r[-1]) for r in rows)
+    if conn.dialect.name == "postgresql":
+        # Tiny tables would otherwise be planned as sequential scans
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        return "\n".join(r[0] for r in conn.execute(text(f"EXPLAIN {sql}"), params))
+    raise NotImplementedError(f"EXPLAIN check not supported on {conn.dialect.name}")
+
+
+def check(engine: Engine) -> list[str]:
+    # Problems found; empty when every hot query's plan uses its index
+    problems = []
+    with engine.connect() as conn:
+        for name, sql, params, index in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            if index not in plan:
+                problems.append(f"{name}: expected {index}, got plan:\n{plan}")
+        conn.rollback()
+    return problems
+
+
+def main(argv=None):
+    from . import models  # noqa: F401  (registers the tables init_db creates)
+    from .database import Base, engine, init_db
+
+    parser = argparse.ArgumentParser(prog="python -m app.migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "check"])
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        for m in init_db(Base, migrate=True):
+            print(f"applied {m.version}: {m.name}")
+        return 0
+    if args.command == "status":
+        with engine.connect() as conn:
+            done = applied_versions(conn)
+        for m in MIGRATIONS:
+            print(f"{m.version:>4}  {'applied' if m.version in done else 'pending'}  {m.name}")
+        return 0
+    problems = check(engine)
+    for p in problems:
+        print(p)
+    print("ok" if not problems else f"{len(problems)} hot queries not using their index")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Boolean, ForeignKey, DateTime, func, Text
+from sqlalchemy import Integer, String, Boolean, ForeignKey, DateTime, func, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -20,17 +20,25 @@ class Policy(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(200), unique=True, index=True)
     retention_value: Mapped[str] = mapped_column(String(32))
+    # Canonical ISO 8601 form of retention_value (see app.policies)
+    retention_duration: Mapped[str | None] = mapped_column(String(32), nullable=True)
     rules_json: Mapped[str | None] = mapped_column(Text, nullable=True)
 
 class Source(Base):
     __tablename__ = "sources"
+    __table_args__ = (
+        # name_prefix listings under a linguistic collation (see pagination.prefix_filter)
+        Index("ix_sources_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}).ddl_if(
+            dialect="postgresql"
+        ),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(200), unique=True, index=True)
     env: Mapped[str] = mapped_column(String(32), default="dev")
 
-    connection_id: Mapped[int] = mapped_column(ForeignKey("connections.id"))
-    warehouse_id: Mapped[int] = mapped_column(ForeignKey("warehouses.id"))
-    default_policy_id: Mapped[int] = mapped_column(ForeignKey("policies.id"))
+    connection_id: Mapped[int] = mapped_column(ForeignKey("connections.id"), index=True)
+    warehouse_id: Mapped[int] = mapped_column(ForeignKey("warehouses.id"), index=True)
+    default_policy_id: Mapped[int] = mapped_column(ForeignKey("policies.id"), index=True)
 
     legal_hold_default: Mapped[bool] = mapped_column(Boolean, default=False)
 
@@ -40,6 +48,14 @@ class Source(Base):
 
 class Rule(Base):
     __tablename__ = "rules"
+    __table_args__ = (
+        # Resolution lookups and filtered rule listings
+        Index("ix_rules_resolution", "source_id", "type", "schema", "table"),
+        # table_prefix listings under a linguistic collation (see pagination.prefix_filter)
+        Index("ix_rules_table_pattern", "source_id", "table", postgresql_ops={"table": "text_pattern_ops"}).ddl_if(
+            dialect="postgresql"
+        ),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"), index=True)
 
@@ -47,7 +63,7 @@ class Rule(Base):
     schema: Mapped[str] = mapped_column(String(256))
     table: Mapped[str | None] = mapped_column(String(256), nullable=True)
 
-    policy_id: Mapped[int | None] = mapped_column(ForeignKey("policies.id"), nullable=True)
+    policy_id: Mapped[int | None] = mapped_column(ForeignKey("policies.id"), nullable=True, index=True)
     legal_hold: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
 
     source = relationship("Source", backref="rules")
@@ -56,7 +72,7 @@ class Rule(Base):
 class Plan(Base):
     __tablename__ = "plans"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"))
+    source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"), index=True)
     label: Mapped[str | None] = mapped_column(String(200), nullable=True)
     built_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
@@ -69,10 +85,77 @@ class PlanItem(Base):
     schema: Mapped[str] = mapped_column(String(256))
     table: Mapped[str] = mapped_column(String(256))
     action: Mapped[str] = mapped_column(String(16))
-    policy_id: Mapped[int | None] = mapped_column(ForeignKey("policies.id"), nullable=True)
+    policy_id: Mapped[int | None] = mapped_column(ForeignKey("policies.id"), nullable=True, index=True)
     legal_hold: Mapped[bool] = mapped_column(Boolean, default=False)
-    connection_id: Mapped[int] = mapped_column(ForeignKey("connections.id"))
-    warehouse_id: Mapped[int] = mapped_column(ForeignKey("warehouses.id"))
+    connection_id: Mapped[int] = mapped_column(ForeignKey("connections.id"), index=True)
+    warehouse_id: Mapped[int] = mapped_column(ForeignKey("warehouses.id"), index=True)
 
     plan = relationship("Plan", backref="items")
     policy = relationship("Policy")
+
+class EffectivePolicy(Base):
+    # Optional materialized resolution (see app.materialized): the winning policy, legal hold and
+    # scope per exact override key of a source. A row with a NULL table holds the result for the
+    # schema's other tables; the row with NULL schema and table the source's defaults.
+    __tablename__ = "effective_policies"
+    __table_args__ = (
+        Index("ix_effective_policies_key", "source_id", "schema", "table", unique=True),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    source_id: Mapped[int] = mapped_column(ForeignKey("sources.id"))
+    schema: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    table: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    policy_id: Mapped[int] = mapped_column(ForeignKey("policies.id"))
+    legal_hold: Mapped[bool] = mapped_column(Boolean)
+    scope: Mapped[str] = mapped_column(String(32))
+    # Source row only: the source has pattern overrides, which rows cannot enumerate
+    has_patterns: Mapped[bool] = mapped_column(Boolean, default=False)
+
+class ConfigRevision(Base):
+    # Per-source config revision, bumped in the same transaction as any write that changes
+    # the source's export or effective policies. Rows outlive their source so that ids reused
+    # after a delete never repeat an earlier revision.
+    __tablename__ = "config_revisions"
+    source_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    revision: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class ChangeCounter(Base):
+    # Single row holding the latest global change revision. Incrementing it takes the row lock
+    # until commit, so revisions become visible in order.
+    __tablename__ = "change_counter"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    revision: Mapped[int] = mapped_column(Integer, default=0)
+
+class Change(Base):
+    # One row per config write (connections, warehouses, policies, sources, rules)
+    __tablename__ = "changes"
+    __table_args__ = (
+        # Maps a timestamp to the revision current at that time (history.revision_at)
+        Index("ix_changes_changed_at", "changed_at"),
+    )
+    revision: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    entity: Mapped[str] = mapped_column(String(32))
+    entity_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    op: Mapped[str] = mapped_column(String(16))
+    changed_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class ChangeSource(Base):
+    # Sources whose export or effective policies a change affects
+    __tablename__ = "change_sources"
+    revision: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    source_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+
+class ConfigLogEntry(Base):
+    # Append-only: how one change altered a source's export state (see app/history.py)
+    __tablename__ = "config_log"
+    source_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    revision: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    delta: Mapped[str] = mapped_column(Text)
+
+class ConfigSnapshot(Base):
+    # A source's full export state as of a change revision (see app/history.py)
+    __tablename__ = "config_snapshots"
+    source_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    revision: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    state: Mapped[str] = mapped_column(Text)
@@ -0,0 +1,48 @@
+import json
+
+from fastapi.responses import StreamingResponse
+from . import profiling
+
+MEDIA_TYPE = "application/x-ndjson"
+
+
+def dumps(obj) -> str:
+    # Same encoding as FastAPI's JSONResponse so streamed documents match single responses byte for byte
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+
+def is_ndjson(content_type: str | None) -> bool:
+    return (content_type or "").split(";")[0].strip() in (MEDIA_TYPE, "application/jsonl", "application/ndjson")
+
+
+async def iter_lines(chunks):
+    # Split a streamed request body into non-empty lines without buffering the whole body
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buf.strip():
+        yield buf
+
+
+def encode(obj) -> bytes:
+    return dumps(obj).encode("utf-8")
+
+
+def response(rows, encoder=encode, **kwargs) -> StreamingResponse:
+    # encoder: obj -> bytes, e.g. serialization.dumps for documents it can take
+    return StreamingResponse(profiling.streamed(encoder(row) + b"\n" for row in rows), media_type=MEDIA_TYPE, **kwargs)
+
+
+def array_response(rows, encoder=encode, **kwargs) -> StreamingResponse:
+    # A JSON array written incrementally, element by element
+    def body():
+        sep = b"["
+        for row in rows:
+            yield sep + encoder(row)
+            sep = b","
+        yield b"[]" if sep == b"[" else b"]"
+    return StreamingResponse(profiling.streamed(body()), media_type="application/json", **kwargs)
@@ -0,0 +1,70 @@
+import base64
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Query, Request, Response
+from sqlalchemy import and_
+
+MAX_LIMIT = 10000
+
+
+class PageParams:
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT, description="Page size; without it, every row"),
+        cursor: Optional[str] = Query(None, description="Opaque cursor taken from the previous page's Link header"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["id"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(400, "Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(400, "Invalid cursor")
+    return last_id
+
+
+def binary_collation(column, dialect: str) -> bool:
+    # Columns without a COLLATE compare with the database's default: BINARY on SQLite, usually a
+    # linguistic one (en_US.UTF-8) on Postgres
+    collation = getattr(column.type, "collation", None)
+    if collation is not None:
+        return collation in ("C", "POSIX", "BINARY")
+    return dialect == "sqlite"
+
+
+def prefix_filter(column, prefix: str, dialect: str):
+    # LIKE 'prefix%' decides the match. Under a binary collation, range bounds on the column are
+    # added: a btree index serves them, and they make SQLite's case-insensitive LIKE exact. Under
+    # a linguistic collation `prefix || U+10FFFF` is not an upper bound, so LIKE is used alone,
+    # served on Postgres by the text_pattern_ops indexes (migration 4).
+    # One bound pattern rather than `:prefix || '%'`, so that Postgres plans it as a constant
+    match = column.like(prefix.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%", escape="/")
+    if not binary_collation(column, dialect):
+        return match
+    return and_(column >= prefix, column < prefix + "\U0010ffff", match)
+
+
+def paginate(query, id_column, page: PageParams, request: Request, response: Response) -> list:
+    # Keyset pagination on id: no OFFSET scans and no COUNT(*). When another page exists the
+    # response carries a Link rel="next" header (and the bare cursor in X-Next-Cursor). Without a
+    # limit, every row (after the cursor) in one response, as before pagination existed.
+    if page.cursor:
+        query = query.filter(id_column > decode_cursor(page.cursor))
+    if page.limit is None:
+        return query.order_by(id_column).all()
+    rows = query.order_by(id_column).limit(page.limit + 1).all()
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor(rows[-1].id)
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
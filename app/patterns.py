@@ -0,0 +1,98 @@
+import re
+
+# Glob patterns in rule schema/table names: `*` matches any run of characters, `?` exactly one;
+# everything else is literal. A PatternSet finds the most specific pattern matching a name
+# without trying the patterns one by one. Patterns are indexed by their literal lead (the text
+# before the first wildcard), and a name is only tested against the patterns whose lead is one
+# of its own prefixes, one dict probe per distinct lead length:
+#   prefix patterns (`feed_*`, by far the common case) match any name with their lead
+#   the other patterns sharing a lead are alternatives of one regex, most specific first, so the
+#     alternative that matches is the best one of its group
+# Specificity is the number of literal characters, then the number of `?`; ties go to the
+# pattern added first (rules are added in id order).
+
+WILDCARDS = frozenset("*?")
+
+# Joins schema and table into one key for table-level patterns; `*` never matches across it
+SEP = "\x1f"
+
+
+def is_pattern(name: str | None) -> bool:
+    return name is not None and not WILDCARDS.isdisjoint(name)
+
+
+def specificity(pattern: str) -> tuple[int, int]:
+    stars, marks = pattern.count("*"), pattern.count("?")
+    return len(pattern) - stars - marks - pattern.count(SEP), marks
+
+
+def table_key(schema: str, table: str) -> str:
+    return f"{schema}{SEP}{table}"
+
+
+def _translate(pattern: str) -> str:
+    return "".join(
+        f"[^{SEP}]*" if c == "*" else f"[^{SEP}]" if c == "?" else re.escape(c)
+        for c in pattern
+    )
+
+
+_LEAD = re.compile(r"[^*?]*")
+
+
+def _lead(pattern: str) -> str:
+    return _LEAD.match(pattern).group()
+
+
+class PatternSet:
+    def __init__(self, items=()):
+        # items: (pattern, value) pairs; the first value added for a pattern wins
+        self._values: dict[str, object] = {}
+        for pattern, value in items:
+            self._values.setdefault(pattern, value)
+        rank = {p: (specificity(p), -n) for n, p in enumerate(self._values)}
+
+        # lead -> (rank, pattern) of the prefix pattern lead + "*"; a table pattern's lead always
+        # contains the exact schema and SEP, so its `*` only spans the table
+        self._prefixes: dict[str, tuple] = {}
+        general: dict[str, list[str]] = {}
+        for pattern in self._values:
+            lead = _lead(pattern)
+            if pattern == lead + "*":
+                self._prefixes[lead] = (rank[pattern], pattern)
+            else:
+                general.setdefault(lead, []).append(pattern)
+        # lead -> (regex over the rest of the name, ranks, patterns), alternatives best first
+        self._general: dict[str, tuple] = {}
+        for lead, group in general.items():
+            group.sort(key=rank.__getitem__, reverse=True)
+            regex = re.compile("|".join(f"({_translate(p[len(lead):])})" for p in group))
+            self._general[lead] = (regex, [rank[p] for p in group], group)
+        self._prefix_lengths = sorted({len(lead) for lead in self._prefixes}, reverse=True)
+        self._general_lengths = sorted({len(lead) for lead in self._general})
+
+    def match(self, name: str) -> str | None:
+        # The most specific pattern matching `name`, or None
+        best = None
+        for n in self._prefix_lengths:
+            # Longest lead first: later hits are less specific
+            if n <= len(name):
+                best = self._prefixes.get(name[:n])
+                if best is not None:
+                    break
+        for n in self._general_lengths:
+            if n > len(name):
+                break
+            group = self._general.get(name[:n])
+            if group is None:
+                continue
+            m = group[0].fullmatch(name, n)
+            if m is not None:
+                hit = group[1][m.lastindex - 1], group[2][m.lastindex - 1]
+                if best is None or hit > best:
+                    best = hit
+        return None if best is None else best[1]
+
+    def get(self, name: str, default=None):
+        pattern = self.match(name)
+        return default if pattern is None else self._values[pattern]
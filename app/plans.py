@@ -0,0 +1,100 @@
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from . import models
+from .database import offload
+from .resolution import SourceResolver
+
+INSERT_BATCH = 10_000
+
+
+def build_plan(db: Session, resolver: SourceResolver, tables, label: str | None = None) -> models.Plan:
+    # Decides include/exclude, effective policy and legal hold for every table of the inventory
+    # in memory, then writes all items with executemany inserts in the caller's transaction.
+    plan = models.Plan(source_id=resolver.source_id, label=label)
+    db.add(plan); db.flush()
+
+    rows = offload(_items, resolver, tables, plan.id)
+    insert = models.PlanItem.__table__.insert()
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.execute(insert, rows[start:start + INSERT_BATCH])
+    return plan
+
+
+def _items(resolver: SourceResolver, tables, plan_id: int) -> list[dict]:
+    seen = set()
+    rows = []
+    for schema, table in tables:
+        key = (schema, table)
+        if key in seen:
+            continue
+        seen.add(key)
+        policy_id, legal_hold = resolver.policy_and_hold(schema, table)
+        rows.append({
+            "plan_id": plan_id,
+            "schema": schema,
+            "table": table,
+            "action": resolver.action(schema, table),
+            "policy_id": policy_id if policy_id in resolver.policies else None,
+            "legal_hold": legal_hold,
+            "connection_id": resolver.connection_id,
+            "warehouse_id": resolver.warehouse_id,
+        })
+    return rows
+
+
+def delete_plan(db: Session, plan_id: int):
+    # Items first; one statement each (db.delete would load every item through the backref)
+    db.execute(delete(models.PlanItem).where(models.PlanItem.plan_id == plan_id))
+    db.execute(delete(models.Plan).where(models.Plan.id == plan_id))
+
+
+def summary(db: Session, plan: models.Plan) -> dict:
+    counts = dict(
+        db.execute(
+            select(models.PlanItem.action, func.count())
+            .where(models.PlanItem.plan_id == plan.id)
+            .group_by(models.PlanItem.action)
+        ).all()
+    )
+    return {
+        "id": plan.id,
+        "source_id": plan.source_id,
+        "label": plan.label,
+        "built_at": plan.built_at,
+        "items": sum(counts.values()),
+        "archive": counts.get("archive", 0),
+        "skip": counts.get("skip", 0),
+    }
+
+
+_DIFF_COLUMNS = ("action", "policy_id", "legal_hold", "connection_id", "warehouse_id")
+
+
+def _items_by_table(db: Session, plan_id: int) -> dict:
+    t = models.PlanItem.__table__
+    rows = db.execute(
+        select(t.c.schema, t.c.table, *(t.c[c] for c in _DIFF_COLUMNS)).where(t.c.plan_id == plan_id)
+    )
+    return {(r[0], r[1]): tuple(r[2:]) for r in rows}
+
+
+def diff(db: Session, base_id: int, plan_id: int) -> dict:
+    # Tables added, removed, or decided differently in plan_id relative to base_id
+    return offload(_diff, base_id, plan_id, _items_by_table(db, base_id), _items_by_table(db, plan_id))
+
+
+def _diff(base_id: int, plan_id: int, before: dict, after: dict) -> dict:
+    def item(key, values):
+        return {"schema": key[0], "table": key[1], **dict(zip(_DIFF_COLUMNS, values))}
+
+    return {
+        "base": base_id,
+        "plan": plan_id,
+        "added": [item(k, v) for k, v in sorted(after.items()) if k not in before],
+        "removed": [item(k, v) for k, v in sorted(before.items()) if k not in after],
+        "changed": [
+            {"before": item(k, before[k]), "after": item(k, v)}
+            for k, v in sorted(after.items())
+            if k in before and before[k] != v
+        ],
+    }
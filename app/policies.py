@@ -0,0 +1,94 @@
+import json
+import math
+import os
+import re
+from functools import lru_cache
+
+# Policy values are checked and normalized on write, so reads never have to:
+#   retention_value  kept as given ("6m"); its canonical ISO 8601 duration ("P6M") is stored in
+#                    retention_duration
+#   rules_json       must be a JSON document; stored in a canonical compact form (sorted keys),
+#                    and served parsed, from a bounded cache keyed by that text. NaN and Infinity
+#                    (and numbers too large for a float) are rejected: json.loads accepts them, but
+#                    they are not JSON and the responses serving them could not be encoded
+
+# Parsed rules_json documents kept in memory
+POLICY_CACHE_SIZE = int(os.getenv("POLICY_CACHE_SIZE", "1024"))
+
+_UNITS = {
+    "d": "D", "day": "D", "days": "D",
+    "w": "W", "wk": "W", "week": "W", "weeks": "W",
+    "m": "M", "mo": "M", "month": "M", "months": "M",
+    "y": "Y", "yr": "Y", "year": "Y", "years": "Y",
+}
+_SHORTHAND = re.compile(r"(\d+)\s*([a-z]+)")
+_ISO = re.compile(r"P(?!$)(\d+Y)?(\d+M)?(\d+W)?(\d+D)?")
+
+
+def retention_duration(value: str) -> str:
+    # "6m", "6 months", "1y", "30d", "2w" or an ISO 8601 date duration ("P1Y6M") -> ISO 8601,
+    # with weeks as days. Raises ValueError.
+    text = value.strip()
+    parts = {}
+    m = _SHORTHAND.fullmatch(text.lower())
+    if m and m.group(2) in _UNITS:
+        parts[_UNITS[m.group(2)]] = int(m.group(1))
+    else:
+        m = _ISO.fullmatch(text.upper())
+        if not m:
+            raise ValueError(f"Invalid retention_value: {value!r} (expected e.g. 6m, 30d, 1y or P1Y6M)")
+        parts = {g[-1]: int(g[:-1]) for g in m.groups() if g}
+    if "W" in parts:
+        parts["D"] = parts.get("D", 0) + 7 * parts.pop("W")
+    if not any(parts.values()):
+        raise ValueError(f"Invalid retention_value: {value!r} (must be longer than zero)")
+    return "P" + "".join(f"{parts[u]}{u}" for u in "YMD" if parts.get(u))
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def _finite_float(value: str) -> float:
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value} is out of range")
+    return number
+
+
+def _loads(text: str):
+    # json.loads, strict about non-finite numbers. Raises ValueError.
+    return json.loads(text, parse_constant=_reject_constant, parse_float=_finite_float)
+
+
+def normalize_rules(text: str | None) -> str | None:
+    # Blank -> None; otherwise the canonical form of the JSON document. Raises ValueError.
+    if text is None or not text.strip():
+        return None
+    try:
+        rules = _loads(text)
+    except ValueError as e:
+        raise ValueError(f"Invalid rules_json: {e}")
+    return json.dumps(rules, sort_keys=True, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+
+
+def normalized(data: dict) -> dict:
+    # Create/update payload with rules_json normalized and retention_duration derived
+    data = dict(data)
+    if "rules_json" in data:
+        data["rules_json"] = normalize_rules(data["rules_json"])
+    if data.get("retention_value") is not None:
+        data["retention_duration"] = retention_duration(data["retention_value"])
+    return data
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def parse_rules(text: str | None):
+    # Shared between responses: never mutate the result. Values written before validation
+    # existed that are not JSON (including NaN or Infinity) are returned as the raw string.
+    if text is None or not text.strip():
+        return None
+    try:
+        return _loads(text)
+    except ValueError:
+        return text
@@ -0,0 +1,342 @@
+import functools
+import hmac
+import inspect
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import anyio
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from starlette import concurrency
+from . import query_budget
+
+# Opt-in per-request profiling, enabled with PROFILING=1 (and ADMIN_TOKEN set). A request sent
+# with `X-Profile: 1` (or `?profile=1`) and `X-Admin-Token: <ADMIN_TOKEN>` is profiled, with
+# probability PROFILE_RATE; its response carries X-Profile-Id. A sampling thread records the
+# request's stacks every PROFILE_INTERVAL seconds (on the event loop, in threadpool workers and in
+# ASYNC_DB greenlets), with the SQL statement in flight as the leaf frame, and time spent waiting
+# (on the client, an async driver or a threadpool slot) as "[waiting]". Written to PROFILE_DIR:
+#   <id>.collapsed  folded stacks, one "frame;frame;... count" line each: open it in speedscope or
+#                   feed it to flamegraph.pl
+#   <id>.json       the request, its status and duration, and every SQL statement with its timing
+# and listed at GET /v1/admin/profiles. Only the PROFILE_KEEP newest profiles are kept. With
+# PROFILING off nothing is installed: no middleware, no endpoint wrappers, no engine listeners.
+
+PROFILING = os.getenv("PROFILING", "0") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+if PROFILING and not ADMIN_TOKEN:
+    raise ValueError("PROFILING=1 requires ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_RATE = float(os.getenv("PROFILE_RATE", "1"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+PROFILE_ID = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}$")
+
+WAITING = "[waiting]"
+WORKER = "[worker thread]"
+
+
+class Profile:
+    def __init__(self, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{secrets.token_hex(4)}"
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+        # Statement shape in flight, by thread; then (offset, seconds, shape) once done
+        self.running: dict[int, str] = {}
+        self.sql: list[tuple[float, float, str]] = []
+
+
+# The profile of the request being served (copied into its threadpool and greenlet contexts)
+current: ContextVar[Profile | None] = ContextVar("profile", default=None)
+
+# Frames of running profiled handlers and endpoints: a sampled stack belongs to the profile whose
+# marker it reaches, and stops there
+_markers: dict = {}
+_active: set[Profile] = set()
+_cond = threading.Condition()
+_sampler: threading.Thread | None = None
+
+
+def _label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}".replace(";", ",")
+
+
+def _sql_frame(shape: str) -> str:
+    return "SQL " + shape[:200].replace(";", ",")
+
+
+def _sample():
+    seen = set()
+    me = threading.get_ident()
+    for ident, frame in sys._current_frames().items():
+        if ident == me:
+            continue
+        stack = []
+        profile = None
+        while frame is not None:
+            profile = _markers.get(frame)
+            if profile is not None:
+                break
+            stack.append(_label(frame))
+            frame = frame.f_back
+        if profile is None:
+            continue
+        seen.add(profile)
+        if ident != profile.thread:
+            stack.append(WORKER)
+        stack.reverse()
+        statement = profile.running.get(ident)
+        if statement is not None:
+            stack.append(_sql_frame(statement))
+        profile.stacks[tuple(stack)] += 1
+        profile.samples += 1
+    for profile in list(_active):
+        if profile not in seen:
+            stack = [WAITING, *(_sql_frame(s) for s in list(profile.running.values())[:1])]
+            profile.stacks[tuple(stack)] += 1
+            profile.samples += 1
+
+
+def _run_sampler():
+    while True:
+        with _cond:
+            while not _active:
+                _cond.wait()
+        time.sleep(PROFILE_INTERVAL)
+        _sample()
+
+
+def _begin(profile: Profile):
+    global _sampler
+    with _cond:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_run_sampler, name="profiler", daemon=True)
+            _sampler.start()
+        _active.add(profile)
+        _cond.notify()
+
+
+def _end(profile: Profile):
+    with _cond:
+        _active.discard(profile)
+
+
+def marked(fn):
+    # Runs fn with its caller's frame as the profile's marker, when the request is profiled
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def marker(*args, **kwargs):
+            profile = current.get()
+            if profile is None:
+                return await fn(*args, **kwargs)
+            frame = sys._getframe()
+            _markers[frame] = profile
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                del _markers[frame]
+    else:
+        @functools.wraps(fn)
+        def marker(*args, **kwargs):
+            profile = current.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            frame = sys._getframe()
+            _markers[frame] = profile
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                del _markers[frame]
+    return marker
+
+
+def route_class(base):
+    # Marks the request handler (dependencies, endpoint, serialization on the event loop) and sync
+    # endpoints (which run in a worker thread or, with ASYNC_DB, a greenlet of their own)
+    class ProfiledRoute(base):
+        def __init__(self, path, endpoint, **kwargs):
+            if not inspect.iscoroutinefunction(endpoint):
+                endpoint = marked(endpoint)
+            super().__init__(path, endpoint, **kwargs)
+
+        def get_route_handler(self):
+            return marked(super().get_route_handler())
+
+    ProfiledRoute.__name__ = f"Profiled{base.__name__}"
+    return ProfiledRoute
+
+
+def _marked_iterator(iterator):
+    # A streamed body's sync iterator, advanced by worker threads after the endpoint has returned
+    profile = current.get()
+    if profile is None:
+        yield from iterator
+        return
+    frame = sys._getframe()
+    _markers[frame] = profile
+    try:
+        yield from iterator
+    finally:
+        del _markers[frame]
+
+
+def streamed(iterator):
+    # For the app's StreamingResponse bodies (see ndjson): a sync body is iterated in worker
+    # threads, which the profile follows only through this wrapper
+    if not PROFILING:
+        return iterator
+    return concurrency.iterate_in_threadpool(_marked_iterator(iterator))
+
+
+def install(app):
+    # Outermost middleware, so that a profile spans the whole request
+    app.router.route_class = route_class(app.router.route_class)
+    app.add_middleware(ProfilingMiddleware)
+
+
+def _requested(scope) -> bool:
+    headers = dict(scope["headers"])
+    flagged = headers.get(b"x-profile") == b"1" or parse_qs(scope["query_string"].decode()).get("profile") == ["1"]
+    if not flagged:
+        return False
+    token = headers.get(b"x-admin-token", b"")
+    return hmac.compare_digest(token, ADMIN_TOKEN.encode()) and random.random() < PROFILE_RATE
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = Profile(scope["method"], scope["path"])
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = current.set(profile)
+        _begin(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _end(profile)
+            current.reset(token)
+            duration = time.perf_counter() - profile.start
+            route = scope.get("route")
+            # Kept even when the client went away and the request was cancelled
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(save, profile, getattr(route, "path", None), status, duration)
+
+
+def save(profile: Profile, route: str | None, status: int, duration: float):
+    root = f"{profile.method} {route or profile.path}".replace(";", ",")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.id)
+    with open(f"{base}.collapsed.tmp", "w") as f:
+        for stack, count in sorted(profile.stacks.items()):
+            f.write(f"{';'.join((root, *stack))} {count}\n")
+    meta = {
+        "id": profile.id,
+        "started_at": profile.started_at.isoformat(),
+        "method": profile.method,
+        "path": profile.path,
+        "route": route,
+        "status": status,
+        "duration": round(duration, 6),
+        "interval": PROFILE_INTERVAL,
+        "samples": profile.samples,
+        "queries": len(profile.sql),
+        "sql_seconds": round(sum(seconds for _, seconds, _ in profile.sql), 6),
+        "sql": [
+            {"offset": round(offset, 6), "seconds": round(seconds, 6), "statement": statement}
+            for offset, seconds, statement in profile.sql
+        ],
+    }
+    with open(f"{base}.json.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{base}.collapsed.tmp", f"{base}.collapsed")
+    os.replace(f"{base}.json.tmp", f"{base}.json")
+    for old in recent()[PROFILE_KEEP:]:
+        for ext in (".json", ".collapsed"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old + ext))
+            except FileNotFoundError:
+                pass
+
+
+def recent() -> list[str]:
+    # Profile ids, newest first
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((n[:-5] for n in names if n.endswith(".json") and PROFILE_ID.match(n[:-5])), reverse=True)
+
+
+def path(profile_id: str, ext: str) -> str | None:
+    if not PROFILE_ID.match(profile_id):
+        return None
+    p = os.path.join(PROFILE_DIR, profile_id + ext)
+    return p if os.path.exists(p) else None
+
+
+def summary(profile_id: str) -> dict | None:
+    # The profile's metadata without its SQL statements
+    p = path(profile_id, ".json")
+    if p is None:
+        return None
+    with open(p) as f:
+        meta = json.load(f)
+    meta.pop("sql")
+    return meta
+
+
+def require_admin(x_admin_token: str = Header("")):
+    if not hmac.compare_digest(x_admin_token.encode(), (ADMIN_TOKEN or "").encode()):
+        raise HTTPException(403, "Admin token required")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current.get()
+    if profile is not None:
+        # A statement that fails never reaches after_cursor_execute; the next one replaces it
+        profile.running[threading.get_ident()] = query_budget.shape(statement)
+        conn.info["profile_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current.get()
+    started = conn.info.pop("profile_query_start", None)
+    if profile is not None and started is not None:
+        shape = profile.running.pop(threading.get_ident(), None) or query_budget.shape(statement)
+        profile.sql.append((started - profile.start, time.perf_counter() - started, shape))
+
+
+def instrument_engine(sync_engine):
+    if not PROFILING:
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,130 @@
+import logging
+import os
+import re
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Development/test aid: counts SQL statements per request, flags statement shapes repeated within
+# one request (N+1 lazy loads), and checks each route against the query budget declared next to
+# it with @budget. QUERY_BUDGET_MODE:
+#   off    (default) nothing is recorded; no engine listeners are installed
+#   warn   violations are logged; responses carry X-DB-Queries
+#   raise  a violation detected before the response starts fails the request with
+#          QueryBudgetExceeded (the test client re-raises it); later ones are logged
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+if QUERY_BUDGET_MODE not in ("off", "warn", "raise"):
+    raise ValueError(f"QUERY_BUDGET_MODE must be off, warn or raise, not {QUERY_BUDGET_MODE!r}")
+ENABLED = QUERY_BUDGET_MODE != "off"
+# A statement shape executed this many times in one request is reported as an N+1 pattern
+REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def budget(max_queries: int | None, allow_repeats: bool = False):
+    # Declares the most statements one request to the route may execute (None: unbounded, e.g.
+    # batched streams), and whether repeated statement shapes are expected
+    def declare(endpoint):
+        endpoint.__query_budget__ = (max_queries, allow_repeats)
+        return endpoint
+    return declare
+
+
+_PLACEHOLDER = re.compile(r"\?|%s|%\(\w+\)s|\$\d+|:\w+")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_ROW_LIST = re.compile(r"\(\?(?:\.\.\.)?\)(?:\s*,\s*\(\?(?:\.\.\.)?\))+")
+
+
+def shape(statement: str) -> str:
+    # Collapses placeholders, expanded IN lists and multi-row VALUES so that one statement
+    # issued with different parameters or batch sizes has a single shape
+    s = _PLACEHOLDER.sub("?", " ".join(statement.split()))
+    s = _PLACEHOLDER_LIST.sub("?...", s)
+    return _ROW_LIST.sub("(?...)...", s)
+
+
+class Audit:
+    __slots__ = ("statements",)
+
+    def __init__(self):
+        self.statements: Counter[str] = Counter()
+
+    @property
+    def count(self) -> int:
+        return sum(self.statements.values())
+
+    def problems(self, declared) -> list[str]:
+        if declared is None:
+            return ["no query budget declared"]
+        max_queries, allow_repeats = declared
+        problems = []
+        if max_queries is not None and self.count > max_queries:
+            problems.append(f"{self.count} queries, budget {max_queries}")
+        if not allow_repeats:
+            for statement, n in self.statements.most_common():
+                if n < REPEAT_THRESHOLD:
+                    break
+                problems.append(f"N+1: {n} x {statement[:200]}")
+        return problems
+
+
+_audit: ContextVar[Audit | None] = ContextVar("query_audit", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    audit = _audit.get()
+    if audit is not None:
+        audit.statements[shape(statement)] += 1
+
+
+def instrument_engine(sync_engine):
+    if ENABLED:
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        audit = Audit()
+        token = _audit.set(audit)
+        started_at = None
+
+        def check(log: bool = True) -> list[str]:
+            route = scope.get("route")
+            if route is None:
+                return []
+            problems = audit.problems(getattr(route.endpoint, "__query_budget__", None))
+            if problems and log:
+                logger.warning("%s %s: %s", scope["method"], route.path, "; ".join(problems))
+            return problems
+
+        async def send_wrapper(message):
+            nonlocal started_at
+            if message["type"] == "http.response.start":
+                started_at = audit.count
+                problems = check(log=QUERY_BUDGET_MODE != "raise")
+                if problems and QUERY_BUDGET_MODE == "raise":
+                    raise QueryBudgetExceeded(f"{scope['method']} {scope['route'].path}: {'; '.join(problems)}")
+                headers = [*message.get("headers", []), (b"x-db-queries", str(started_at).encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _audit.reset(token)
+        if started_at is not None and audit.count > started_at:
+            # Statements issued while a streamed body was sent can only be logged
+            check()
@@ -0,0 +1,243 @@
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload
+from . import models, patterns, policies
+from .database import offload
+
+OVERRIDE_TYPES = ("override_policy", "override_hold")
+RULE_TYPES = ("include", "exclude", *OVERRIDE_TYPES)
+
+
+def policy_payload(policy: models.Policy) -> dict:
+    rules = policies.parse_rules(policy.rules_json)
+    return {
+        "id": policy.id,
+        "name": policy.name,
+        "retention_value": policy.retention_value,
+        "retention": policy.retention_duration,
+        "has_rules": rules is not None,
+        # The stored string as before, alongside the parsed document
+        "rules_json": policy.rules_json if rules is not None else None,
+        "rules": rules,
+    }
+
+
+class SourceResolver:
+    # In-memory resolution for one source, built from its rules.
+    # Precedence matches the single-table lookup: default -> schema override -> table override,
+    # where only the lowest-id rule per (schema, table) key is considered. Rules whose schema or
+    # table is a glob pattern (see patterns) rank between the exact levels, most specific first:
+    # exact table > table pattern > exact schema > schema pattern > default.
+    def __init__(self, source: models.Source, rules, policies):
+        self.source_id = source.id
+        self.source_name = source.name
+        self.connection_id = source.connection_id
+        self.warehouse_id = source.warehouse_id
+        self.default_policy_id = source.default_policy_id
+        self.legal_hold_default = bool(source.legal_hold_default)
+        self.policies = {p.id: policy_payload(p) for p in policies}
+
+        self.schema_policy: dict[str, int | None] = {}
+        self.table_policy: dict[tuple[str, str], int | None] = {}
+        self.schema_hold: dict[str, bool | None] = {}
+        self.table_hold: dict[tuple[str, str], bool | None] = {}
+        self.included: set = set()  # schema names (schema-wide rules) and (schema, table) keys
+        self.excluded: set = set()
+        # Pattern rules by type, as (pattern, value) pairs in rule order. Table-level patterns
+        # match patterns.table_key(schema, table), schema-wide ones the schema name.
+        table_patterns = {t: [] for t in RULE_TYPES}
+        schema_patterns = {t: [] for t in RULE_TYPES}
+        for r in sorted(rules, key=lambda r: r.id):
+            if patterns.is_pattern(r.schema) or patterns.is_pattern(r.table):
+                value = r.policy_id if r.type == "override_policy" else r.legal_hold
+                if r.table is None:
+                    schema_patterns[r.type].append((r.schema, value))
+                else:
+                    table_patterns[r.type].append((patterns.table_key(r.schema, r.table), value))
+            elif r.type == "override_policy":
+                if r.table is None:
+                    self.schema_policy.setdefault(r.schema, r.policy_id)
+                else:
+                    self.table_policy.setdefault((r.schema, r.table), r.policy_id)
+            elif r.type == "override_hold":
+                if r.table is None:
+                    self.schema_hold.setdefault(r.schema, r.legal_hold)
+                else:
+                    self.table_hold.setdefault((r.schema, r.table), r.legal_hold)
+            elif r.type in ("include", "exclude"):
+                target = self.included if r.type == "include" else self.excluded
+                target.add(r.schema if r.table is None else (r.schema, r.table))
+        self.table_patterns = {t: patterns.PatternSet(items) for t, items in table_patterns.items()}
+        self.schema_patterns = {t: patterns.PatternSet(items) for t, items in schema_patterns.items()}
+
+    # A None table (or schema) stands for one that no table-level (or schema-wide) rule matches
+    def _policy(self, schema: str | None, table: str | None) -> tuple[int, str]:
+        if table is not None:
+            policy_id = self.table_policy.get((schema, table))
+            if policy_id:
+                return policy_id, "override_table"
+            policy_id = self.table_patterns["override_policy"].get(patterns.table_key(schema, table))
+            if policy_id:
+                return policy_id, "override_table_pattern"
+        if schema is not None:
+            policy_id = self.schema_policy.get(schema)
+            if policy_id:
+                return policy_id, "override_schema"
+            policy_id = self.schema_patterns["override_policy"].get(schema)
+            if policy_id:
+                return policy_id, "override_schema_pattern"
+        return self.default_policy_id, "default"
+
+    def _hold(self, schema: str | None, table: str | None) -> bool:
+        legal_hold = None
+        if table is not None:
+            legal_hold = self.table_hold.get((schema, table))
+            if legal_hold is None:
+                legal_hold = self.table_patterns["override_hold"].get(patterns.table_key(schema, table))
+        if legal_hold is None and schema is not None:
+            legal_hold = self.schema_hold.get(schema)
+            if legal_hold is None:
+                legal_hold = self.schema_patterns["override_hold"].get(schema)
+        if legal_hold is None:
+            legal_hold = self.legal_hold_default
+        return bool(legal_hold)
+
+    def decide(self, schema: str | None, table: str | None) -> tuple[int, bool, str]:
+        # Policy id, legal hold and scope
+        policy_id, scope = self._policy(schema, table)
+        return policy_id, self._hold(schema, table), scope
+
+    def policy_and_hold(self, schema: str, table: str) -> tuple[int, bool]:
+        return self._policy(schema, table)[0], self._hold(schema, table)
+
+    def _covers(self, rule_type: str, schema: str, table: str) -> bool:
+        names = self.included if rule_type == "include" else self.excluded
+        return (
+            (schema, table) in names
+            or schema in names
+            or self.table_patterns[rule_type].match(patterns.table_key(schema, table)) is not None
+            or self.schema_patterns[rule_type].match(schema) is not None
+        )
+
+    def action(self, schema: str, table: str) -> str:
+        # Archived when an include rule covers the table (by name, pattern or schema-wide) and no exclude rule does
+        if self._covers("include", schema, table) and not self._covers("exclude", schema, table):
+            return "archive"
+        return "skip"
+
+    def resolve(self, schema: str, table: str) -> dict | None:
+        policy_id, scope = self._policy(schema, table)
+        policy = self.policies.get(policy_id)
+        if policy is None:
+            return None
+        return {
+            "source_id": self.source_id,
+            "source_name": self.source_name,
+            "schema": schema,
+            "table": table,
+            "scope": scope,
+            "policy": policy,
+            "legal_hold": self._hold(schema, table),
+        }
+
+
+def _entry(name: str, **extra) -> dict:
+    # Glob patterns are flagged so consumers expand them against their table inventory
+    return {"name": name, "pattern": True, **extra} if patterns.is_pattern(name) else {"name": name, **extra}
+
+
+def _group_tables(rules):
+    # Build include/exclude schema->tables from table-level rules
+    grouped: dict[str, list[dict[str, str]]] = {}
+    for r in rules:
+        if r.table is None:
+            continue
+        grouped.setdefault(r.schema, []).append(_entry(r.table))
+    # Sort tables for determinism
+    return [
+        _entry(schema, tables=sorted(tables, key=lambda t: t["name"]))
+        for schema, tables in sorted(grouped.items(), key=lambda kv: kv[0])
+    ]
+
+
+def export_header(src: models.Source) -> dict:
+    # The export fields that come from the source and the names it references
+    return {
+        "id": src.name,
+        "env": src.env,
+        "connection": src.connection.name if src.connection else None,
+        "warehouse": src.warehouse.name if src.warehouse else None,
+        "default_policy": src.default_policy.name if src.default_policy else None,
+        "legal_hold_default": bool(src.legal_hold_default),
+    }
+
+
+def build_export(header: dict, rules) -> dict:
+    # rules: anything with .type, .schema and .table; only include/exclude rules are exported
+    include_block = {"schemas": _group_tables(r for r in rules if r.type == "include")}
+    exclude_schemas = _group_tables(r for r in rules if r.type == "exclude")
+    exclude_block = {} if not exclude_schemas else {"schemas": exclude_schemas}
+
+    return {**header, "include": include_block, "exclude": exclude_block}
+
+
+def export_document(src: models.Source, rules) -> dict:
+    return build_export(export_header(src), rules)
+
+
+class CompiledSource(NamedTuple):
+    resolver: SourceResolver
+    export: dict
+
+
+def compile_source(db: Session, source_id: int) -> CompiledSource | None:
+    src = db.get(
+        models.Source,
+        source_id,
+        options=[
+            joinedload(models.Source.connection),
+            joinedload(models.Source.warehouse),
+            joinedload(models.Source.default_policy),
+        ],
+    )
+    if not src:
+        return None
+    rules = db.scalars(
+        select(models.Rule).where(models.Rule.source_id == source_id).order_by(models.Rule.id)
+    ).all()
+    policy_ids = {src.default_policy_id} | {r.policy_id for r in rules if r.type == "override_policy" and r.policy_id}
+    policies = db.scalars(select(models.Policy).where(models.Policy.id.in_(policy_ids))).all()
+    return offload(_compile, src, rules, policies)
+
+
+def _compile(src: models.Source, rules, policies) -> CompiledSource:
+    return CompiledSource(SourceResolver(src, rules, policies), export_document(src, rules))
+
+
+def iter_exports(db: Session, batch_size: int = 500):
+    # Every source's export document, in id order, from a fixed number of queries per batch:
+    # sources joined to their connection/warehouse/default policy, then one IN query for the
+    # batch's include/exclude rules, fetched as plain rows since only three columns are needed.
+    # Sources come from a server-side cursor and the identity map only holds weak references,
+    # so each batch is released once its documents have been yielded and memory stays bounded.
+    stmt = (
+        select(models.Source)
+        .options(
+            joinedload(models.Source.connection),
+            joinedload(models.Source.warehouse),
+            joinedload(models.Source.default_policy),
+        )
+        .order_by(models.Source.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in db.scalars(stmt).partitions():
+        rules: dict[int, list] = {src.id: [] for src in batch}
+        rows = db.execute(
+            select(models.Rule.source_id, models.Rule.type, models.Rule.schema, models.Rule.table)
+            .where(models.Rule.source_id.in_(list(rules)), models.Rule.type.in_(("include", "exclude")))
+        )
+        for row in rows:
+            rules[row.source_id].append(row)
+        for src in batch:
+            yield src.id, export_document(src, rules[src.id])
@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import NamedTuple
+
+from fastapi import Request
+from sqlalchemy import select, union
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import compression, models
+
+# Part of every ETag; bump when the representation of exports or effective policies changes
+# so clients holding a validator for the old shape re-fetch.
+REPRESENTATION_VERSION = 3
+
+CACHE_CONTROL = "no-cache"
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def bump(db: Session, source_ids):
+    # Call before commit so the revision changes atomically with the data it describes
+    ids = sorted(set(source_ids))
+    if not ids:
+        return
+    now = datetime.now(timezone.utc)
+    table = models.ConfigRevision.__table__
+    insert = _UPSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        existing = set(db.scalars(select(table.c.source_id).where(table.c.source_id.in_(ids))))
+        if existing:
+            db.execute(
+                table.update()
+                .where(table.c.source_id.in_(existing))
+                .values(revision=table.c.revision + 1, updated_at=now)
+            )
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            db.execute(table.insert(), [{"source_id": i, "revision": 1, "updated_at": now} for i in missing])
+        return
+    for start in range(0, len(ids), 500):
+        stmt = insert(table).values(
+            [{"source_id": i, "revision": 1, "updated_at": now} for i in ids[start:start + 500]]
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[table.c.source_id],
+                set_={"revision": table.c.revision + 1, "updated_at": stmt.excluded.updated_at},
+            )
+        )
+
+
+def sources_using(db: Session, model, id: int) -> list[int]:
+    # Sources whose export or effective policies mention the given connection/warehouse/policy
+    if model is models.Connection:
+        stmt = select(models.Source.id).where(models.Source.connection_id == id)
+    elif model is models.Warehouse:
+        stmt = select(models.Source.id).where(models.Source.warehouse_id == id)
+    elif model is models.Policy:
+        stmt = union(
+            select(models.Source.id).where(models.Source.default_policy_id == id),
+            select(models.Rule.source_id).where(models.Rule.policy_id == id),
+        )
+    else:
+        raise ValueError(f"Unsupported model: {model.__name__}")
+    return list(db.scalars(stmt))
+
+
+class Validators(NamedTuple):
+    etag: str
+    last_modified: str | None
+
+    @property
+    def headers(self) -> dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        return headers
+
+
+def etag(source_id: int, revision: int) -> str:
+    return f'"{source_id}-{revision}-v{REPRESENTATION_VERSION}"'
+
+
+def validators(db: Session, source_id: int) -> Validators | None:
+    # One indexed lookup, without building the payload; None if the source does not exist
+    row = db.execute(
+        select(models.ConfigRevision.revision, models.ConfigRevision.updated_at)
+        .select_from(models.Source)
+        .outerjoin(models.ConfigRevision, models.ConfigRevision.source_id == models.Source.id)
+        .where(models.Source.id == source_id)
+    ).first()
+    if row is None:
+        return None
+    revision, updated_at = row
+    last_modified = None
+    if updated_at is not None:
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        last_modified = format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+    return Validators(etag(source_id, revision or 0), last_modified)
+
+
+def not_modified(request: Request, current: Validators) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # A tag may carry the content coding the compression middleware appended
+    tags = {compression.strip_coding(t.strip().removeprefix("W/")) for t in header.split(",")}
+    return "*" in tags or current.etag in tags
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.orm import Session
+from . import models, ndjson, schemas
+from .database import offload
+
+CSV_COLUMNS = ("type", "schema", "table", "policy_id", "legal_hold")
+WRITE_BATCH = 10_000
+
+
+def parse(body: bytes, content_type: str | None) -> list:
+    # JSON (a list, or {"rules": [...]}), NDJSON, or CSV with a header row
+    media_type = (content_type or "").split(";")[0].strip()
+    text = body.decode("utf-8-sig")
+    if ndjson.is_ndjson(media_type):
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+        return rows
+    if media_type == "text/csv":
+        reader = csv.DictReader(io.StringIO(text))
+        unknown = set(reader.fieldnames or ()) - set(CSV_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown CSV columns: {', '.join(sorted(unknown))}")
+        # Empty cells mean "not set"
+        return [{k: v for k, v in row.items() if v not in ("", None)} for row in reader]
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("rules")
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of rules")
+    return data
+
+
+def _error(exc: ValidationError) -> str:
+    err = exc.errors()[0]
+    loc = ".".join(str(p) for p in err["loc"])
+    return f"{loc}: {err['msg']}" if loc else err["msg"]
+
+
+def _check(rows: list) -> tuple[list[tuple[int, dict]], list[dict]]:
+    # Per-row type/field checks: (row number, rule) pairs and errors
+    rules, errors = [], []
+    for n, row in enumerate(rows, start=1):
+        try:
+            rule = schemas.RuleCreate.model_validate(row).model_dump()
+        except ValidationError as e:
+            errors.append({"row": n, "error": _error(e)})
+            continue
+        if rule["type"] == "override_policy":
+            if rule["policy_id"] is None:
+                errors.append({"row": n, "error": "policy_id required for override_policy"})
+                continue
+            rule["legal_hold"] = None
+        elif rule["type"] == "override_hold":
+            if rule["legal_hold"] is None:
+                errors.append({"row": n, "error": "legal_hold required for override_hold"})
+                continue
+            rule["policy_id"] = None
+        else:
+            rule["policy_id"] = None
+            rule["legal_hold"] = None
+        rules.append((n, rule))
+    return rules, errors
+
+
+def validate(db: Session, rows: list) -> tuple[list[dict], list[dict]]:
+    # Same type/field constraints as add_rule and update_rule. Policy references are checked
+    # with a single query for all referenced ids.
+    rules, errors = offload(_check, rows)
+
+    referenced = {r["policy_id"] for _, r in rules if r["policy_id"] is not None}
+    if referenced:
+        known = set(db.scalars(select(models.Policy.id).where(models.Policy.id.in_(referenced))))
+        for n, r in rules:
+            if r["policy_id"] is not None and r["policy_id"] not in known:
+                errors.append({"row": n, "error": f"Invalid reference id: Policy={r['policy_id']}"})
+        errors.sort(key=lambda e: e["row"])
+    failed = {e["row"] for e in errors}
+    return [r for n, r in rules if n not in failed], errors
+
+
+def _key(rule) -> tuple:
+    return (rule["type"], rule["schema"], rule["table"])
+
+
+def apply(db: Session, source_id: int, rules: list[dict], mode: str) -> dict:
+    # Writes in the caller's transaction with executemany statements
+    t = models.Rule.__table__
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+
+    if mode == "replace":
+        counts["deleted"] = db.execute(delete(t).where(t.c.source_id == source_id)).rowcount
+
+    inserts = rules
+    if mode == "upsert":
+        # Match on (type, schema, table); the lowest-id existing rule per key is updated,
+        # and when a key repeats in the upload the last row wins.
+        latest = {_key(r): r for r in rules}
+        existing = {}
+        for id, type, schema, table in db.execute(
+            select(t.c.id, t.c.type, t.c.schema, t.c.table)
+            .where(t.c.source_id == source_id)
+            .order_by(t.c.id)
+        ):
+            existing.setdefault((type, schema, table), id)
+        updates = [
+            {"_id": existing[k], "_policy_id": r["policy_id"], "_legal_hold": r["legal_hold"]}
+            for k, r in latest.items() if k in existing
+        ]
+        inserts = [r for k, r in latest.items() if k not in existing]
+        stmt = (
+            t.update()
+            .where(t.c.id == bindparam("_id"))
+            .values(policy_id=bindparam("_policy_id"), legal_hold=bindparam("_legal_hold"))
+        )
+        for start in range(0, len(updates), WRITE_BATCH):
+            db.execute(stmt, updates[start:start + WRITE_BATCH])
+        counts["updated"] = len(updates)
+
+    rows = [{"source_id": source_id, **r} for r in inserts]
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.execute(t.insert(), rows[start:start + WRITE_BATCH])
+    counts["inserted"] = len(rows)
+    return counts
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional, List, Literal
 
@@ -41,6 +42,7 @@ class PolicyOut(BaseModel):
     id: int
     name: str
     retention_value: str
+    retention_duration: Optional[str]
     rules_json: Optional[str]
     class Config: from_attributes = True
 
@@ -76,6 +78,7 @@ class SourceUpdate(BaseModel):
     legal_hold_default: Optional[bool] = None
 
 RuleType = Literal["include","exclude","override_policy","override_hold"]
+ImportMode = Literal["append","replace","upsert"]
 
 class RuleCreate(BaseModel):
     type: RuleType
@@ -101,4 +104,58 @@ class RuleUpdate(BaseModel):
     policy_id: Optional[int] = None
     legal_hold: Optional[bool] = None
 
-    
+class RuleBulkError(BaseModel):
+    row: int
+    error: str
+
+class RuleBulkResult(BaseModel):
+    mode: ImportMode
+    received: int
+    inserted: int
+    updated: int
+    deleted: int
+    errors: List[RuleBulkError]
+
+class TableRef(BaseModel):
+    schema: str
+    table: str
+
+class PlanBuild(BaseModel):
+    source_id: int
+    label: Optional[str] = None
+    tables: List[TableRef]
+
+class PlanOut(BaseModel):
+    id: int
+    source_id: int
+    label: Optional[str]
+    built_at: datetime
+    items: int
+    archive: int
+    skip: int
+
+class PlanItemOut(BaseModel):
+    id: int
+    schema: str
+    table: str
+    action: Literal["archive","skip"]
+    policy_id: Optional[int]
+    legal_hold: bool
+    connection_id: int
+    warehouse_id: int
+    class Config: from_attributes = True
+
+class ChangeOut(BaseModel):
+    revision: int
+    entity: Literal["connection","warehouse","policy","source","rule"]
+    id: Optional[int]
+    op: Literal["create","update","delete","import"]
+    changed_at: Optional[datetime]
+    source_ids: List[int]
+
+class ChangeFeed(BaseModel):
+    since: int
+    revision: int
+    changes: List[ChangeOut]
+    sources: List[int]
+    more: bool
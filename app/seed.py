@@ -1,6 +1,16 @@
 from sqlalchemy.orm import Session
 from .database import init_db, SessionLocal, Base
-from . import models
+from . import changes, materialized, models, policies
+
+def _create(db: Session, obj, entity: str, source_id: int | None = None):
+    # Recorded in the change feed (and the source's history) like the API's create handlers
+    db.add(obj); db.flush()
+    if entity == "source":
+        source_id = obj.id
+        materialized.refresh(db, obj)
+    changes.record(db, entity, obj.id, "create", [source_id] if source_id else [])
+    db.commit(); db.refresh(obj)
+    return obj
 
 def seed():
     init_db(Base)
@@ -13,17 +23,17 @@ def seed():
                 driver="postgres",
                 jdbc_url="jdbc:postgresql://host:5432/doc_db_metadata",
             )
-            db.add(conn); db.commit(); db.refresh(conn)
+            _create(db, conn, "connection")
 
         wh = db.query(models.Warehouse).filter_by(name="dev_warehouse").first()
         if not wh:
             wh = models.Warehouse(name="dev_warehouse", s3_uri="s3://natwest-data-archive-vault")
-            db.add(wh); db.commit(); db.refresh(wh)
+            _create(db, wh, "warehouse")
 
         pol = db.query(models.Policy).filter_by(name="default_6m").first()
         if not pol:
-            pol = models.Policy(name="default_6m", retention_value="6m")
-            db.add(pol); db.commit(); db.refresh(pol)
+            pol = models.Policy(**policies.normalized({"name": "default_6m", "retention_value": "6m"}))
+            _create(db, pol, "policy")
 
         src = db.query(models.Source).filter_by(name="pg_doc_db_metadata").first()
         if not src:
@@ -35,13 +45,11 @@ def seed():
                 default_policy_id=pol.id,
                 legal_hold_default=False
             )
-            db.add(src); db.commit(); db.refresh(src)
+            _create(db, src, "source")
 
-            db.add(models.Rule(source_id=src.id, type="include", schema="doc_sup_owner", table="bank_holidays"))
-            db.add(models.Rule(source_id=src.id, type="include", schema="doc_sup_owner", table="feed"))
-            db.add(models.Rule(source_id=src.id, type="include", schema="doc_sup_owner", table="feed_batch"))
-            db.add(models.Rule(source_id=src.id, type="include", schema="doc_sup_owner", table="feed_dependencies"))
-            db.commit()
+            for table in ("bank_holidays", "feed", "feed_batch", "feed_dependencies"):
+                rule = models.Rule(source_id=src.id, type="include", schema="doc_sup_owner", table=table)
+                _create(db, rule, "rule", src.id)
 
         print("Seed complete. Source id:", src.id)
     finally:
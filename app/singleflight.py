@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from . import metrics
+
+# Request coalescing: while one call for a key is computing, identical calls wait for it and share
+# its result (or exception) instead of repeating the work. Keys start with the endpoint name (the
+# metric label) and include whatever the result depends on, down to the revision it was read at,
+# so a waiter never gets a result older than what it asked for. Callers may be threadpool threads
+# (sync path), greenlets inside AsyncSession.run_sync (ASYNC_DB=1; they wait without blocking the
+# event loop) or coroutines (do_async). Nothing is kept once the leader finishes: repeated,
+# non-overlapping calls are the caches' job. Only the computation's own errors are shared: when
+# the leader is cancelled (its client went away) or interrupted, its waiters start over and one
+# of them becomes the new leader.
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+
+# Result of a call whose leader gave up: its waiters retry
+_ABANDONED = object()
+
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, Future] = {}
+
+    def _join(self, key: tuple) -> tuple[Future, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                # Running futures cannot be cancelled by a waiter that goes away
+                call.set_running_or_notify_cancel()
+        if metrics.METRICS_ENABLED:
+            metrics.SINGLE_FLIGHT.labels(key[0], "leader" if leader else "follower").inc()
+        return call, leader
+
+    def _finish(self, key: tuple, call: Future, result=None, error: BaseException | None = None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            call.set_exception(error)
+        else:
+            call.set_result(result)
+
+    def do(self, key: tuple, fn):
+        if not SINGLE_FLIGHT:
+            return fn()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            result = await_only(asyncio.wrap_future(call)) if in_greenlet() else call.result()
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = fn()
+        except Exception as e:
+            self._finish(key, call, error=e)
+            raise
+        except BaseException:
+            self._finish(key, call, _ABANDONED)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def do_async(self, key: tuple, fn):
+        # fn: coroutine function
+        if not SINGLE_FLIGHT:
+            return await fn()
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            result = await asyncio.wrap_future(call)
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = await fn()
+        except Exception as e:
+            self._finish(key, call, error=e)
+            raise
+        except BaseException:
+            # CancelledError: not the followers' error
+            self._finish(key, call, _ABANDONED)
+            raise
+        self._finish(key, call, result)
+        return result
+
+
+group = Group()
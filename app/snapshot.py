@@ -0,0 +1,228 @@
+import argparse
+import gzip
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import anyio
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.responses import FileResponse
+from . import changes, models, resolution, serialization
+
+# Export snapshot: every source's export document in one file, for consumers (DAG parsing) that
+# need all of them at once. A build writes, under SNAPSHOT_DIR:
+#   exports-<revision>.ndjson.gz       one export document per line, in source id order, as a
+#                                      series of gzip members of MEMBER_SOURCES lines each (any
+#                                      gzip reader sees one NDJSON stream)
+#   exports-<revision>.index.json      per source: id, name, byte offset and length of its gzip
+#                                      member, start and end of its line in the member, and the
+#                                      source's config revision
+#   current.json                       the snapshot being served, replaced atomically last
+# <revision> is the global change revision the build started from. One source is read back by
+# decompressing only its member. Builds run out of process:
+#   python -m app.snapshot build|watch
+# where watch rebuilds whenever the change revision moves.
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+MEMBER_SOURCES = int(os.getenv("SNAPSHOT_MEMBER_SOURCES", "64"))
+# With a front proxy that serves SNAPSHOT_DIR under this internal location (nginx
+# X-Accel-Redirect), the bundle leaves through the proxy's sendfile instead of this process.
+# Without one, a server with the ASGI pathsend extension sends the file itself (see SendfileResponse)
+ACCEL_REDIRECT = os.getenv("SNAPSHOT_ACCEL_REDIRECT")
+KEEP = 2
+
+CURRENT = "current.json"
+
+
+def _write_atomic(path: str, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def build(db: Session, directory: str = SNAPSHOT_DIR) -> dict:
+    # Writes a snapshot of the current config and makes it current; returns its manifest
+    os.makedirs(directory, exist_ok=True)
+    # Read before the documents, so a write made during the build triggers the next one
+    revision = changes.latest_revision(db)
+    source_revisions = dict(db.execute(select(models.ConfigRevision.source_id, models.ConfigRevision.revision)).all())
+    name = f"exports-{revision}"
+    entries = []
+
+    def write_bundle(f):
+        lines, pending = [], []
+        pos = 0
+
+        def flush():
+            nonlocal pos
+            member = gzip.compress(b"".join(lines), mtime=0)
+            offset = f.tell()
+            f.write(member)
+            entries.extend([*entry[:2], offset, len(member), *entry[2:]] for entry in pending)
+            lines.clear()
+            pending.clear()
+            pos = 0
+
+        for source_id, doc in resolution.iter_exports(db):
+            line = serialization.dumps(doc)
+            pending.append((source_id, doc["id"], pos, pos + len(line), source_revisions.get(source_id, 0)))
+            lines.append(line + b"\n")
+            pos += len(line) + 1
+            if len(pending) >= MEMBER_SOURCES:
+                flush()
+        if pending:
+            flush()
+
+    _write_atomic(os.path.join(directory, f"{name}.ndjson.gz"), write_bundle)
+    manifest = {
+        "revision": revision,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "bundle": f"{name}.ndjson.gz",
+        "index": f"{name}.index.json",
+        "sources": len(entries),
+        "size": os.path.getsize(os.path.join(directory, f"{name}.ndjson.gz")),
+    }
+    index = {**manifest, "fields": ["id", "name", "offset", "length", "start", "end", "revision"], "entries": entries}
+    _write_atomic(os.path.join(directory, manifest["index"]), lambda f: f.write(serialization.dumps(index)))
+    _write_atomic(os.path.join(directory, CURRENT), lambda f: f.write(serialization.dumps(manifest)))
+    _prune(directory, manifest["revision"])
+    return manifest
+
+
+_SNAPSHOT_FILE = re.compile(r"exports-(\d+)\.(ndjson\.gz|index\.json)")
+
+
+def _prune(directory: str, revision: int):
+    # Keeps the newest KEEP snapshots; readers holding an older bundle open keep their copy
+    files: dict[int, list[str]] = {}
+    for fn in os.listdir(directory):
+        m = _SNAPSHOT_FILE.fullmatch(fn)
+        if m:
+            files.setdefault(int(m.group(1)), []).append(fn)
+    for rev in sorted(files, reverse=True)[KEEP:]:
+        if rev != revision:
+            for fn in files[rev]:
+                os.remove(os.path.join(directory, fn))
+
+
+class Snapshot:
+    def __init__(self, directory: str, manifest: dict):
+        self.directory = directory
+        self.manifest = manifest
+        self.revision = manifest["revision"]
+        self.etag = f'"snapshot-{self.revision}"'
+        self.bundle_path = os.path.join(directory, manifest["bundle"])
+        self._by_id = None
+        self._by_name = None
+        self._map = None
+
+    def _load(self):
+        with open(os.path.join(self.directory, self.manifest["index"]), "rb") as f:
+            entries = json.load(f)["entries"]
+        by_id = {e[0]: e for e in entries}
+        self._by_name = {e[1]: e for e in entries}
+        with open(self.bundle_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.manifest["size"] else b""
+        self._by_id = by_id
+
+    def entry(self, source_id: int | None = None, name: str | None = None):
+        # [id, name, offset, length, start, end, revision] of one source, or None
+        if self._by_id is None:
+            self._load()
+        return self._by_id.get(source_id) if name is None else self._by_name.get(name)
+
+    def document(self, entry) -> bytes:
+        # The source's export document, byte for byte as the export endpoint serves it
+        _, _, offset, length, start, end, _ = entry
+        return _member(self, offset, length)[start:end]
+
+
+# Cleared when current() moves to a new snapshot, so that the old one (and its mmap) can be freed
+# once its last request is done
+@lru_cache(maxsize=32)
+def _member(snapshot: Snapshot, offset: int, length: int) -> bytes:
+    return gzip.decompress(snapshot._map[offset:offset + length])
+
+
+_current: tuple | None = None
+
+
+def current(directory: str = SNAPSHOT_DIR) -> Snapshot | None:
+    # The snapshot named by current.json, re-read only when that file was replaced
+    global _current
+    path = os.path.join(directory, CURRENT)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (path, st.st_ino, st.st_mtime_ns)
+    if _current is not None and _current[0] == key:
+        return _current[1]
+    with open(path, "rb") as f:
+        snapshot = Snapshot(directory, json.load(f))
+    _current = (key, snapshot)
+    _member.cache_clear()
+    return snapshot
+
+
+class SendfileResponse(FileResponse):
+    # Hands the path to the server when it supports the ASGI pathsend extension (Granian, for one),
+    # which sends the file with sendfile; otherwise FileResponse reads it in chunks
+    async def __call__(self, scope, receive, send):
+        if "http.response.pathsend" not in scope.get("extensions", {}) or scope["method"] == "HEAD":
+            await super().__call__(scope, receive, send)
+            return
+        if self.stat_result is None:
+            self.set_stat_headers(await anyio.to_thread.run_sync(os.stat, self.path))
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+
+
+def watch(directory: str = SNAPSHOT_DIR, interval: float = 5.0):
+    from .database import SessionLocal
+
+    built = None
+    snapshot = current(directory)
+    if snapshot is not None:
+        built = snapshot.revision
+    while True:
+        with SessionLocal() as db:
+            revision = changes.latest_revision(db)
+            if revision != built:
+                started = time.perf_counter()
+                manifest = build(db, directory)
+                built = manifest["revision"]
+                print(f"revision {built}: {manifest['sources']} sources, {manifest['size']} bytes in {time.perf_counter() - started:.2f}s", flush=True)
+        time.sleep(interval)
+
+
+def main(argv=None):
+    from .database import Base, SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(prog="python -m app.snapshot")
+    parser.add_argument("command", choices=["build", "watch"])
+    parser.add_argument("--dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--interval", type=float, default=5.0, help="watch: seconds between revision checks")
+    args = parser.parse_args(argv)
+
+    init_db(Base)
+    if args.command == "watch":
+        watch(args.dir, args.interval)
+        return 0
+    with SessionLocal() as db:
+        manifest = build(db, args.dir)
+    print(f"revision {manifest['revision']}: {manifest['sources']} sources, {manifest['size']} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
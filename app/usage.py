@@ -0,0 +1,75 @@
+from sqlalchemy import exists, or_, select
+from sqlalchemy.orm import Session
+from . import models, resolution
+
+# Reverse references: what points at a connection, warehouse, policy or source. Each of these
+# columns has its own index (migrations 1 and 6), so existence checks and usage listings are index
+# lookups however many sources, rules and plan items there are. Plans record the policy,
+# connection and warehouse each table was given, so a row a plan names stays until the plan is
+# deleted.
+REFERENCES = {
+    models.Connection: (models.Source.connection_id, models.PlanItem.connection_id),
+    models.Warehouse: (models.Source.warehouse_id, models.PlanItem.warehouse_id),
+    models.Policy: (models.Source.default_policy_id, models.Rule.policy_id, models.PlanItem.policy_id),
+    models.Source: (models.Rule.source_id, models.Plan.source_id),
+}
+
+
+def in_use(db: Session, model, id: int) -> bool:
+    # Whether any row references it, in one query
+    return db.scalar(select(or_(*(exists().where(column == id) for column in REFERENCES[model]))))
+
+
+def inventory(db: Session, policy_id: int, plan_id: int, batch_size: int = 1000) -> dict:
+    # How many of a plan's tables resolve to the policy under the current config
+    plan = db.get(models.Plan, plan_id)
+    compiled = resolution.compile_source(db, plan.source_id)
+    tables = resolved = 0
+    rows = db.execute(
+        select(models.PlanItem.schema, models.PlanItem.table)
+        .where(models.PlanItem.plan_id == plan_id)
+        .execution_options(yield_per=batch_size)
+    )
+    for schema, table in rows:
+        tables += 1
+        result = compiled.resolver.resolve(schema, table) if compiled else None
+        if result is not None and result["policy"]["id"] == policy_id:
+            resolved += 1
+    return {"kind": "inventory", "plan_id": plan_id, "source_id": plan.source_id, "tables": tables, "resolved": resolved}
+
+
+def policy_usage(db: Session, policy_id: int, plan_id: int | None = None, batch_size: int = 1000):
+    # NDJSON lines: the sources using the policy as their default, the override rules naming it
+    # (schema-wide or per table), with plan_id the plan's inventory count, then a summary. Rows
+    # are fetched in batches, so a policy used by every source streams in bounded memory.
+    counts = {"sources": 0, "rules": 0}
+    src = models.Source
+    rows = db.execute(
+        select(src.id, src.name, src.env)
+        .where(src.default_policy_id == policy_id)
+        .order_by(src.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        counts["sources"] += 1
+        yield {"kind": "source", "id": row.id, "name": row.name, "env": row.env}
+    rule = models.Rule
+    rows = db.execute(
+        select(rule.id, rule.source_id, rule.schema, rule.table)
+        .where(rule.policy_id == policy_id, rule.type == "override_policy")
+        .order_by(rule.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        counts["rules"] += 1
+        yield {
+            "kind": "rule",
+            "id": row.id,
+            "source_id": row.source_id,
+            "scope": "schema" if row.table is None else "table",
+            "schema": row.schema,
+            "table": row.table,
+        }
+    if plan_id is not None:
+        yield inventory(db, policy_id, plan_id, batch_size)
+    yield {"kind": "summary", "policy_id": policy_id, **counts}
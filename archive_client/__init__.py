@@ -0,0 +1,6 @@
+from .cache import DiskCache
+from .client import BATCH_SIZE, Client, NotFound, ServiceError, Unavailable
+from .models import (
+    Connection, EffectivePolicy, EffectivePolicyPolicy, Export, ExportBlock, ExportEntry, Policy, Rule, RuleType,
+    Source, Warehouse,
+)
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+# Persistent response cache shared by every client (and process) using the same directory. One
+# file per key (a GET's URL, or a batch request): a JSON header line with the response headers
+# the client needs (the ETag validator, the next page's cursor), then the body. Files are
+# replaced atomically, so concurrent readers and writers never see a partial entry.
+
+
+class Entry(NamedTuple):
+    headers: dict[str, str]
+    stored_at: float
+    body: bytes
+
+
+class DiskCache:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key: str) -> Entry | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if header.get("key") != key:
+            return None
+        return Entry(header["headers"], header["stored_at"], body)
+
+    def put(self, key: str, headers: dict[str, str], body: bytes):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        header = {"key": key, "headers": headers, "stored_at": time.time()}
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(body)
+        os.replace(tmp, path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for fn in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, fn))
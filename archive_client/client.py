@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import time
+from typing import Iterable, Iterator, Literal
+
+import httpx
+from pydantic import BaseModel
+from . import models
+from .cache import DiskCache, Entry
+
+# Client for the retention policy service:
+#   client = Client("http://archive-config:8000", cache_dir="/var/cache/archive-config")
+#   client.export(12).include.schemas
+#   client.effective_policies([(12, "sales", "orders"), (12, "sales", "refunds"), (7, "hr", "staff")])
+# One pooled keep-alive HTTP client serves every call. With a cache_dir, GET responses are kept
+# on disk with their ETag and revalidated with If-None-Match, so an unchanged export or
+# effective policy costs a 304 and no transfer. `offline` decides what happens when the service
+# cannot be reached (connection error, timeout or 5xx):
+#   fallback  (default) serve the last cached response, if there is one
+#   never     raise Unavailable
+#   always    never contact the service; serve only from the cache
+# In-process (tests, notebooks), pass the app's TestClient as `http`:
+#   Client(http=TestClient(app))
+
+OfflineMode = Literal["fallback", "never", "always"]
+
+# Tables per effective-policy batch request
+BATCH_SIZE = 1000
+# Rows per page of a list endpoint
+PAGE_SIZE = 1000
+# Response headers kept with cached bodies
+CACHED_HEADERS = ("etag", "x-next-cursor", "x-config-revision")
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class NotFound(ServiceError):
+    pass
+
+
+class Unavailable(Exception):
+    # The service could not be reached and nothing usable was cached
+    pass
+
+
+def _raise_for_status(response: httpx.Response):
+    if response.status_code < 400:
+        return
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        detail = response.text
+    raise (NotFound if response.status_code == 404 else ServiceError)(response.status_code, detail)
+
+
+class Client:
+    def __init__(
+        self,
+        base_url: str | None = None,
+        *,
+        cache_dir: str | None = None,
+        offline: OfflineMode = "fallback",
+        timeout: float = 10.0,
+        max_connections: int = 10,
+        http: httpx.Client | None = None,
+    ):
+        if offline not in ("fallback", "never", "always"):
+            raise ValueError(f"offline must be fallback, never or always, not {offline!r}")
+        base_url = base_url or os.getenv("ARCHIVE_CONFIG_URL")
+        if http is None:
+            if not base_url:
+                raise ValueError("base_url (or ARCHIVE_CONFIG_URL) is required")
+            http = httpx.Client(
+                base_url=base_url,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+        self.http = http
+        cache_dir = cache_dir or os.getenv("ARCHIVE_CONFIG_CACHE_DIR")
+        self.cache = DiskCache(cache_dir) if cache_dir else None
+        self.offline = offline
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fetch(self, request: httpx.Request, key: str) -> tuple[bytes, dict[str, str]]:
+        # Body and CACHED_HEADERS of the response, through the cache as `offline` says
+        cached = self.cache.get(key) if self.cache is not None else None
+        if self.offline == "always":
+            if cached is None:
+                raise Unavailable(f"{key} is not cached")
+            return cached.body, cached.headers
+        if cached is not None and request.method == "GET" and "etag" in cached.headers:
+            request.headers["If-None-Match"] = cached.headers["etag"]
+        try:
+            response = self.http.send(request)
+            if response.status_code >= 500:
+                raise ServiceError(response.status_code, response.text[:200])
+        except (httpx.TransportError, ServiceError) as e:
+            if self.offline == "never" or cached is None:
+                raise Unavailable(f"{key}: {e}") from e
+            logger.warning("%s: %s; serving the response cached %.0fs ago", key, e, time.time() - cached.stored_at)
+            return cached.body, cached.headers
+        if response.status_code == 304 and cached is not None:
+            return cached.body, cached.headers
+        if response.status_code == 404 and self.cache is not None:
+            # Never serve what the service says is gone
+            self.cache.delete(key)
+        _raise_for_status(response)
+        headers = {k: response.headers[k] for k in CACHED_HEADERS if k in response.headers}
+        if self.cache is not None:
+            self.cache.put(key, headers, response.content)
+        return response.content, headers
+
+    def _get(self, path: str, params: dict | None = None) -> tuple[bytes, dict[str, str]]:
+        request = self.http.build_request(
+            "GET", path, params={k: v for k, v in (params or {}).items() if v is not None}
+        )
+        return self._fetch(request, str(request.url))
+
+    def _get_model(self, path: str, model: type[BaseModel], params: dict | None = None):
+        return model.model_validate_json(self._get(path, params)[0])
+
+    def _list(self, path: str, model: type[BaseModel], **params) -> Iterator:
+        # Follows the keyset pagination cursor; each page is cached like any GET
+        params.setdefault("limit", PAGE_SIZE)
+        while True:
+            body, headers = self._get(path, params)
+            yield from (model.model_validate(row) for row in json.loads(body))
+            if "x-next-cursor" not in headers:
+                return
+            params["cursor"] = headers["x-next-cursor"]
+
+    def connection(self, id: int) -> models.Connection:
+        return self._get_model(f"/v1/connections/{id}", models.Connection)
+
+    def warehouse(self, id: int) -> models.Warehouse:
+        return self._get_model(f"/v1/warehouses/{id}", models.Warehouse)
+
+    def policy(self, id: int) -> models.Policy:
+        return self._get_model(f"/v1/policies/{id}", models.Policy)
+
+    def policies(self) -> Iterator[models.Policy]:
+        return self._list("/v1/policies", models.Policy)
+
+    def source(self, id: int) -> models.Source:
+        return self._get_model(f"/v1/sources/{id}", models.Source)
+
+    def sources(self, env: str | None = None) -> Iterator[models.Source]:
+        return self._list("/v1/sources", models.Source, env=env)
+
+    def rules(self, source_id: int, type: models.RuleType | None = None) -> Iterator[models.Rule]:
+        return self._list(f"/v1/sources/{source_id}/rules", models.Rule, type=type)
+
+    def export(self, source_id: int, as_of: int | str | None = None) -> models.Export:
+        # as_of: a change revision or ISO 8601 time for the export as it was then
+        return self._get_model(f"/v1/sources/{source_id}:export", models.Export, {"as_of": as_of})
+
+    def effective_policy(self, source_id: int, schema: str, table: str) -> models.EffectivePolicy:
+        return self._get_model(
+            f"/v1/sources/{source_id}/policy:effective", models.EffectivePolicy, {"schema": schema, "table": table}
+        )
+
+    def effective_policies(
+        self, lookups: Iterable[tuple[int, str, str]]
+    ) -> dict[tuple[int, str, str], models.EffectivePolicy | None]:
+        # (source_id, schema, table) -> effective policy, or None where none applies. Lookups are
+        # grouped into one batch request per source (and per BATCH_SIZE tables); a source that
+        # does not exist raises NotFound.
+        by_source: dict[int, list[tuple[str, str]]] = {}
+        for source_id, schema, table in lookups:
+            tables = by_source.setdefault(source_id, [])
+            if (schema, table) not in tables:
+                tables.append((schema, table))
+        results = {}
+        for source_id, tables in by_source.items():
+            for start in range(0, len(tables), BATCH_SIZE):
+                chunk = tables[start:start + BATCH_SIZE]
+                for (schema, table), line in zip(chunk, self._batch(source_id, chunk)):
+                    doc = json.loads(line)
+                    results[source_id, schema, table] = (
+                        None if "error" in doc else models.EffectivePolicy.model_validate(doc)
+                    )
+        return results
+
+    def _batch(self, source_id: int, tables: list[tuple[str, str]]) -> list[bytes]:
+        # One NDJSON line per table, in order. A POST is not revalidated: each table's line is cached
+        # under its own key, so that any later batch naming the table, whatever else it asks for, can
+        # fall back to it. A cached single lookup (effective_policy) of the table serves as well.
+        body = json.dumps([list(t) for t in tables], separators=(",", ":")).encode()
+        request = self.http.build_request(
+            "POST",
+            f"/v1/sources/{source_id}/policy:effective:batch",
+            content=body,
+            headers={"Content-Type": "application/json"},
+        )
+        keys = [f"POST {request.url} {json.dumps(list(t))}" for t in tables]
+        if self.offline != "always":
+            try:
+                response = self.http.send(request)
+                if response.status_code >= 500:
+                    raise ServiceError(response.status_code, response.text[:200])
+            except (httpx.TransportError, ServiceError) as e:
+                if self.offline == "never":
+                    raise Unavailable(f"POST {request.url}: {e}") from e
+                error = e
+            else:
+                if response.status_code == 404 and self.cache is not None:
+                    for key in keys:
+                        self.cache.delete(key)
+                _raise_for_status(response)
+                lines = response.content.splitlines()
+                if self.cache is not None:
+                    for key, line in zip(keys, lines):
+                        self.cache.put(key, {}, line)
+                return lines
+        cached = [self._cached_effective(source_id, key, *t) for key, t in zip(keys, tables)]
+        missing = [f"{schema}.{table}" for (schema, table), entry in zip(tables, cached) if entry is None]
+        if missing:
+            more = f" and {len(missing) - 3} more" if len(missing) > 3 else ""
+            raise Unavailable(f"POST {request.url}: {', '.join(missing[:3])}{more} not cached")
+        if self.offline != "always":
+            logger.warning(
+                "POST %s: %s; serving effective policies cached up to %.0fs ago",
+                request.url, error, time.time() - min(entry.stored_at for entry in cached),
+            )
+        return [entry.body for entry in cached]
+
+    def _cached_effective(self, source_id: int, key: str, schema: str, table: str) -> Entry | None:
+        # The newer of the table's last batch line and its last single lookup
+        if self.cache is None:
+            return None
+        single = self.http.build_request(
+            "GET", f"/v1/sources/{source_id}/policy:effective", params={"schema": schema, "table": table}
+        )
+        entries = [e for e in (self.cache.get(key), self.cache.get(str(single.url))) if e is not None]
+        return max(entries, key=lambda e: e.stored_at, default=None)
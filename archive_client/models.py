@@ -0,0 +1,92 @@
+from typing import Any, List, Literal, Optional
+
+from pydantic import BaseModel
+
+# Response models, mirroring app/schemas.py (which the client does not import: DAGs and jobs
+# should not need the service's dependencies). Unknown fields are ignored, so that an older
+# client keeps working against a newer service.
+
+RuleType = Literal["include", "exclude", "override_policy", "override_hold"]
+
+
+class Connection(BaseModel):
+    id: int
+    name: str
+    driver: Optional[str] = None
+    jdbc_url: Optional[str] = None
+
+
+class Warehouse(BaseModel):
+    id: int
+    name: str
+    s3_uri: str
+
+
+class Policy(BaseModel):
+    id: int
+    name: str
+    retention_value: str
+    retention_duration: Optional[str] = None
+    rules_json: Optional[str] = None
+
+
+class Source(BaseModel):
+    id: int
+    name: str
+    env: str
+    connection_id: int
+    warehouse_id: int
+    default_policy_id: int
+    legal_hold_default: bool
+
+
+class Rule(BaseModel):
+    id: int
+    source_id: int
+    type: RuleType
+    schema: str
+    table: Optional[str] = None
+    policy_id: Optional[int] = None
+    legal_hold: Optional[bool] = None
+
+
+class ExportEntry(BaseModel):
+    # A schema (with its tables) or a table; pattern entries are globs to expand
+    name: str
+    pattern: bool = False
+    tables: List["ExportEntry"] = []
+
+
+class ExportBlock(BaseModel):
+    schemas: List[ExportEntry] = []
+
+
+class Export(BaseModel):
+    id: str
+    env: str
+    connection: Optional[str] = None
+    warehouse: Optional[str] = None
+    default_policy: Optional[str] = None
+    legal_hold_default: bool
+    include: ExportBlock
+    exclude: ExportBlock
+
+
+class EffectivePolicyPolicy(BaseModel):
+    id: int
+    name: str
+    retention_value: str
+    retention: Optional[str] = None
+    has_rules: bool
+    rules_json: Optional[str] = None
+    rules: Any = None
+
+
+class EffectivePolicy(BaseModel):
+    source_id: int
+    source_name: str
+    schema: str
+    table: str
+    scope: str
+    policy: EffectivePolicyPolicy
+    legal_hold: bool
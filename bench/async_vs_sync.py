@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+from . import datagen, drivers
+from .httpload import run_load
+from .run import scenarios
+
+# Compares the sync (threadpool) and async (ASYNC_DB=1) request paths under concurrency:
+#   python -m bench.async_vs_sync --concurrency 200 --duration 20
+# Each mode gets a fresh uvicorn process on the same generated SQLite database and a mixed
+# read load (export, effective policy, list rules); results are printed as JSON.
+
+
+def mixed(fixture: datagen.Fixture):
+    reads = [v for k, v in scenarios(fixture).items() if k != "add_rule"]
+    return lambda i: reads[i % len(reads)](i // len(reads))
+
+
+def run_mode(url: str, async_db: bool, args) -> dict:
+    next_request = mixed(datagen.fixture_from(args))
+    with drivers.uvicorn({"DATABASE_URL": url, "ASYNC_DB": "1" if async_db else "0"}) as target:
+        asyncio.run(run_load(target.make_client, next_request, args.concurrency, args.warmup))
+        return asyncio.run(run_load(target.make_client, next_request, args.concurrency, args.duration))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.async_vs_sync")
+    datagen.add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--out", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        os.environ["DATABASE_URL"] = url
+        engine = create_engine(url)
+        datagen.generate(engine, datagen.fixture_from(args))
+        engine.dispose()
+        results = {
+            "config": {k: v for k, v in vars(args).items() if k != "out"},
+            "sync": run_mode(url, False, args),
+            "async": run_mode(url, True, args),
+        }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from urllib.error import HTTPError
+
+from . import drivers
+
+# Read-your-writes across workers:
+#   python -m bench.coherence --workers 4 --rounds 200
+# Starts N single-worker uvicorn processes on one SQLite database (a temporary one, or
+# DATABASE_URL), warms every worker's caches, then repeatedly writes through one worker and at
+# once reads the affected export, effective policy and batch result from every worker. A read
+# that does not reflect the write is a violation; prints JSON and exits 1 if there were any.
+
+TABLE = ("coherence", "probe")
+
+
+class Worker:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.latencies: list[float] = []
+
+    def call(self, method: str, path: str, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method, headers={"Content-Type": "application/json"}
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                payload = response.read()
+        except HTTPError as e:
+            raise RuntimeError(f"{method} {path}: {e.code} {e.read()[:200]!r}")
+        self.latencies.append(time.perf_counter() - started)
+        return payload
+
+
+def _fixture(worker: Worker, suffix: str) -> dict:
+    def create(path, body):
+        return json.loads(worker.call("POST", path, body))
+
+    policy = create("/v1/policies", {"name": f"coherence-{suffix}", "retention_value": "1d"})
+    source = create("/v1/sources", {
+        "name": f"coherence-{suffix}",
+        "connection_id": create("/v1/connections", {"name": f"coherence-{suffix}"})["id"],
+        "warehouse_id": create("/v1/warehouses", {"name": f"coherence-{suffix}", "s3_uri": "s3://coherence"})["id"],
+        "default_policy_id": policy["id"],
+    })
+    return {"source": source["id"], "policy": policy["id"]}
+
+
+def _observe(worker: Worker, source_id: int, full: bool) -> tuple:
+    # (legal_hold, retention) as seen by the batch, and with `full` the effective policy and the
+    # export too. Only some rounds read the export: an export read replaces the cache entry the
+    # batch would otherwise reuse, which would hide a stale batch.
+    schema, table = TABLE
+    batch = worker.call("POST", f"/v1/sources/{source_id}/policy:effective:batch", [[schema, table]])
+    batch = json.loads(batch.splitlines()[0])
+    holds, retentions = [batch["legal_hold"]], [batch["policy"]["retention_value"]]
+    if full:
+        effective = worker.call("GET", f"/v1/sources/{source_id}/policy:effective?schema={schema}&table={table}")
+        effective = json.loads(effective)
+        export = json.loads(worker.call("GET", f"/v1/sources/{source_id}:export"))
+        holds += [effective["legal_hold"], export["legal_hold_default"]]
+        retentions.append(effective["policy"]["retention_value"])
+    return holds, retentions
+
+
+def run(workers: list[Worker], rounds: int) -> dict:
+    ids = _fixture(workers[0], str(int(time.time() * 1000)))
+    for w in workers:
+        _observe(w, ids["source"], True)
+    violations = []
+    reads = 0
+    hold, retention = False, "1d"
+    for n in range(rounds):
+        writer = workers[n % len(workers)]
+        # Alternate between a source write and a write to the policy it uses
+        if n % 2 == 0:
+            hold = not hold
+            writer.call("PATCH", f"/v1/sources/{ids['source']}", {"legal_hold_default": hold})
+        else:
+            retention = f"{n + 1}d"
+            writer.call("PATCH", f"/v1/policies/{ids['policy']}", {"retention_value": retention})
+        for i, w in enumerate(workers):
+            holds, retentions = _observe(w, ids["source"], full=n % 4 < 2)
+            reads += len(holds)
+            if any(h != hold for h in holds) or any(r != retention for r in retentions):
+                violations.append({"round": n, "worker": i, "holds": holds, "retentions": retentions})
+    latencies = sorted(x for w in workers for x in w.latencies)
+    return {
+        "workers": len(workers),
+        "rounds": rounds,
+        "reads": reads,
+        "violations": len(violations),
+        "first_violations": violations[:5],
+        "latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p99": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.coherence")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--coherence", choices=["revision", "notify"], default="revision")
+    parser.add_argument("--async-db", action="store_true")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.ExitStack() as stack:
+        env = {
+            "DATABASE_URL": os.environ.get("DATABASE_URL") or f"sqlite:///{tmp}/coherence.db",
+            "CACHE_COHERENCE": args.coherence,
+            "ASYNC_DB": "1" if args.async_db else "0",
+            # The first worker creates the schema before the others start
+            "MIGRATE_ON_STARTUP": "1",
+        }
+        workers = []
+        for _ in range(args.workers):
+            target = stack.enter_context(drivers.uvicorn(env))
+            workers.append(Worker(target.base_url))
+        results = run(workers, args.rounds)
+    print(json.dumps(results, indent=2))
+    return 1 if results["violations"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
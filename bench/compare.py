@@ -0,0 +1,48 @@
+import argparse
+import json
+import sys
+
+# Compares two bench.run result files and exits non-zero on a regression:
+#   python -m bench.compare baseline.json results.json --threshold 0.15
+
+
+def regressions(baseline: dict, current: dict, threshold: float):
+    # Yields (driver, scenario, metric, before, after, regressed) for scenarios present in both
+    for driver, scenarios in current["results"].items():
+        for scenario, now in scenarios.items():
+            before = baseline["results"].get(driver, {}).get(scenario)
+            if before is None:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                yield driver, scenario, metric, before[metric], now[metric], now[metric] > before[metric] * (1 + threshold)
+            yield (driver, scenario, "throughput_rps", before["throughput_rps"], now["throughput_rps"],
+                   now["throughput_rps"] < before["throughput_rps"] * (1 - threshold))
+            if now["errors"] > before["errors"]:
+                yield driver, scenario, "errors", before["errors"], now["errors"], True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.compare")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative change (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline["config"] != current["config"]:
+        print("warning: runs used different configurations", file=sys.stderr)
+
+    failed = 0
+    for driver, scenario, metric, before, after, regressed in regressions(baseline, current, args.threshold):
+        change = (after - before) / before * 100 if before else 0.0
+        flag = "REGRESSION" if regressed else ""
+        print(f"{driver:10} {scenario:22} {metric:15} {before:>10} -> {after:>10} ({change:+6.1f}%) {flag}")
+        failed += regressed
+    print("ok" if not failed else f"{failed} regression(s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+# Deterministic synthetic fixtures for benchmarks, written with executemany bulk inserts:
+#   python -m bench.datagen --url sqlite:////tmp/bench.db --sources 1000 --rules-per-source 200
+# The same arguments always produce the same rows. The target database must be empty.
+# The app is imported lazily: its engines are configured from the environment at import time.
+
+INSERT_BATCH = 10_000
+
+# Share of each rule type in the generated rules
+RULE_MIX = {"include": 0.4, "exclude": 0.2, "override_policy": 0.25, "override_hold": 0.15}
+# Share of rules that apply to a whole schema rather than one table
+SCHEMA_WIDE = 0.05
+
+
+class Fixture(NamedTuple):
+    sources: int
+    rules_per_source: int
+    policies: int
+    seed: int
+
+    def schemas(self) -> int:
+        return max(1, self.rules_per_source // 40)
+
+    def tables(self) -> int:
+        # Tables per schema; leaves room for tables without any rule
+        return max(1, self.rules_per_source * 2 // self.schemas())
+
+    def table(self, rnd: random.Random) -> tuple[str, str]:
+        # A table name from the generated namespace (it may or may not have rules)
+        return f"schema_{rnd.randrange(self.schemas())}", f"table_{rnd.randrange(self.tables())}"
+
+
+def _rules(fixture: Fixture, source_id: int):
+    rnd = random.Random(fixture.seed * 1_000_003 + source_id)
+    types = list(RULE_MIX)
+    weights = list(RULE_MIX.values())
+    for _ in range(fixture.rules_per_source):
+        type = rnd.choices(types, weights)[0]
+        schema, table = fixture.table(rnd)
+        if rnd.random() < SCHEMA_WIDE:
+            table = None
+        yield {
+            "source_id": source_id,
+            "type": type,
+            "schema": schema,
+            "table": table,
+            "policy_id": rnd.randint(1, fixture.policies) if type == "override_policy" else None,
+            "legal_hold": rnd.random() < 0.5 if type == "override_hold" else None,
+        }
+
+
+def _insert(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def generate(engine: Engine, fixture: Fixture) -> dict:
+    # Creates the schema, then inserts connections, warehouses, policies, sources, rules and
+    # config revisions; returns row counts and timing
+    from app import migrations, models, policies
+    from app.database import Base
+
+    started = time.perf_counter()
+    Base.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    rnd = random.Random(fixture.seed)
+    now = datetime.now(timezone.utc)
+    n_shared = max(1, fixture.sources // 100)
+    with engine.begin() as conn:
+        _insert(conn, models.Connection.__table__, (
+            {"id": i, "name": f"bench_conn_{i}", "driver": "postgres",
+             "jdbc_url": f"jdbc:postgresql://db{i}:5432/bench"}
+            for i in range(1, n_shared + 1)
+        ))
+        _insert(conn, models.Warehouse.__table__, (
+            {"id": i, "name": f"bench_wh_{i}", "s3_uri": f"s3://bench-archive-{i}"}
+            for i in range(1, n_shared + 1)
+        ))
+        _insert(conn, models.Policy.__table__, (
+            policies.normalized({"id": i, "name": f"bench_policy_{i}", "retention_value": f"{rnd.randint(1, 36)}m",
+                                 "rules_json": '{"tier": "cold"}' if i % 3 == 0 else None})
+            for i in range(1, fixture.policies + 1)
+        ))
+        _insert(conn, models.Source.__table__, (
+            {"id": s, "name": f"bench_source_{s}", "env": rnd.choice(("dev", "test", "prod")),
+             "connection_id": rnd.randint(1, n_shared), "warehouse_id": rnd.randint(1, n_shared),
+             "default_policy_id": rnd.randint(1, fixture.policies), "legal_hold_default": rnd.random() < 0.1}
+            for s in range(1, fixture.sources + 1)
+        ))
+        _insert(conn, models.Rule.__table__, (
+            rule for s in range(1, fixture.sources + 1) for rule in _rules(fixture, s)
+        ))
+        _insert(conn, models.ConfigRevision.__table__, (
+            {"source_id": s, "revision": 1, "updated_at": now} for s in range(1, fixture.sources + 1)
+        ))
+    return {
+        "connections": n_shared,
+        "warehouses": n_shared,
+        "policies": fixture.policies,
+        "sources": fixture.sources,
+        "rules": fixture.sources * fixture.rules_per_source,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--rules-per-source", type=int, default=100)
+    parser.add_argument("--policies", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def fixture_from(args) -> Fixture:
+    return Fixture(args.sources, args.rules_per_source, args.policies, args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.datagen")
+    parser.add_argument("--url", required=True, help="SQLAlchemy URL of an empty database")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    engine = create_engine(args.url)
+    print(generate(engine, fixture_from(args)))
+    engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
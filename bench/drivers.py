@@ -0,0 +1,68 @@
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Callable, NamedTuple
+from urllib.parse import urlsplit
+
+from .httpload import AsgiClient, Connection
+
+# Ways of running the service under load. Each driver is a context manager yielding a Target:
+# a client factory for httpload.run_load, and an async context manager to enter on the event
+# loop the load runs on.
+
+
+class Target(NamedTuple):
+    make_client: Callable
+    lifespan: Callable
+    base_url: str | None = None
+
+
+@contextlib.contextmanager
+def in_process():
+    # Imports the app in this process; DATABASE_URL and the other settings are read from the
+    # environment at import time, so set them before entering. The app's startup and shutdown
+    # handlers run in Target.lifespan.
+    from app.main import app
+    yield Target(lambda: AsgiClient(app), lambda: app.router.lifespan_context(app))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            urllib.request.urlopen(f"{base_url}/openapi.json", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("uvicorn did not start")
+
+
+@contextlib.contextmanager
+def uvicorn(env: dict | None = None, workers: int = 1):
+    # A local uvicorn process on a free port; `env` is layered over this process's environment
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "MIGRATE_ON_STARTUP": "0", **(env or {})},
+    )
+    try:
+        _wait_ready(base_url, server)
+        url = urlsplit(base_url)
+        yield Target(lambda: Connection(url.hostname, url.port), contextlib.nullcontext, base_url)
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+# Closed-loop load generator: `concurrency` clients each send their next request as soon as the
+# previous one completes. Clients are either a minimal keep-alive HTTP/1.1 connection on asyncio
+# streams or an in-process ASGI caller, so benchmarks need nothing beyond the service's own
+# requirements.
+
+
+class Connection:
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict | None = None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        for k, v in (headers or {}).items():
+            head += f"{k}: {v}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("server closed the connection")
+        status = int(status_line.split()[1])
+        length, chunked, close = None, False, False
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding" and "chunked" in value:
+                chunked = True
+            elif name == "connection" and value == "close":
+                close = True
+        if chunked:
+            payload = bytearray()
+            while size := int((await self.reader.readline()).split(b";")[0], 16):
+                payload += await self.reader.readexactly(size)
+                await self.reader.readline()
+            await self.reader.readline()
+        elif length is not None:
+            payload = await self.reader.readexactly(length)
+        else:
+            payload = b""
+        if close:
+            self.close()
+        return status, bytes(payload)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class AsgiClient:
+    # Calls the ASGI app directly: no sockets, no server, same request/response cycle
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict | None = None):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench"), (b"content-length", str(len(body)).encode())]
+            + [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        status, payload = 0, bytearray()
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            # Like a server with a connected client: nothing more until the response is done
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                payload.extend(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, bytes(payload)
+
+    def close(self):
+        pass
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+async def run_load(make_client, next_request, concurrency: int, duration: float) -> dict:
+    # `next_request(i)` returns (method, path, body, headers) for the i-th request
+    deadline = time.perf_counter() + duration
+    latencies: list[float] = []
+    errors = 0
+
+    async def client(n):
+        nonlocal errors
+        conn = make_client()
+        i = n
+        while time.perf_counter() < deadline:
+            method, path, body, headers = next_request(i)
+            i += concurrency
+            start = time.perf_counter()
+            try:
+                status, _ = await conn.request(method, path, body, headers)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                errors += 1
+                continue
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        conn.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
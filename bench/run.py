@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+
+from . import datagen, drivers
+from .httpload import run_load
+
+# Benchmark suite: generates a fixture, then measures each scenario in-process and/or through a
+# local uvicorn, and writes the results as JSON for bench.compare:
+#   python -m bench.run --sources 1000 --rules-per-source 200 --out results.json
+
+REQUESTS_PER_SCENARIO = 10_000
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def scenarios(fixture: datagen.Fixture) -> dict:
+    # Deterministic request sequences per scenario, cycled by the load generator
+    rnd = random.Random(fixture.seed)
+
+    def source_id():
+        return rnd.randint(1, fixture.sources)
+
+    def effective():
+        schema, table = fixture.table(rnd)
+        return "GET", f"/v1/sources/{source_id()}/policy:effective?schema={schema}&table={table}", b"", None
+
+    def add_rule(n):
+        body = {"type": "exclude", "schema": "bench_writes", "table": f"table_{n}"}
+        return "POST", f"/v1/sources/{source_id()}/rules", json.dumps(body).encode(), JSON_HEADERS
+
+    sequences = {
+        "export_source_config": [
+            ("GET", f"/v1/sources/{source_id()}:export", b"", None) for _ in range(REQUESTS_PER_SCENARIO)
+        ],
+        "effective_policy": [effective() for _ in range(REQUESTS_PER_SCENARIO)],
+        "list_rules": [
+            ("GET", f"/v1/sources/{source_id()}/rules?limit=100", b"", None) for _ in range(REQUESTS_PER_SCENARIO)
+        ],
+        # Writes last: they invalidate cached sources
+        "add_rule": [add_rule(n) for n in range(REQUESTS_PER_SCENARIO)],
+    }
+    return {name: (lambda i, s=seq: s[i % len(s)]) for name, seq in sequences.items()}
+
+
+async def run_scenarios(target: drivers.Target, selected: dict, args) -> dict:
+    # One event loop for all scenarios: async engines keep connections bound to their loop
+    results = {}
+    async with target.lifespan():
+        for name, next_request in selected.items():
+            if args.warmup:
+                await run_load(target.make_client, next_request, args.concurrency, args.warmup)
+            results[name] = await run_load(target.make_client, next_request, args.concurrency, args.duration)
+            print(f"  {name}: {results[name]}", file=sys.stderr)
+    return results
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    datagen.add_arguments(parser)
+    parser.add_argument("--driver", choices=["inprocess", "uvicorn", "all"], default="all")
+    parser.add_argument("--scenario", action="append", help="Run only these scenarios (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds measured per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of unmeasured load per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--database-url", help="Empty database to generate into (default: a temporary SQLite file)")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    fixture = datagen.fixture_from(args)
+    all_scenarios = scenarios(fixture)
+    unknown = set(args.scenario or ()) - set(all_scenarios)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}; choose from {', '.join(all_scenarios)}")
+    selected = {k: v for k, v in all_scenarios.items() if not args.scenario or k in args.scenario}
+    drivers_to_run = ["inprocess", "uvicorn"] if args.driver == "all" else [args.driver]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{tmp}/bench.db"
+        # Before anything imports the app, which reads its settings at import time
+        os.environ["DATABASE_URL"] = url
+        os.environ.pop("DATABASE_READ_URL", None)
+        engine = create_engine(url)
+        generated = datagen.generate(engine, fixture)
+        engine.dispose()
+        print(f"generated {generated}", file=sys.stderr)
+
+        results = {}
+        for name in drivers_to_run:
+            # Each driver starts from the generated data: writes of the previous one are removed
+            with create_engine(url).begin() as conn:
+                conn.exec_driver_sql("DELETE FROM rules WHERE schema = 'bench_writes'")
+            print(name, file=sys.stderr)
+            if name == "inprocess":
+                driver = drivers.in_process()
+            else:
+                driver = drivers.uvicorn({"DATABASE_URL": url}, workers=args.workers)
+            with driver as target:
+                results[name] = asyncio.run(run_scenarios(target, selected, args))
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": url.split("://")[0],
+            "async_db": os.getenv("ASYNC_DB", "0") == "1",
+        },
+        "config": {
+            "fixture": fixture._asdict(),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "workers": args.workers,
+        },
+        "generated": generated,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The app reads its settings at import: point it at a scratch database, snapshot and profile
+# directory, and fail any request that goes over its query budget
+_scratch = tempfile.mkdtemp(prefix="archive-config-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_scratch, 'test.db')}")
+os.environ.setdefault("SNAPSHOT_DIR", os.path.join(_scratch, "snapshots"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_scratch, "profiles"))
+os.environ.setdefault("QUERY_BUDGET_MODE", "raise")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
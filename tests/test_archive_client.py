@@ -0,0 +1,155 @@
+import itertools
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from archive_client import Client, NotFound, Unavailable
+from archive_client import client as client_module
+from app.main import app
+
+_names = itertools.count()
+
+
+@pytest.fixture(scope="module")
+def service():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def sent():
+    # The service's response to each request the client sends
+    return []
+
+
+@pytest.fixture
+def client(service, sent, tmp_path):
+    # Its own test client (the app is already started), so that setup requests are not recorded
+    http = TestClient(app)
+    http.event_hooks = {"request": [], "response": [sent.append]}
+    return Client(http=http, cache_dir=str(tmp_path))
+
+
+def down(tmp_path, offline: str, calls: list | None = None) -> Client:
+    # A client sharing the cache directory, for a service that cannot be reached
+    def refuse(request):
+        if calls is not None:
+            calls.append(request)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    http = httpx.Client(base_url="http://testserver", transport=httpx.MockTransport(refuse))
+    return Client(http=http, cache_dir=str(tmp_path), offline=offline)
+
+
+def make_source(service, rules: int = 0) -> int:
+    n = next(_names)
+    conn = service.post("/v1/connections", json={"name": f"client-conn{n}"}).json()
+    wh = service.post("/v1/warehouses", json={"name": f"client-wh{n}", "s3_uri": "s3://bucket"}).json()
+    pol = service.post("/v1/policies", json={"name": f"client-p{n}", "retention_value": "6m"}).json()
+    src = service.post("/v1/sources", json={
+        "name": f"client-src{n}", "connection_id": conn["id"], "warehouse_id": wh["id"],
+        "default_policy_id": pol["id"],
+    }).json()
+    if rules:
+        rows = [{"type": "include", "schema": "sales", "table": f"t{i:04}"} for i in range(rules)]
+        r = service.post(f"/v1/sources/{src['id']}/rules:bulk", json=rows)
+        assert r.status_code == 200, r.text
+    return src["id"]
+
+
+def test_revalidates_with_etag(service, client, sent):
+    sid = make_source(service)
+    export = client.export(sid)
+    assert client.export(sid) == export
+    assert [(r.status_code, r.request.headers.get("if-none-match")) for r in sent] == [
+        (200, None), (304, sent[0].headers["etag"]),
+    ]
+
+    service.patch(f"/v1/sources/{sid}", json={"legal_hold_default": True})
+    sent.clear()
+    assert client.export(sid).legal_hold_default
+    assert [r.status_code for r in sent] == [200]
+
+
+def test_follows_pagination_cursor(service, client, sent):
+    sid = make_source(service, rules=1005)
+    rules = list(client.rules(sid))
+    assert [r.table for r in rules] == [f"t{i:04}" for i in range(1005)]
+    assert [r.request.url.params.get("cursor") for r in sent] == [None, sent[0].headers["x-next-cursor"]]
+    # Unpaginated without a limit
+    everything = service.get(f"/v1/sources/{sid}/rules")
+    assert len(everything.json()) == 1005 and "link" not in everything.headers
+
+
+def test_batches_lookups_per_source(service, client, sent, monkeypatch):
+    a, b = make_source(service), make_source(service)
+    lookups = [(a, "sales", "orders"), (a, "sales", "refunds"), (b, "hr", "staff"), (a, "sales", "orders")]
+    found = client.effective_policies(lookups)
+    assert [(r.request.method, r.request.url.path) for r in sent] == [
+        ("POST", f"/v1/sources/{a}/policy:effective:batch"),
+        ("POST", f"/v1/sources/{b}/policy:effective:batch"),
+    ]
+    assert set(found) == set(lookups)
+    assert found[a, "sales", "orders"] == client.effective_policy(a, "sales", "orders")
+
+    monkeypatch.setattr(client_module, "BATCH_SIZE", 1)
+    sent.clear()
+    assert client.effective_policies(lookups) == found
+    assert len(sent) == 3
+
+    with pytest.raises(NotFound):
+        client.effective_policies([(999999, "sales", "orders")])
+
+
+def test_not_found_evicts_cached_response(service, client, tmp_path):
+    sid = make_source(service)
+    client.export(sid)
+    assert service.delete(f"/v1/sources/{sid}").status_code == 204
+    with pytest.raises(NotFound):
+        client.export(sid)
+    # Not served offline either
+    with pytest.raises(Unavailable):
+        down(tmp_path, "fallback").export(sid)
+
+
+def test_offline_fallback(service, client, tmp_path):
+    sid = make_source(service)
+    export = client.export(sid)
+    tables = [(sid, "sales", f"t{i}") for i in range(5)]
+    found = client.effective_policies(tables)
+    single = client.effective_policy(sid, "hr", "staff")
+
+    offline = down(tmp_path, "fallback")
+    assert offline.export(sid) == export
+    # Any subset of the tables cached by earlier batches or single lookups
+    subset = [tables[3], tables[1], (sid, "hr", "staff")]
+    assert offline.effective_policies(subset) == {**{t: found[t] for t in tables[3:0:-2]}, subset[2]: single}
+    with pytest.raises(Unavailable):
+        offline.effective_policies([tables[0], (sid, "sales", "uncached")])
+    with pytest.raises(Unavailable):
+        offline.export(999999)
+
+
+def test_offline_never(service, client, tmp_path):
+    sid = make_source(service)
+    client.export(sid)
+    client.effective_policies([(sid, "sales", "orders")])
+    offline = down(tmp_path, "never")
+    with pytest.raises(Unavailable):
+        offline.export(sid)
+    with pytest.raises(Unavailable):
+        offline.effective_policies([(sid, "sales", "orders")])
+
+
+def test_offline_always(service, client, tmp_path):
+    sid = make_source(service)
+    export = client.export(sid)
+    found = client.effective_policies([(sid, "sales", "orders")])
+    calls = []
+    offline = down(tmp_path, "always", calls)
+    assert offline.export(sid) == export
+    assert offline.effective_policies([(sid, "sales", "orders")]) == found
+    with pytest.raises(Unavailable):
+        offline.export(999999)
+    assert calls == []
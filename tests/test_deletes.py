@@ -0,0 +1,61 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+def test_rows_named_by_a_plan_are_kept_until_it_is_deleted(client):
+    conn = client.post("/v1/connections", json={"name": "delete-conn"}).json()
+    wh = client.post("/v1/warehouses", json={"name": "delete-wh", "s3_uri": "s3://bucket"}).json()
+    pol = client.post("/v1/policies", json={"name": "delete-p", "retention_value": "6m"}).json()
+    src = client.post("/v1/sources", json={
+        "name": "delete-src", "connection_id": conn["id"], "warehouse_id": wh["id"], "default_policy_id": pol["id"],
+    }).json()
+    plan = client.post("/v1/plans:build", json={"source_id": src["id"], "tables": [{"schema": "s", "table": "t"}]})
+    assert plan.status_code == 200, plan.text
+
+    # The source's own default policy would hold it too: point the source elsewhere first
+    other = client.post("/v1/policies", json={"name": "delete-p2", "retention_value": "1y"}).json()
+    assert client.patch(f"/v1/sources/{src['id']}", json={"default_policy_id": other["id"]}).status_code == 200
+    for path, detail in (
+        (f"/v1/policies/{pol['id']}", "Policy in use by sources, rules or plans"),
+        (f"/v1/sources/{src['id']}", "Source has rules or plans; delete them first"),
+    ):
+        r = client.delete(path)
+        assert (r.status_code, r.json()["detail"]) == (400, detail), path
+
+    assert client.delete(f"/v1/plans/{plan.json()['id']}").status_code == 204
+    assert client.delete(f"/v1/plans/{plan.json()['id']}").status_code == 404
+    assert client.delete(f"/v1/policies/{pol['id']}").status_code == 204
+    assert client.delete(f"/v1/sources/{src['id']}").status_code == 204
+
+
+def test_connection_and_warehouse_named_by_a_plan(client):
+    conn = client.post("/v1/connections", json={"name": "delete-conn2"}).json()
+    wh = client.post("/v1/warehouses", json={"name": "delete-wh2", "s3_uri": "s3://bucket"}).json()
+    pol = client.post("/v1/policies", json={"name": "delete-p3", "retention_value": "6m"}).json()
+    src = client.post("/v1/sources", json={
+        "name": "delete-src2", "connection_id": conn["id"], "warehouse_id": wh["id"], "default_policy_id": pol["id"],
+    }).json()
+    plan = client.post("/v1/plans:build", json={"source_id": src["id"], "tables": [{"schema": "s", "table": "t"}]})
+    # Move the source off them: only the plan's items still name them
+    conn2 = client.post("/v1/connections", json={"name": "delete-conn3"}).json()
+    wh2 = client.post("/v1/warehouses", json={"name": "delete-wh3", "s3_uri": "s3://bucket"}).json()
+    r = client.patch(f"/v1/sources/{src['id']}", json={"connection_id": conn2["id"], "warehouse_id": wh2["id"]})
+    assert r.status_code == 200, r.text
+    for path, detail in (
+        (f"/v1/connections/{conn['id']}", "Connection in use by sources or plans"),
+        (f"/v1/warehouses/{wh['id']}", "Warehouse in use by sources or plans"),
+    ):
+        r = client.delete(path)
+        assert (r.status_code, r.json()["detail"]) == (400, detail), path
+
+    assert client.delete(f"/v1/plans/{plan.json()['id']}").status_code == 204
+    assert client.delete(f"/v1/connections/{conn['id']}").status_code == 204
+    assert client.delete(f"/v1/warehouses/{wh['id']}").status_code == 204
@@ -0,0 +1,10 @@
+from app import migrations, models  # noqa: F401  (models registers the tables init_db creates)
+from app.database import Base, engine, init_db
+
+
+def test_hot_queries_use_their_indexes():
+    # `python -m app.migrations check`, against the test database
+    init_db(Base, migrate=True)
+    with engine.connect() as conn:
+        assert migrations.applied_versions(conn) >= {m.version for m in migrations.MIGRATIONS}
+    assert migrations.check(engine) == []
@@ -0,0 +1,170 @@
+import json
+
+import anyio
+import pytest
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from starlette import concurrency, responses
+
+from app import metrics, profiling, query_budget, snapshot
+from app.database import SessionLocal
+from app.main import app
+
+# Runs under QUERY_BUDGET_MODE=raise (see conftest.py): a request over its route's budget, with a
+# repeated statement shape (N+1), or to a route without a budget fails with QueryBudgetExceeded
+
+SOURCES = 6
+RULES = 40
+
+ROUTES = {(method, r.path) for r in app.routes if isinstance(r, APIRoute) for method in r.methods}
+
+
+@pytest.fixture(scope="module")
+def hits():
+    return set()
+
+
+@pytest.fixture(scope="module")
+def client(hits):
+    async def recording(scope, receive, send):
+        # The router stores the matched route in the scope
+        try:
+            await app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            if isinstance(route, APIRoute):
+                hits.add((scope["method"], route.path))
+
+    with TestClient(recording) as c:
+        yield c
+
+
+def ok(r, status=200):
+    assert r.status_code == status, (r.status_code, r.text)
+    return r.json() if r.headers.get("content-type") == "application/json" else r
+
+
+def first_event(client, path: str) -> bytes:
+    # The stream never ends: the client disconnects once the first event has arrived
+    async def run():
+        received = anyio.Event()
+        body = []
+
+        async def receive():
+            await received.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                body.append(message["body"])
+                received.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+            "client": ("testclient", 50000), "server": ("testserver", 80),
+        }
+        await client.app(scope, receive, send)
+        return b"".join(body)
+
+    return client.portal.call(run)
+
+
+def test_every_route_declares_a_budget():
+    undeclared = [r.path for r in app.routes if isinstance(r, APIRoute) and not hasattr(r.endpoint, "__query_budget__")]
+    assert undeclared == []
+
+
+def test_routes_stay_within_budget(client, hits):
+    assert query_budget.QUERY_BUDGET_MODE == "raise"
+
+    # Enough sources, rules and tables that an N+1 pattern crosses QUERY_REPEAT_THRESHOLD
+    conn = ok(client.post("/v1/connections", json={"name": "conn"}))
+    wh = ok(client.post("/v1/warehouses", json={"name": "wh", "s3_uri": "s3://bucket"}))
+    pols = [
+        ok(client.post("/v1/policies", json={"name": f"p{i}", "retention_value": "6m", "rules_json": '{"a": 1}'}))
+        for i in range(3)
+    ]
+    sources = [
+        ok(client.post("/v1/sources", json={
+            "name": f"src{i}", "connection_id": conn["id"], "warehouse_id": wh["id"],
+            "default_policy_id": pols[0]["id"],
+        }))
+        for i in range(SOURCES)
+    ]
+    sid = sources[0]["id"]
+    rule = ok(client.post(f"/v1/sources/{sid}/rules", json={"type": "include", "schema": "sales"}))
+    rows = [
+        {"type": "override_policy", "schema": "sales", "table": f"t{i:03}", "policy_id": pols[1 + i % 2]["id"]}
+        for i in range(RULES)
+    ]
+    result = ok(client.post(f"/v1/sources/{sid}/rules:bulk", params={"mode": "upsert"}, json=rows))
+    assert result["inserted"] == RULES
+
+    # Reads
+    for kind, obj in (("connections", conn), ("warehouses", wh), ("policies", pols[0]), ("sources", sources[0])):
+        ok(client.get(f"/v1/{kind}"))
+        ok(client.get(f"/v1/{kind}/{obj['id']}"))
+    assert len(ok(client.get(f"/v1/sources/{sid}/rules"))) == RULES + 1
+    ok(client.get(f"/v1/sources/{sid}/rules/{rule['id']}"))
+    ok(client.get(f"/v1/sources/{sid}:export"))
+    assert len(ok(client.get("/v1/sources:export")).text.splitlines()) >= SOURCES
+    ok(client.get(f"/v1/sources/{sid}:diff", params={"from": 1}))
+    effective = ok(client.get(f"/v1/sources/{sid}/policy:effective", params={"schema": "sales", "table": "t001"}))
+    assert (effective["policy"]["rules_json"], effective["policy"]["rules"]) == ('{"a":1}', {"a": 1})
+    tables = [{"schema": "sales", "table": f"t{i:03}"} for i in range(RULES + 10)]
+    batch = ok(client.post(f"/v1/sources/{sid}/policy:effective:batch", json=tables))
+    assert len(batch.text.splitlines()) == len(tables)
+
+    # Plans
+    plan = ok(client.post("/v1/plans:build", json={"source_id": sid, "tables": tables}))
+    base = ok(client.post("/v1/plans:build", json={"source_id": sid, "tables": tables[:RULES // 2]}))
+    ok(client.get(f"/v1/plans/{plan['id']}"))
+    assert len(ok(client.get(f"/v1/plans/{plan['id']}/items"))) == len(tables)
+    ok(client.get(f"/v1/plans/{plan['id']}:diff", params={"base": base["id"]}))
+    usage = ok(client.get(f"/v1/policies/{pols[1]['id']}/usage", params={"plan_id": plan["id"]}))
+    assert json.loads(usage.text.splitlines()[-1])
+
+    # Changes
+    feed = ok(client.get("/v1/changes"))
+    assert feed["changes"]
+    assert first_event(client, "/v1/changes:stream").startswith(b"id: 1\n")
+
+    # Snapshot
+    with SessionLocal() as db:
+        snapshot.build(db)
+    ok(client.get("/v1/snapshot"))
+    ok(client.get("/v1/snapshot/index"))
+    ok(client.get(f"/v1/snapshot/sources/{sid}"))
+
+    if metrics.METRICS_ENABLED:
+        ok(client.get("/metrics"))
+
+    # Admin routes, registered only with PROFILING=1
+    if profiling.PROFILING:
+        admin = {"X-Admin-Token": profiling.ADMIN_TOKEN}
+        pid = client.get(f"/v1/sources/{sid}", headers={**admin, "X-Profile": "1"}).headers["x-profile-id"]
+        assert ok(client.get("/v1/admin/profiles", headers=admin))[0]["id"] == pid
+        ok(client.get(f"/v1/admin/profiles/{pid}", headers=admin))
+        ok(client.get(f"/v1/admin/profiles/{pid}:collapsed", headers=admin))
+        # Streamed bodies are wrapped by the app, not by patching Starlette
+        assert responses.iterate_in_threadpool is concurrency.iterate_in_threadpool
+
+    # Writes
+    ok(client.patch(f"/v1/connections/{conn['id']}", json={"driver": "postgresql"}))
+    ok(client.patch(f"/v1/warehouses/{wh['id']}", json={"s3_uri": "s3://other"}))
+    ok(client.patch(f"/v1/policies/{pols[1]['id']}", json={"retention_value": "1y"}))
+    ok(client.patch(f"/v1/sources/{sid}", json={"legal_hold_default": True}))
+    ok(client.patch(f"/v1/sources/{sid}/rules/{rule['id']}", json={"legal_hold": True}))
+    ok(client.delete(f"/v1/sources/{sid}/rules/{rule['id']}"), 204)
+    ok(client.post(f"/v1/sources/{sid}/rules:bulk", params={"mode": "replace"}, json=[]))
+    for p in (plan, base):
+        ok(client.delete(f"/v1/plans/{p['id']}"), 204)
+    for source in sources:
+        ok(client.delete(f"/v1/sources/{source['id']}"), 204)
+    for p in pols:
+        ok(client.delete(f"/v1/policies/{p['id']}"), 204)
+    ok(client.delete(f"/v1/warehouses/{wh['id']}"), 204)
+    ok(client.delete(f"/v1/connections/{conn['id']}"), 204)
+
+    assert ROUTES - hits == set()
@@ -0,0 +1,20 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.seed import seed
+
+
+def test_seed_records_every_entity():
+    with TestClient(app) as client:
+        since = client.get("/v1/changes").json()["revision"]
+        seed()
+        feed = client.get("/v1/changes", params={"since": since}).json()
+        assert [(c["entity"], c["op"]) for c in feed["changes"]] == [
+            ("connection", "create"), ("warehouse", "create"), ("policy", "create"), ("source", "create"),
+            *[("rule", "create")] * 4,
+        ]
+        sid = feed["changes"][3]["id"]
+        # The history has every rule: the export as of the last revision matches the current one
+        current = client.get(f"/v1/sources/{sid}:export").json()
+        assert client.get(f"/v1/sources/{sid}:export", params={"as_of": feed["revision"]}).json() == current
+        assert len(current["include"]["schemas"][0]["tables"]) == 4
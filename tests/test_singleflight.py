@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from app import singleflight
+
+
+@pytest.fixture(autouse=True)
+def coalescing(monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLE_FLIGHT", True)
+
+
+def test_cancelled_leader_hands_over_to_a_follower():
+    group = singleflight.Group()
+    calls = []
+
+    async def compute():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(group.do_async(("test", 1), compute))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(group.do_async(("test", 1), compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(run()) == ["done"] * 3
+    # The cancelled leader's call, then one new leader's
+    assert calls == [0, 1]
+
+
+def test_leader_error_is_shared():
+    group = singleflight.Group()
+    calls = []
+
+    async def compute():
+        calls.append(len(calls))
+        await asyncio.sleep(0.02)
+        raise ValueError("boom")
+
+    async def run():
+        tasks = [asyncio.create_task(group.do_async(("test", 2), compute)) for _ in range(3)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert calls == [0]
@@ -0,0 +1,74 @@
+import gc
+import os
+import weakref
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import snapshot
+from app.database import SessionLocal
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+def build():
+    with SessionLocal() as db:
+        return snapshot.build(db)
+
+
+def make_source(client, name: str) -> int:
+    conn = client.post("/v1/connections", json={"name": f"{name}-conn"}).json()
+    wh = client.post("/v1/warehouses", json={"name": f"{name}-wh", "s3_uri": "s3://bucket"}).json()
+    pol = client.post("/v1/policies", json={"name": f"{name}-p", "retention_value": "6m"}).json()
+    return client.post("/v1/sources", json={
+        "name": f"{name}-src", "connection_id": conn["id"], "warehouse_id": wh["id"], "default_policy_id": pol["id"],
+    }).json()["id"]
+
+
+def test_new_snapshot_releases_the_old_one(client):
+    sid = make_source(client, "snapshot-a")
+    build()
+    assert client.get(f"/v1/snapshot/sources/{sid}").status_code == 200
+    old = weakref.ref(snapshot.current())
+    assert snapshot._member.cache_info().currsize
+
+    make_source(client, "snapshot-b")
+    build()
+    assert client.get(f"/v1/snapshot/sources/{sid}").status_code == 200
+    gc.collect()
+    assert old() is None
+
+
+def test_bundle_is_handed_to_a_server_with_pathsend(client):
+    make_source(client, "snapshot-c")
+    manifest = build()
+    messages = []
+
+    async def run():
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": "/v1/snapshot", "raw_path": b"/v1/snapshot", "root_path": "", "query_string": b"",
+            "headers": [(b"accept-encoding", b"gzip")], "client": ("testclient", 50000),
+            "server": ("testserver", 80), "extensions": {"http.response.pathsend": {}},
+        }
+        await client.app(scope, receive, send)
+
+    client.portal.call(run)
+    start, body = messages
+    assert start["status"] == 200
+    assert dict(start["headers"])[b"content-length"] == str(manifest["size"]).encode()
+    assert body == {
+        "type": "http.response.pathsend",
+        "path": os.path.abspath(os.path.join(snapshot.SNAPSHOT_DIR, manifest["bundle"])),
+    }